@@ -0,0 +1 @@
+"""Benchmarks for the story creator agent."""
@@ -0,0 +1,118 @@
+"""
+Simulate admission control under load, on a simulated clock.
+
+The scheduler reads time from the event loop, and SimulatedClockLoop (from
+tests/simulated_clock.py) moves its clock forward instead of sleeping, so an
+hour of traffic runs in about a second and gives the same result every time.
+
+The workload mixes one heavy tenant, who queues many whole-story
+generations at once, with light tenants who send a patch edit now and then.
+Each call holds for a fixed latency and reports a usage near its estimate.
+The same workload runs through the fair scheduler and through a single
+first-come-first-served queue, and the report has:
+
+- the admission wait of each kind of tenant;
+- the calls rejected because the queue was full;
+- the busiest minute after the first, to check that requests and tokens
+  stay within the limits. The buckets start full, so the first minute may
+  use a minute's worth on top of the limit.
+
+Run from the agent directory:
+
+    poetry run python -m benchmarks.admission
+    poetry run python -m benchmarks.admission --heavy-calls 300 --light-tenants 10 --queue-limit 50
+"""
+
+import argparse
+import asyncio
+import random
+import statistics
+from typing import Any, Dict, List
+
+from tests.simulated_clock import SimulatedClockLoop
+from translate_agent.admission import BULK, INTERACTIVE, QueueFullError, Scheduler
+
+
+async def simulate(args: argparse.Namespace, fair: bool) -> Dict[str, Any]:
+    """Run the workload through one scheduler and return the waits, rejections and busiest minute."""
+    scheduler = Scheduler(args.requests_per_minute, args.tokens_per_minute, args.queue_limit)
+    loop = asyncio.get_running_loop()
+    rng = random.Random(0)
+    waits: Dict[str, List[float]] = {"heavy": [], "light": []}
+    rejected = {"heavy": 0, "light": 0}
+    minutes: Dict[int, List[float]] = {}
+
+    async def call(kind: str, tenant: str, tokens: int, priority: int) -> None:
+        queued = loop.time()
+        try:
+            if fair:
+                await scheduler.acquire(tenant, tokens, priority)
+            else:
+                await scheduler.acquire("everyone", tokens, INTERACTIVE)
+        except QueueFullError:
+            rejected[kind] += 1
+            return
+        waits[kind].append(loop.time() - queued)
+        used = int(tokens * rng.uniform(0.8, 1.2))
+        minute = minutes.setdefault(int(loop.time() // 60), [0, 0])
+        minute[0] += 1
+        minute[1] += used
+        await asyncio.sleep(args.latency)
+        scheduler.settle(tokens, used)
+
+    async def heavy() -> None:
+        # Queues every generation at once, like a tenant scripting new stories
+        await asyncio.gather(*(call("heavy", "heavy", args.story_tokens, BULK) for _ in range(args.heavy_calls)))
+
+    async def light(tenant: int) -> None:
+        calls = []
+        for _ in range(args.light_calls):
+            await asyncio.sleep(rng.expovariate(1 / args.light_interval))
+            calls.append(asyncio.ensure_future(call("light", f"light-{tenant}", args.edit_tokens, INTERACTIVE)))
+        await asyncio.gather(*calls)
+
+    await asyncio.gather(heavy(), *(light(tenant) for tenant in range(args.light_tenants)))
+    return {
+        "waits": waits,
+        "rejected": rejected,
+        "busiest": max((minute for index, minute in minutes.items() if index > 0), key=lambda minute: minute[1]),
+        "duration": loop.time(),
+    }
+
+
+def main():
+    """Run the workload fair and first-come-first-served, and print the report."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests-per-minute", type=float, default=60)
+    parser.add_argument("--tokens-per-minute", type=float, default=150000)
+    parser.add_argument("--queue-limit", type=int, default=100)
+    parser.add_argument("--heavy-calls", type=int, default=80, help="whole-story generations queued at once")
+    parser.add_argument("--story-tokens", type=int, default=6000)
+    parser.add_argument("--light-tenants", type=int, default=5)
+    parser.add_argument("--light-calls", type=int, default=20, help="edits per light tenant")
+    parser.add_argument("--light-interval", type=float, default=30, help="mean seconds between edits")
+    parser.add_argument("--edit-tokens", type=int, default=1500)
+    parser.add_argument("--latency", type=float, default=5, help="simulated seconds per model call")
+    args = parser.parse_args()
+
+    print(f"limits: {args.requests_per_minute:g} requests and {args.tokens_per_minute:g} tokens per minute\n")
+    print(f"{'scheduler':<10} {'tenant':<6} {'calls':>6} {'rejected':>9} {'wait p50':>9} {'wait p95':>9} {'wait max':>9}")
+    for fair in (True, False):
+        loop = SimulatedClockLoop()
+        try:
+            result = loop.run_until_complete(simulate(args, fair))
+        finally:
+            loop.close()
+        name = "fair" if fair else "fifo"
+        for kind in ("light", "heavy"):
+            waits = sorted(result["waits"][kind]) or [0.0]
+            print(f"{name:<10} {kind:<6} {len(result['waits'][kind]):>6} {result['rejected'][kind]:>9} "
+                  f"{statistics.median(waits):>8.1f}s {waits[int(0.95 * (len(waits) - 1))]:>8.1f}s "
+                  f"{waits[-1]:>8.1f}s")
+        requests, tokens = result["busiest"]
+        print(f"{name:<10} busiest minute: {requests} requests, {tokens} tokens, "
+              f"{result['duration'] / 60:.1f} simulated minutes\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+Measure the throughput of batch story generation.
+
+A batch of prompts runs through run_batch() against the local stub model at
+several concurrency levels, and the report has the stories written per
+second, the latency percentiles of a story and the requests the stub got,
+one per story when nothing is resumed.
+
+Run from the agent directory:
+
+    poetry run python -m benchmarks.batch
+    poetry run python -m benchmarks.batch --prompts 1000 --concurrency 1 16 64 --latency 1
+"""
+
+import argparse
+import asyncio
+import os
+import time
+
+from benchmarks.hedging import percentile
+from benchmarks.stub_llm import serve_stub
+
+
+async def run(args: argparse.Namespace) -> None:
+    """Run the batch at each concurrency level and print one row each."""
+    # Imported late so the environment set in main() is picked up
+    from translate_agent.batch import read_prompts, run_batch  # pylint: disable=import-outside-toplevel
+
+    print(f"{'concurrency':>11} {'stories':>8} {'failed':>7} {'seconds':>8} {'stories/s':>10} "
+          f"{'p50':>6} {'p95':>6} {'requests':>9}")
+    for concurrency in args.concurrency:
+        items = read_prompts(f"Write story {number} of batch {concurrency}" for number in range(args.prompts))
+        with serve_stub(port=args.port, latency=args.latency, token_rate=args.token_rate,
+                        story_words=args.words) as stats:
+            started = time.perf_counter()
+            results = [result async for result in run_batch(items, f"bench-{concurrency}", concurrency)]
+            elapsed = time.perf_counter() - started
+        seconds = [result["seconds"] for result in results if "error" not in result] or [0.0]
+        failed = sum("error" in result for result in results)
+        print(f"{concurrency:>11} {len(results):>8} {failed:>7} {elapsed:>7.1f}s {len(results) / elapsed:>10.1f} "
+              f"{percentile(seconds, 0.5):>5.2f}s {percentile(seconds, 0.95):>5.2f}s {stats['requests']:>9}")
+
+
+def main():
+    """Point the agent at the stub and run the batches."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--prompts", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--latency", type=float, default=0.5, help="stub latency before the first token")
+    parser.add_argument("--token-rate", type=float, default=0, help="stub tokens per second, 0 sends at once")
+    parser.add_argument("--words", type=int, default=500, help="words in a generated story")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{args.port}/v1"
+    os.environ["OPENAI_API_KEY"] = "stub"
+    os.environ["STORY_CHECKPOINTER"] = "memory"
+    os.environ["STORY_CACHE"] = "false"
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
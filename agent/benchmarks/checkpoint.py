@@ -0,0 +1,95 @@
+"""
+Compare memory footprint and checkpoint latency of the checkpointer backends.
+
+Each thread runs a number of turns through a one-node graph whose state holds
+a story of the given size, the way the story graph's state does.
+
+Run from the agent directory:
+
+    poetry run python -m benchmarks.checkpoint
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import tempfile
+import time
+import tracemalloc
+from typing import Any
+
+from langgraph.checkpoint.memory import MemorySaver
+from langgraph.graph import END, MessagesState, StateGraph
+
+from benchmarks.diff import make_story, edit_story
+from translate_agent.checkpoint import SQLiteSaver
+
+
+class BenchState(MessagesState):
+    """Story state shaped like AgentState."""
+    story_content: dict
+    previous_story_content: dict
+
+
+def build_graph(checkpointer: Any, words: int):
+    """Compile a graph whose node edits the story on every turn."""
+    rng = random.Random(0)
+    base_story = make_story(words, rng)
+
+    def edit_node(state: BenchState):
+        story = state.get("story_content") or {"title": "T", "genre": "G", "summary": "S", "story": base_story}
+        return {
+            "previous_story_content": story,
+            "story_content": {**story, "story": edit_story(story["story"], rng, paragraphs_changed=1)},
+        }
+
+    workflow = StateGraph(BenchState)
+    workflow.add_node("edit_node", edit_node)
+    workflow.set_entry_point("edit_node")
+    workflow.add_edge("edit_node", END)
+    return workflow.compile(checkpointer=checkpointer)
+
+
+async def run(checkpointer: Any, threads: int, turns: int, words: int):
+    """Drive the graph and return (turn latencies in ms, traced memory in bytes)."""
+    graph = build_graph(checkpointer, words)
+    latencies = []
+    tracemalloc.start()
+    for turn in range(turns):
+        for thread in range(threads):
+            config = {"configurable": {"thread_id": f"thread-{thread}"}}
+            start = time.perf_counter()
+            await graph.ainvoke({"messages": [("user", f"edit {turn}")]}, config)
+            latencies.append((time.perf_counter() - start) * 1000)
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return latencies, memory
+
+
+def report(name: str, latencies, memory: int):
+    """Print one result row."""
+    latencies = sorted(latencies)
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(f"{name:>8} {memory / 1e6:>10.1f} {statistics.mean(latencies):>10.2f} {p95:>10.2f}")
+
+
+def main():
+    """Run the benchmark and print a table."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--threads", type=int, default=50)
+    parser.add_argument("--turns", type=int, default=10)
+    parser.add_argument("--words", type=int, default=2000)
+    parser.add_argument("--keep-last", type=int, default=4)
+    args = parser.parse_args()
+
+    print(f"{'backend':>8} {'memory MB':>10} {'mean ms':>10} {'p95 ms':>10}")
+    report("memory", *asyncio.run(run(MemorySaver(), args.threads, args.turns, args.words)))
+    with tempfile.TemporaryDirectory() as directory:
+        saver = SQLiteSaver(os.path.join(directory, "bench.sqlite"), keep_last=args.keep_last)
+        with saver:
+            report("sqlite", *asyncio.run(run(saver, args.threads, args.turns, args.words)))
+
+
+if __name__ == "__main__":
+    main()
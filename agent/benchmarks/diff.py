@@ -0,0 +1,97 @@
+"""
+Compare the paragraph-anchored diff against the old SequenceMatcher diff.
+
+Run from the agent directory:
+
+    poetry run python -m benchmarks.diff
+"""
+
+import argparse
+import contextlib
+import difflib
+import io
+import random
+import re
+import time
+
+from translate_agent.diff import generate_diff_markup
+
+WORDS = (
+    "the a and of to in she he it was her his they that with for on as at "
+    "forest river dragon castle night light shadow whispered ran quietly "
+    "ancient village storm heart silver door key dream stars wind"
+).split()
+
+
+def make_story(words: int, rng: random.Random) -> str:
+    """Build a synthetic story of roughly the given word count."""
+    paragraphs = []
+    remaining = words
+    while remaining > 0:
+        size = min(remaining, rng.randint(40, 120))
+        paragraphs.append(" ".join(rng.choice(WORDS) for _ in range(size)) + ".")
+        remaining -= size
+    return "\n\n".join(paragraphs)
+
+
+def edit_story(story: str, rng: random.Random, paragraphs_changed: int = 3) -> str:
+    """Rewrite a few words in a handful of paragraphs and insert a new one."""
+    paragraphs = story.split("\n\n")
+    for index in rng.sample(range(len(paragraphs)), min(paragraphs_changed, len(paragraphs))):
+        words = paragraphs[index].split(" ")
+        for _ in range(5):
+            words[rng.randrange(len(words))] = rng.choice(WORDS).upper()
+        paragraphs[index] = " ".join(words)
+    paragraphs.insert(rng.randrange(len(paragraphs) + 1), "A brand new paragraph appears here.")
+    return "\n\n".join(paragraphs)
+
+
+def legacy_diff_markup(old_text: str, new_text: str) -> str:
+    """The SequenceMatcher implementation generate_diff_markup used to have."""
+    old_tokens = re.findall(r'\S+|\s+', old_text)
+    new_tokens = re.findall(r'\S+|\s+', new_text)
+    markup = []
+    for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, old_tokens, new_tokens).get_opcodes():
+        if tag == 'equal':
+            markup.extend(old_tokens[i1:i2])
+            continue
+        if tag in ('delete', 'replace'):
+            markup.extend([f'<span class="deleted">{token}</span>' for token in old_tokens[i1:i2]])
+        if tag in ('insert', 'replace'):
+            markup.extend([f'<span class="added">{token}</span>' for token in new_tokens[j1:j2]])
+    return ''.join(markup)
+
+
+def timed(func, *args) -> float:
+    """Return the wall time of a single call in milliseconds."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        func(*args)
+        return (time.perf_counter() - start) * 1000
+
+
+def main():
+    """Run the benchmark and print a table."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", default="1000,5000,20000,50000,100000",
+                        help="comma separated story sizes in words")
+    parser.add_argument("--legacy-max-words", type=int, default=20000,
+                        help="skip the SequenceMatcher diff above this size")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    print(f"{'words':>8} {'legacy ms':>12} {'anchored ms':>12} {'speedup':>8}")
+    for words in (int(size) for size in args.sizes.split(",")):
+        old_story = make_story(words, rng)
+        new_story = edit_story(old_story, rng)
+        anchored = timed(generate_diff_markup, old_story, new_story)
+        if words <= args.legacy_max_words:
+            legacy = timed(legacy_diff_markup, old_story, new_story)
+            print(f"{words:>8} {legacy:>12.1f} {anchored:>12.1f} {legacy / anchored:>7.1f}x")
+        else:
+            print(f"{words:>8} {'skipped':>12} {anchored:>12.1f} {'-':>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Measure the bytes of intermediate state sent to the UI in a turn.
+
+Replays the tool call arguments of a turn through PartialJSON, the way they
+stream from the model, and emits the state every --tokens-per-emit tokens,
+as STORY_EMIT_INTERVAL does at a given model speed: 5 tokens at 50 tokens a
+second and the default interval of 0.1s. Each emitted state is serialized as
+CopilotKit sends it, whole or as a delta from translate_agent.emission, and
+the UI's copy is rebuilt from the deltas with apply_ops() and checked
+against the state that was emitted.
+
+Three turns per story length: a new story, an edit that rewrites a paragraph
+in the middle through a StoryPatch and an edit that regenerates the whole
+story with one paragraph changed. The state sent when the node starts and
+ends is the same in both modes and isn't counted.
+
+Run from the agent directory:
+
+    poetry run python -m benchmarks.emission
+    poetry run python -m benchmarks.emission --words 1000 50000 --tokens-per-emit 10
+"""
+
+import argparse
+import json
+import random
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from benchmarks.diff import make_story
+from translate_agent.emission import DELTA_FIELDS, StateEmitter, apply_ops
+from translate_agent.patch import apply_patch
+from translate_agent.streaming import PartialJSON
+
+
+def preview_story(args: Any) -> Optional[Dict[str, Any]]:
+    """The state update of agent.preview_story()."""
+    if not isinstance(args, dict) or not args:
+        return None
+    return {"story_content": args, "diff_ops": [], "diff_markup": ""}
+
+
+def preview_patch(story: Dict[str, Any]) -> Callable[[Any], Optional[Dict[str, Any]]]:
+    """The state update of the preview_patch() of an edit of story."""
+    def update(args: Any) -> Optional[Dict[str, Any]]:
+        if not isinstance(args, dict):
+            return None
+        operations = [operation for operation in args.get("operations") or []
+                      if isinstance(operation, dict) and "index" in operation and operation.get("text")]
+        preview = apply_patch(story, {**args, "operations": operations})
+        return None if preview is None else {"story_content": preview, "diff_ops": [], "diff_markup": ""}
+    return update
+
+
+def replay(base: Dict[str, Any], arguments: str, to_update: Callable[[Any], Optional[Dict[str, Any]]],
+           chars_per_emit: int, emitter: Optional[StateEmitter]) -> Tuple[int, int, float]:
+    """
+    Stream arguments through PartialJSON and emit the state as it grows.
+
+    Returns:
+        (emits, bytes sent, seconds spent computing the deltas)
+
+    Raises:
+        AssertionError: If the UI's copy rebuilt from the deltas differs from the state
+    """
+    parser = PartialJSON()
+    view = {field: base[field] for field in DELTA_FIELDS if field in base}
+    emits = sent = 0
+    seconds = 0.0
+    for start in range(0, len(arguments), chars_per_emit):
+        parser.feed(arguments[start:start + chars_per_emit])
+        update = to_update(parser.value())
+        if not update:
+            continue
+        state = {**base, **update}
+        started = time.perf_counter()
+        message = state if emitter is None else emitter.message(state)
+        seconds += time.perf_counter() - started
+        emits += 1
+        sent += len(json.dumps(message, default=str))
+        if emitter is not None:
+            patch = message["state_patch"]
+            if patch.get("full"):
+                view = {field: message[field] for field in DELTA_FIELDS if field in message}
+            else:
+                view = apply_ops(view, patch["ops"])
+            assert view == {field: state[field] for field in DELTA_FIELDS if field in state}
+    return emits, sent, seconds
+
+
+def turns(words: int, rng: random.Random) -> Dict[str, Tuple[Dict[str, Any], str, Callable]]:
+    """The base state, tool call arguments and preview of each kind of turn."""
+    story = {"title": "The Lighthouse", "genre": "Adventure", "summary": "A keeper and a storm.",
+             "story": make_story(words, rng)}
+    parts = story["story"].split("\n\n")
+    middle = len(parts) // 2
+    rewritten = make_story(len(parts[middle].split()), rng)
+    edited = {**story, "story": "\n\n".join(parts[:middle] + [rewritten] + parts[middle + 1:])}
+    kept = {"story_content": story, "previous_story_content": story, "diff_ops": [], "diff_markup": "",
+            "pending_confirmation": False, "is_edit": False}
+    return {
+        "create": ({}, json.dumps(story), preview_story),
+        "patch edit": (kept, json.dumps({"operations": [{"op": "replace", "index": middle, "text": rewritten}]}),
+                       preview_patch(story)),
+        "full edit": (kept, json.dumps(edited), preview_story),
+    }
+
+
+def main():
+    """Print the bytes sent per turn, whole and as deltas."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--words", type=int, nargs="+", default=[1000, 5000, 20000, 50000])
+    parser.add_argument("--tokens-per-emit", type=int, default=5, help="four character tokens between two emits")
+    parser.add_argument("--resync-interval", type=int, default=600, help="emits between two full states")
+    args = parser.parse_args()
+
+    chars_per_emit = args.tokens_per_emit * 4
+    print(f"{'words':>6} {'turn':<11} {'emits':>6} {'whole':>10} {'deltas':>10} {'ratio':>7} {'per emit':>9}")
+    for words in args.words:
+        for name, (base, arguments, to_update) in turns(words, random.Random(words)).items():
+            emits, whole, _ = replay(base, arguments, to_update, chars_per_emit, None)
+            _, deltas, seconds = replay(base, arguments, to_update, chars_per_emit,
+                                        StateEmitter(base, args.resync_interval))
+            print(f"{words:>6} {name:<11} {emits:>6} {whole / 1e6:>8.2f}MB {deltas / 1e6:>8.3f}MB "
+                  f"{whole / deltas:>6.0f}x {seconds / emits * 1e6:>7.0f}us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+Measure hedged requests and failover between two stub providers.
+
+Two local stub models stand in for two providers: the primary is fast but
+sends a share of its answers late, the fallback is slower but steady. Story
+creation turns run through the graph with and without a fallback model, and
+once more with the primary failing every request, which should open its
+circuit and send the calls straight to the fallback.
+
+The report has the latency percentiles of a turn, the requests each stub got
+and how many calls were hedged, won by the hedge or failed over.
+
+Each scenario runs in a process of its own, since the routing settings are
+read when the models are built.
+
+Run from the agent directory:
+
+    poetry run python -m benchmarks.hedging
+    poetry run python -m benchmarks.hedging --turns 400 --slow-fraction 0.05 --slow-latency 10
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+from typing import Any, Dict, List, Tuple
+
+from benchmarks.stub_llm import serve_stub
+
+# Environment and share of failing primary requests of each scenario
+SCENARIOS: Dict[str, Tuple[Dict[str, str], float]] = {
+    "primary only": ({}, 0.0),
+    "hedged": ({"STORY_FALLBACK_MODEL": "gpt-4o-mini"}, 0.0),
+    "primary down": ({"STORY_FALLBACK_MODEL": "gpt-4o-mini"}, 1.0),
+}
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of values."""
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+async def run_turns(turns: int, concurrency: int) -> List[float]:
+    """Run story creation turns, concurrency at a time, and return their latencies."""
+    # Imported late so the environment set in child() is picked up
+    from langchain_core.messages import HumanMessage  # pylint: disable=import-outside-toplevel
+    from translate_agent.agent import graph  # pylint: disable=import-outside-toplevel
+
+    latencies: List[float] = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def turn(number: int) -> None:
+        async with semaphore:
+            started = time.perf_counter()
+            config = {"configurable": {"thread_id": uuid.uuid4().hex}}
+            await graph.ainvoke({"messages": [HumanMessage(content=f"Write story {number}")]}, config)
+            latencies.append(time.perf_counter() - started)
+
+    await asyncio.gather(*(turn(number) for number in range(turns)))
+    return latencies
+
+
+def child(args: argparse.Namespace) -> None:
+    """Run one scenario against two stubs and print the results as JSON."""
+    primary_port, fallback_port = args.port, args.port + 1
+    os.environ.update(
+        OPENAI_BASE_URL=f"http://127.0.0.1:{primary_port}/v1",
+        OPENAI_API_KEY="stub",
+        STORY_FALLBACK_BASE_URL=f"http://127.0.0.1:{fallback_port}/v1",
+        STORY_CHECKPOINTER="memory",
+        STORY_CACHE="false",
+        STORY_SINGLE_FLIGHT="false",
+        STORY_HEDGE_PERCENTILE=str(args.hedge_percentile),
+        STORY_HEDGE_DELAY=str(args.fallback_latency),
+        STORY_BREAKER_RESET="3600",
+    )
+    environment, error_rate = SCENARIOS[args.scenario]
+    os.environ.update(environment)
+    primary_options = {"latency": args.latency, "slow_fraction": args.slow_fraction,
+                       "slow_latency": args.slow_latency, "error_rate": error_rate}
+    with serve_stub(port=primary_port, **primary_options) as primary, \
+            serve_stub(port=fallback_port, latency=args.fallback_latency) as fallback:
+        latencies = asyncio.run(run_turns(args.turns, args.concurrency))
+    from translate_agent.routing import routing_stats  # pylint: disable=import-outside-toplevel
+    print(json.dumps({
+        "latencies": latencies,
+        "primary_requests": primary["requests"],
+        "fallback_requests": fallback["requests"],
+        "routing": routing_stats(),
+    }))
+
+
+def main():
+    """Run every scenario in a child process and print one row each."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.2, help="usual primary latency in seconds")
+    parser.add_argument("--slow-fraction", type=float, default=0.1, help="share of slow primary answers")
+    parser.add_argument("--slow-latency", type=float, default=5.0, help="latency of a slow primary answer")
+    parser.add_argument("--fallback-latency", type=float, default=0.6)
+    parser.add_argument("--hedge-percentile", type=float, default=90)
+    parser.add_argument("--port", type=int, default=8765, help="primary stub port, the fallback uses the next one")
+    parser.add_argument("--scenario", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.scenario:
+        child(args)
+        return
+
+    print(f"{'scenario':<14} {'p50':>6} {'p95':>6} {'p99':>6} {'max':>6} "
+          f"{'primary':>8} {'fallback':>9} {'hedges':>7} {'won':>5} {'failover':>9}")
+    for scenario in SCENARIOS:
+        output = subprocess.run(
+            [sys.executable, "-m", "benchmarks.hedging", *sys.argv[1:], "--scenario", scenario],
+            capture_output=True, text=True, check=True,
+        ).stdout
+        result: Dict[str, Any] = json.loads(output.strip().splitlines()[-1])
+        latencies, routing = result["latencies"], result["routing"]
+        print(f"{scenario:<14} {statistics.median(latencies):>5.2f}s {percentile(latencies, 0.95):>5.2f}s "
+              f"{percentile(latencies, 0.99):>5.2f}s {max(latencies):>5.2f}s {result['primary_requests']:>8} "
+              f"{result['fallback_requests']:>9} {routing['hedges']:>7} {routing['hedge_wins']:>5} "
+              f"{routing['failovers']:>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""
+Count messages and prompt tokens over a long editing session.
+
+Drives the story graph through create, confirm and then edit/confirm turns
+against the local stub model, and prints the message count in state and the
+estimated prompt tokens per turn. With the history window both stay flat.
+
+Run from the agent directory:
+
+    poetry run python -m benchmarks.history
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+
+from benchmarks.stub_llm import serve_stub
+
+
+async def run(turns: int, stats):
+    """Run the session and print one row per turn."""
+    # Imported late so the environment set in main() is picked up
+    from langchain_core.messages import HumanMessage  # pylint: disable=import-outside-toplevel
+    from langgraph.types import Command  # pylint: disable=import-outside-toplevel
+    from translate_agent.agent import graph  # pylint: disable=import-outside-toplevel
+    from translate_agent.history import estimate_tokens  # pylint: disable=import-outside-toplevel
+
+    config = {"configurable": {"thread_id": "history-benchmark"}}
+    print(f"{'turn':>5} {'messages':>9} {'state tokens':>13} {'prompt tokens':>14}")
+    for turn in range(turns):
+        before = stats["prompt_tokens"]
+        request = "Write a story about a lighthouse" if turn == 0 else f"Edit number {turn}: change the ending"
+        with contextlib.redirect_stdout(io.StringIO()):
+            await graph.ainvoke({"messages": [HumanMessage(content=request)]}, config)
+            result = await graph.ainvoke(Command(resume="Confirm"), config)
+        messages = result["messages"]
+        print(f"{turn + 1:>5} {len(messages):>9} {estimate_tokens(messages):>13} {stats['prompt_tokens'] - before:>14}")
+
+
+def main():
+    """Start the stub and run the session."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--turns", type=int, default=50)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{args.port}/v1"
+    os.environ["OPENAI_API_KEY"] = "stub"
+    os.environ["STORY_CHECKPOINTER"] = "memory"
+    os.environ.setdefault("STORY_WORKER_POOL_SIZE", "0")
+    with serve_stub(port=args.port) as stats:
+        asyncio.run(run(args.turns, stats))
+
+
+if __name__ == "__main__":
+    main()
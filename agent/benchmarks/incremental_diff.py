@@ -0,0 +1,75 @@
+"""
+Measure the diff of an edit while the new story streams.
+
+The edited story is fed to StreamingDiff --chars-per-emit characters at a
+time, the way the model streams a full edit, then finished. The report has
+the total time of the stream's diff and the time per thousand words, which
+stays flat when the work is linear, the slowest emit, and the diff of the
+whole story that the edit used to wait for after the stream. "lag" is the
+number of paragraphs that had streamed after the first changed one when
+its change became final, and "same" whether the final
+changes are those of compact_diff().
+
+Run from the agent directory:
+
+    poetry run python -m benchmarks.incremental_diff
+    poetry run python -m benchmarks.incremental_diff --sizes 1000,200000 --chars-per-emit 40
+"""
+
+import argparse
+import random
+import time
+
+from benchmarks.diff import edit_story, make_story
+from translate_agent.diff import StreamingDiff, compact_diff
+
+
+def main():
+    """Run the benchmark and print a table."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1000,5000,20000,50000,100000",
+                        help="comma separated story sizes in words")
+    parser.add_argument("--chars-per-emit", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    print(f"{'words':>8} {'emits':>6} {'streamed':>10} {'per 1k words':>13} {'slowest emit':>13} "
+          f"{'whole diff':>11} {'lag':>4} {'same':>5}")
+    for words in (int(size) for size in args.sizes.split(",")):
+        old_story = make_story(words, rng)
+        new_story = edit_story(old_story, rng)
+        expected = compact_diff(old_story, new_story)
+        first_change = new_story.find("\n\n", expected[0][3]) if expected else -1
+
+        diff = StreamingDiff(old_story)
+        streamed = slowest = 0.0
+        lag = None
+        text = ""
+        for end in range(args.chars_per_emit, len(new_story) + args.chars_per_emit, args.chars_per_emit):
+            # The model's text so far, sliced like PartialJSON hands it over, and the
+            # text before it freed outside the timing
+            previous, text = text, new_story[:end]
+            started = time.perf_counter()
+            ops = diff.update(text)
+            elapsed = time.perf_counter() - started
+            streamed += elapsed
+            slowest = max(slowest, elapsed)
+            del previous
+            if lag is None and ops:
+                lag = new_story.count("\n\n", first_change + 2, end)
+        started = time.perf_counter()
+        ops = diff.finish(new_story)
+        streamed += time.perf_counter() - started
+
+        started = time.perf_counter()
+        compact_diff(old_story, new_story)
+        whole = time.perf_counter() - started
+        emits = -(-len(new_story) // args.chars_per_emit)
+        print(f"{words:>8} {emits:>6} {streamed * 1e3:>8.1f}ms {streamed * 1e3 / words * 1000:>11.2f}ms "
+              f"{slowest * 1e3:>11.2f}ms {whole * 1e3:>9.1f}ms {lag if lag is not None else '-':>4} "
+              f"{'yes' if ops == expected else 'no':>5}")
+
+
+if __name__ == "__main__":
+    main()
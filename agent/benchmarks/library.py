@@ -0,0 +1,98 @@
+"""
+Measure the story library at scale.
+
+Builds a library of synthetic stories on disk, their words drawn from a
+Zipf-distributed vocabulary so that some words are in most stories and most
+words in few, and times searches of each kind: a common, a mid-frequency
+and a rare word, two words, a prefix, a word within two genres, a genre
+listing and a page deep into the results of a common word.
+
+Run from the agent directory:
+
+    poetry run python -m benchmarks.library
+    poetry run python -m benchmarks.library --stories 1000000 --words 150
+"""
+
+import argparse
+import itertools
+import os
+import random
+import statistics
+import tempfile
+import time
+from typing import Any, Dict, Iterator, List, Tuple
+
+from translate_agent.library import StoryLibrary
+
+GENRES = ["Fantasy", "Mystery", "Science Fiction", "Romance", "Horror", "Adventure",
+          "Thriller", "Comedy", "Drama", "Historical", "Fairy Tale", "Western"]
+
+SYLLABLES = ["ka", "lo", "mi", "ren", "tha", "vor", "el", "dun", "sa", "qui", "bar", "nel", "os", "tir", "ul", "wen"]
+
+
+def vocabulary(size: int) -> List[str]:
+    """Distinct made-up words, the same every run."""
+    words = ("".join(parts) for length in (2, 3, 4) for parts in itertools.product(SYLLABLES, repeat=length))
+    return list(itertools.islice(words, size))
+
+
+def stories(count: int, words: int, vocabulary_words: List[str], rng: random.Random) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """Yield (thread_id, StoryContent) pairs with Zipf-distributed words."""
+    weights = list(itertools.accumulate(1 / rank for rank in range(1, len(vocabulary_words) + 1)))
+    for number in range(count):
+        text = rng.choices(vocabulary_words, cum_weights=weights, k=words + 18)
+        yield f"thread-{number}", {
+            "title": " ".join(text[:3]).title(),
+            "genre": GENRES[number % len(GENRES)],
+            "summary": " ".join(text[3:18]),
+            "story": " ".join(text[18:]),
+        }
+
+
+def main():
+    """Build the library, then time each kind of search."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--stories", type=int, default=100000)
+    parser.add_argument("--words", type=int, default=100, help="words in a story")
+    parser.add_argument("--vocabulary", type=int, default=50000)
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    vocabulary_words = vocabulary(args.vocabulary)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "library.sqlite")
+        library = StoryLibrary(path)
+        started = time.perf_counter()
+        library.add_many(stories(args.stories, args.words, vocabulary_words, random.Random(0)))
+        library.optimize()
+        elapsed = time.perf_counter() - started
+        size = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+        print(f"indexed {args.stories} stories in {elapsed:.1f}s ({args.stories / elapsed:.0f}/s), "
+              f"{size / 1e6:.0f} MB\n")
+
+        common, mid, rare = vocabulary_words[5], vocabulary_words[500], vocabulary_words[20000]
+        searches = {
+            f"common word ({common})": dict(query=common),
+            f"mid word ({mid})": dict(query=mid),
+            f"rare word ({rare})": dict(query=rare),
+            "two words": dict(query=f"{common} {mid}"),
+            "prefix": dict(query=mid[:4] + "*"),
+            "word in 2 genres": dict(query=mid, genres=["Mystery", "Horror"]),
+            "genre listing": dict(genres=["Western"]),
+            "common, offset 1000": dict(query=common, offset=1000),
+        }
+        print(f"{'search':<28} {'results':>8} {'p50':>9} {'p95':>9}")
+        for name, search in searches.items():
+            times = []
+            for _ in range(args.runs):
+                started = time.perf_counter()
+                page = library.search(**search)
+                times.append(time.perf_counter() - started)
+            times.sort()
+            print(f"{name:<28} {len(page['results']):>8} {statistics.median(times) * 1e3:>7.2f}ms "
+                  f"{times[int(0.95 * (len(times) - 1))] * 1e3:>7.2f}ms")
+        library.close()
+
+
+if __name__ == "__main__":
+    main()
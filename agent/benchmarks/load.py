@@ -0,0 +1,258 @@
+"""
+Load test the story agent against a local stub model.
+
+Each simulated user runs create, confirm, edit and cancel turns on a thread
+of its own, either directly through the compiled graph or through the
+/copilotkit endpoint of the demo FastAPI app. The stub model's latency, token
+rate and story size are configurable, so runs are reproducible offline.
+
+The report has p50/p95/p99 latency per turn and per cycle, throughput, RSS
+and the checkpoint database size. It is printed and saved as JSON, and a
+previous report can be passed as a baseline to compare two commits.
+
+Run from the agent directory:
+
+    poetry run python -m benchmarks.load --target both --concurrency 20 --output load.json
+    poetry run python -m benchmarks.load --baseline load.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import resource
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+from typing import Any, Dict, List
+
+import httpx
+import uvicorn
+
+from benchmarks.stub_llm import serve_stub
+
+TURNS = ("create", "confirm", "edit", "cancel")
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile of values, q between 0 and 100."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(q / 100 * len(ordered) + 0.5) - 1))]
+
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    """Latency percentiles in milliseconds."""
+    return {
+        "count": len(values),
+        "p50_ms": percentile(values, 50) * 1000,
+        "p95_ms": percentile(values, 95) * 1000,
+        "p99_ms": percentile(values, 99) * 1000,
+        "max_ms": max(values, default=0.0) * 1000,
+    }
+
+
+def rss_bytes() -> int:
+    """Current resident set size of this process."""
+    with open("/proc/self/statm", encoding="utf-8") as statm:
+        return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def checkpoint_bytes() -> int:
+    """Size of the SQLite checkpoint database with its WAL, 0 for the memory checkpointer."""
+    path = os.environ.get("STORY_CHECKPOINT_PATH", "")
+    return sum(os.path.getsize(path + suffix) for suffix in ("", "-wal") if os.path.exists(path + suffix))
+
+
+class GraphDriver:
+    """Runs turns directly through the compiled graph."""
+
+    def __init__(self):
+        # Imported late so the environment set in main() is picked up
+        from translate_agent.agent import graph  # pylint: disable=import-outside-toplevel
+        self.graph = graph
+
+    async def turn(self, thread_id: str, kind: str, text: str) -> None:
+        """Run one turn and wait for the graph to stop."""
+        from langchain_core.messages import HumanMessage  # pylint: disable=import-outside-toplevel
+        from langgraph.types import Command  # pylint: disable=import-outside-toplevel
+
+        config = {"configurable": {"thread_id": thread_id}}
+        if kind in ("confirm", "cancel"):
+            await self.graph.ainvoke(Command(resume=text), config)
+        else:
+            await self.graph.ainvoke({"messages": [HumanMessage(content=text)]}, config)
+
+    async def close(self) -> None:
+        """Release the loop-bound model clients."""
+        from translate_agent.models import reset_models  # pylint: disable=import-outside-toplevel
+        await reset_models()
+
+
+class HttpDriver:
+    """Runs turns through the /copilotkit endpoint of the demo app, the way the UI does."""
+
+    def __init__(self, port: int):
+        from translate_agent.demo import app  # pylint: disable=import-outside-toplevel
+        self.server = uvicorn.Server(uvicorn.Config(app, port=port, log_level="warning"))
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.01)
+        self.client = httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=300)
+
+    async def turn(self, thread_id: str, kind: str, text: str) -> None:
+        """Send one turn and read the event stream to its end."""
+        body: Dict[str, Any] = {
+            "name": "story_creator_agent",
+            "threadId": thread_id,
+            "state": {},
+            "messages": [],
+            "actions": [],
+            "metaEvents": [],
+        }
+        if kind in ("confirm", "cancel"):
+            body["metaEvents"] = [{"name": "LangGraphInterruptEvent", "response": text}]
+        else:
+            body["messages"] = [{"id": str(uuid.uuid4()), "type": "TextMessage", "role": "user", "content": text}]
+        async with self.client.stream("POST", "/copilotkit/agents/execute", json=body) as response:
+            response.raise_for_status()
+            async for _ in response.aiter_bytes():
+                pass
+
+    async def close(self) -> None:
+        """Stop the server."""
+        await self.client.aclose()
+        self.server.should_exit = True
+        await asyncio.to_thread(self.thread.join)
+
+
+async def run_target(driver, concurrency: int, cycles: int) -> Dict[str, Any]:
+    """Run concurrency users for cycles cycles each and collect the timings."""
+    latencies: Dict[str, List[float]] = {turn: [] for turn in (*TURNS, "cycle")}
+    errors: List[str] = []
+    # Every thread gets its own prompt, so the response cache doesn't hide model calls
+    turn_text = {
+        "create": "Write a story about lighthouse {thread_id}",
+        "confirm": "Confirm",
+        "edit": "Change the opening of the story",
+        "cancel": "Cancel",
+    }
+
+    async def user() -> None:
+        for _ in range(cycles):
+            thread_id = f"load-{uuid.uuid4().hex[:8]}"
+            cycle_started = time.perf_counter()
+            try:
+                for kind in TURNS:
+                    started = time.perf_counter()
+                    await driver.turn(thread_id, kind, turn_text[kind].format(thread_id=thread_id))
+                    latencies[kind].append(time.perf_counter() - started)
+            except Exception as exc:  # pylint: disable=broad-except
+                errors.append(f"{type(exc).__name__}: {exc}")
+                continue
+            latencies["cycle"].append(time.perf_counter() - cycle_started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(user() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    return {
+        "elapsed_s": elapsed,
+        "cycles_per_s": len(latencies["cycle"]) / elapsed,
+        "turns_per_s": sum(len(latencies[turn]) for turn in TURNS) / elapsed,
+        "latency": {name: summarize(values) for name, values in latencies.items()},
+        "errors": len(errors),
+        "first_errors": errors[:5],
+        "rss_bytes": rss_bytes(),
+        "checkpoint_bytes": checkpoint_bytes(),
+    }
+
+
+async def run(args) -> Dict[str, Any]:
+    """Run the selected targets one after the other."""
+    results: Dict[str, Any] = {}
+    if args.target in ("graph", "both"):
+        driver = GraphDriver()
+        results["graph"] = await run_target(driver, args.concurrency, args.cycles)
+        await driver.close()
+    if args.target in ("http", "both"):
+        driver = HttpDriver(args.port + 1)
+        results["http"] = await run_target(driver, args.concurrency, args.cycles)
+        await driver.close()
+    return results
+
+
+def git_commit() -> str:
+    """The commit being measured, if this is a git checkout."""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def print_report(report: Dict[str, Any], baseline: Dict[str, Any]) -> None:
+    """Print one row per target and turn, with the change against the baseline."""
+    print(f"commit {report['commit'] or '?'}, baseline {baseline.get('commit', '-') or '?'}")
+    for target, result in report["results"].items():
+        previous = baseline.get("results", {}).get(target, {})
+        print(f"\n{target}: {result['cycles_per_s']:.2f} cycles/s, {result['turns_per_s']:.2f} turns/s, "
+              f"{result['errors']} errors, RSS {result['rss_bytes'] / 2**20:.1f} MB, "
+              f"checkpoints {result['checkpoint_bytes'] / 2**20:.1f} MB")
+        print(f"{'':>8} {'p50':>9} {'p95':>9} {'p99':>9} {'p95 vs baseline':>16}")
+        for name, latency in result["latency"].items():
+            change = ""
+            old = previous.get("latency", {}).get(name, {}).get("p95_ms")
+            if old:
+                change = f"{(latency['p95_ms'] - old) / old * 100:+.1f}%"
+            print(f"{name:>8} {latency['p50_ms']:>7.0f}ms {latency['p95_ms']:>7.0f}ms "
+                  f"{latency['p99_ms']:>7.0f}ms {change:>16}")
+
+
+def main():
+    """Start the stub, run the load and save the report."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", choices=("graph", "http", "both"), default="both")
+    parser.add_argument("--concurrency", type=int, default=10, help="simulated users")
+    parser.add_argument("--cycles", type=int, default=3, help="create/confirm/edit/cancel cycles per user")
+    parser.add_argument("--latency", type=float, default=0.2, help="stub seconds before the first token")
+    parser.add_argument("--token-rate", type=float, default=0, help="stub tokens per second, 0 unpaced")
+    parser.add_argument("--words", type=int, default=300, help="words per generated story")
+    parser.add_argument("--port", type=int, default=8765, help="stub port, the demo app uses the next one")
+    parser.add_argument("--output", help="save the report as JSON")
+    parser.add_argument("--baseline", help="a previous JSON report to compare against")
+    args = parser.parse_args()
+
+    checkpoint_dir = tempfile.mkdtemp(prefix="story-load-")
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{args.port}/v1"
+    os.environ["OPENAI_API_KEY"] = "stub"
+    os.environ.setdefault("STORY_CHECKPOINT_PATH", os.path.join(checkpoint_dir, "checkpoints.sqlite"))
+
+    with serve_stub(port=args.port, story_words=args.words, token_rate=args.token_rate,
+                    latency=args.latency) as stats:
+        results = asyncio.run(run(args))
+
+    report = {
+        "commit": git_commit(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+        "settings": {key: value for key, value in os.environ.items() if key.startswith("STORY_")},
+        "model_requests": stats["requests"],
+        "peak_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        "results": results,
+    }
+    baseline: Dict[str, Any] = {}
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as file:
+            baseline = json.load(file)
+    print_report(report, baseline)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
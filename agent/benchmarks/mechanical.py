@@ -0,0 +1,56 @@
+"""
+Measure mechanical edits applied without the model.
+
+For stories of 1k to 100k words, each kind of mechanical edit is classified
+and applied many times, and the median time per request is reported, next
+to a request that has to go to the model, for the cost of classifying it.
+
+Run from the agent directory:
+
+    poetry run python -m benchmarks.mechanical
+    poetry run python -m benchmarks.mechanical --words 1000 10000 --runs 200
+"""
+
+import argparse
+import random
+import statistics
+import time
+
+from benchmarks.diff import make_story
+from translate_agent.mechanical import mechanical_edit
+
+REQUESTS = {
+    "rename": "rename Mira to Lena",
+    "title": 'change the title to "The Long Night"',
+    "genre": "set the genre to mystery",
+    "replace": "replace 'forest' with 'desert'",
+    "to model": "make the ending happier",
+}
+
+
+def main():
+    """Time each request on each story size and print one row per size."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--words", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--runs", type=int, default=50)
+    args = parser.parse_args()
+
+    print(f"{'words':>7} " + " ".join(f"{name:>10}" for name in REQUESTS))
+    for words in args.words:
+        text = make_story(words, random.Random(0))
+        # Give the story a character and the word to replace
+        text = "Mira walked into the forest.\n\n" + text + "\n\nMira left the forest behind."
+        story = {"title": "The Forest", "genre": "Fantasy", "summary": "Mira in the forest.", "story": text}
+        row = []
+        for request in REQUESTS.values():
+            times = []
+            for _ in range(args.runs):
+                started = time.perf_counter()
+                mechanical_edit(story, request)
+                times.append(time.perf_counter() - started)
+            row.append(statistics.median(times))
+        print(f"{words:>7} " + " ".join(f"{seconds * 1e6:>8.0f}us" for seconds in row))
+
+
+if __name__ == "__main__":
+    main()
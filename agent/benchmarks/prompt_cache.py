@@ -0,0 +1,74 @@
+"""
+Measure how much of the story prompts a provider prefix cache can serve.
+
+A thread creates a story against the local stub model, which reports cached
+prompt tokens the way OpenAI does, and then runs edit rounds: an edit that
+is cancelled, then another edit of the same story that is confirmed. Each
+edit mode (patch and full) runs on a fresh stub, so the cache starts empty.
+
+The report has the prompt tokens sent, the ones served from the cache as the
+stub counted them, and the hit ratio the agent computed from the usage
+metadata, which should agree.
+
+Run from the agent directory:
+
+    poetry run python -m benchmarks.prompt_cache
+    poetry run python -m benchmarks.prompt_cache --words 5000 --rounds 10
+"""
+
+import argparse
+import asyncio
+import os
+
+from benchmarks.stub_llm import serve_stub
+
+
+async def session(rounds: int, thread_id: str) -> None:
+    """Create a story, then run rounds of a cancelled edit followed by a confirmed one."""
+    # Imported late so the environment set in main() is picked up
+    from langchain_core.messages import HumanMessage  # pylint: disable=import-outside-toplevel
+    from langgraph.types import Command  # pylint: disable=import-outside-toplevel
+    from translate_agent.agent import graph  # pylint: disable=import-outside-toplevel
+
+    config = {"configurable": {"thread_id": thread_id}}
+    await graph.ainvoke({"messages": [HumanMessage(content="Write a story about a lighthouse keeper")]}, config)
+    await graph.ainvoke(Command(resume="Confirm"), config)
+    for number in range(rounds):
+        await graph.ainvoke({"messages": [HumanMessage(content=f"Make the opening darker, take {number}")]}, config)
+        await graph.ainvoke(Command(resume="Cancel"), config)
+        await graph.ainvoke({"messages": [HumanMessage(content=f"Make the ending hopeful, take {number}")]}, config)
+        await graph.ainvoke(Command(resume="Confirm"), config)
+
+
+def main():
+    """Parse the arguments, point the agent at the stub and run the sessions."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--words", type=int, default=2000, help="words in a generated story")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{args.port}/v1"
+    os.environ["OPENAI_API_KEY"] = "stub"
+    os.environ["STORY_CHECKPOINTER"] = "memory"
+    os.environ["STORY_CACHE"] = "false"
+    asyncio.run(run_modes(args))
+
+
+async def run_modes(args: argparse.Namespace) -> None:
+    """Run a session per edit mode, each against a fresh stub, and print one row each."""
+    from translate_agent.metrics import prompt_cache_stats  # pylint: disable=import-outside-toplevel
+
+    print(f"{'edit mode':<10} {'requests':>9} {'prompt tokens':>14} {'cached':>9} {'stub ratio':>11} {'agent ratio':>12}")
+    for mode in ("patch", "full"):
+        os.environ["STORY_EDIT_MODE"] = mode
+        before = prompt_cache_stats()
+        with serve_stub(port=args.port, story_words=args.words) as stats:
+            await session(args.rounds, f"prompt-cache-{mode}")
+        after = prompt_cache_stats()
+        agent_ratio = (after["cached_tokens"] - before["cached_tokens"]) / max(after["prompt_tokens"] - before["prompt_tokens"], 1)
+        print(f"{mode:<10} {stats['requests']:>9} {stats['prompt_tokens']:>14} {stats['cached_tokens']:>9} "
+              f"{stats['cached_tokens'] / max(stats['prompt_tokens'], 1):>11.0%} {agent_ratio:>12.0%}")
+
+if __name__ == "__main__":
+    main()
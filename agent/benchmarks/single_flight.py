@@ -0,0 +1,71 @@
+"""
+Check that concurrent identical requests share one model call.
+
+Sends the same story prompt on several threads at once against a slow local
+stub model, and cancels one of the requests while the call is in flight. The
+stub should see a single request, and every request that was not cancelled
+should get the story.
+
+Run from the agent directory:
+
+    poetry run python -m benchmarks.single_flight
+"""
+
+import argparse
+import asyncio
+import os
+import time
+
+from benchmarks.stub_llm import serve_stub
+
+
+async def run(requests: int, latency: float, stats):
+    """Fire the requests, cancel one, and check the results."""
+    # Imported late so the environment set in main() is picked up
+    from langchain_core.messages import HumanMessage  # pylint: disable=import-outside-toplevel
+    from translate_agent.agent import graph  # pylint: disable=import-outside-toplevel
+    from translate_agent.singleflight import flight_stats  # pylint: disable=import-outside-toplevel
+
+    started = time.perf_counter()
+    tasks = [
+        asyncio.ensure_future(graph.ainvoke(
+            {"messages": [HumanMessage(content="Write a story about a lighthouse")]},
+            # One user in several tabs, calls are only shared within a tenant
+            {"configurable": {"thread_id": f"single-flight-{number}", "tenant_id": "single-flight"}},
+        ))
+        for number in range(requests)
+    ]
+    await asyncio.sleep(latency / 2)
+    tasks[0].cancel()
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    elapsed = time.perf_counter() - started
+
+    stories = [result for result in results if isinstance(result, dict) and result.get("story_content")]
+    print(f"requests sent:      {requests}")
+    print(f"stories returned:   {len(stories)}")
+    print(f"cancelled:          {sum(isinstance(result, asyncio.CancelledError) for result in results)}")
+    print(f"model calls:        {stats['requests']}")
+    print(f"elapsed:            {elapsed * 1000:.0f}ms")
+    print(f"single flight:      {flight_stats()}")
+    assert stats["requests"] == 1, "identical requests should share one model call"
+    assert len(stories) == requests - 1, "cancelling one request should not cancel the others"
+
+
+def main():
+    """Start a slow stub and run the check."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=1.0)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{args.port}/v1"
+    os.environ["OPENAI_API_KEY"] = "stub"
+    os.environ["STORY_CHECKPOINTER"] = "memory"
+    os.environ["STORY_CACHE"] = "false"
+    with serve_stub(port=args.port, latency=args.latency) as stats:
+        asyncio.run(run(args.requests, args.latency, stats))
+
+
+if __name__ == "__main__":
+    main()
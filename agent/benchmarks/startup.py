@@ -0,0 +1,92 @@
+"""
+Measure the import and cold-start cost of the story agent.
+
+Each run starts a fresh interpreter with python -X importtime, imports a
+module and, unless --import-only is given, builds the default graph. The
+report has the median import time, the median time to a compiled graph and
+the modules that take longest to import, cumulative with their own imports.
+
+Run from the agent directory:
+
+    poetry run python -m benchmarks.startup
+    poetry run python -m benchmarks.startup --module translate_agent.demo --runs 3
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+_BUILD = """
+import time
+started = time.perf_counter()
+import {module}
+imported = time.perf_counter()
+from translate_agent.agent import build_graph
+build_graph()
+print(f"startup {{imported - started}} {{time.perf_counter() - started}}")
+"""
+
+
+def parse_importtime(stderr: str) -> Dict[str, int]:
+    """Cumulative import time in microseconds per module, from python -X importtime output."""
+    modules: Dict[str, int] = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if cumulative.strip().isdigit():
+            modules[name.strip()] = int(cumulative)
+    return modules
+
+
+def run_once(module: str, import_only: bool) -> Tuple[float, float, Dict[str, int]]:
+    """Start one interpreter and return the import time, the time to a built graph and the module times."""
+    env = dict(os.environ, STORY_CHECKPOINTER="memory")
+    env.setdefault("OPENAI_API_KEY", "stub")
+    code = f"import {module}; print('startup 0 0')" if import_only else _BUILD.format(module=module)
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], env=env,
+                            capture_output=True, text=True, check=True)
+    modules = parse_importtime(result.stderr)
+    line = next(line for line in result.stdout.splitlines() if line.startswith("startup "))
+    _, imported, built = line.split()
+    import_seconds = float(imported) if not import_only else modules.get(module, 0) / 1e6
+    return import_seconds, float(built), modules
+
+
+def main():
+    """Run the measurement and print the report."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="translate_agent.agent", help="module to import")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10, help="slowest modules to list")
+    parser.add_argument("--import-only", action="store_true", help="don't build the graph")
+    args = parser.parse_args()
+
+    imports: List[float] = []
+    builds: List[float] = []
+    modules: Dict[str, List[int]] = {}
+    for _ in range(args.runs):
+        import_seconds, build_seconds, times = run_once(args.module, args.import_only)
+        imports.append(import_seconds)
+        builds.append(build_seconds)
+        for name, micros in times.items():
+            modules.setdefault(name, []).append(micros)
+
+    print(f"import {args.module}: {statistics.median(imports) * 1000:.0f}ms median of {args.runs}")
+    if not args.import_only:
+        print(f"import and build_graph(): {statistics.median(builds) * 1000:.0f}ms")
+    # A package costs at least its slowest module, cumulative times of nested modules overlap
+    packages: Dict[str, float] = {}
+    for name, times in modules.items():
+        package = name if name.startswith("translate_agent.") else name.split(".")[0]
+        packages[package] = max(packages.get(package, 0.0), statistics.median(times))
+    print("\nslowest imports (cumulative):")
+    for name, micros in sorted(packages.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"{micros / 1000:>8.1f}ms  {name}")
+
+
+if __name__ == "__main__":
+    main()
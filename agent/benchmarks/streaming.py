@@ -0,0 +1,78 @@
+"""
+Measure the time to the first visible paragraph of a new story.
+
+Runs create turns against the local stub model, paced at a fixed token rate,
+with streaming on and off. With streaming the first paragraph shows up as soon
+as it has been generated; without it the panel stays empty until the whole
+tool call has arrived.
+
+Run from the agent directory:
+
+    poetry run python -m benchmarks.streaming
+"""
+
+import argparse
+import asyncio
+import os
+import time
+
+from benchmarks.stub_llm import serve_stub
+
+
+async def first_paragraph(graph, thread_id: str) -> tuple:
+    """Run one create turn and return (first paragraph seconds, total seconds, emits)."""
+    from langchain_core.messages import HumanMessage  # pylint: disable=import-outside-toplevel
+
+    config = {"configurable": {"thread_id": thread_id}}
+    started = time.perf_counter()
+    first = None
+    emits = 0
+    async for event in graph.astream_events(
+        {"messages": [HumanMessage(content="Write a story about a lighthouse")]}, config, version="v2"
+    ):
+        if event["event"] == "on_custom_event" and event["name"] == "copilotkit_manually_emit_intermediate_state":
+            emits += 1
+            story = (event["data"].get("story_content") or {}).get("story", "")
+            if first is None and "\n\n" in story.strip():
+                first = time.perf_counter() - started
+        elif event["event"] == "on_chain_end" and event["name"] == "create_node" and first is None:
+            first = time.perf_counter() - started
+    return first, time.perf_counter() - started, emits
+
+
+async def run(turns: int):
+    """Print one row per mode."""
+    # Imported late so the environment set in main() is picked up
+    from translate_agent.agent import graph  # pylint: disable=import-outside-toplevel
+
+    print(f"{'mode':>10} {'first paragraph':>16} {'total':>8} {'emits':>6}")
+    for mode in ("false", "true"):
+        os.environ["STORY_STREAM"] = mode
+        rows = [await first_paragraph(graph, f"streaming-{mode}-{turn}") for turn in range(turns)]
+        first = sum(row[0] for row in rows) / turns
+        total = sum(row[1] for row in rows) / turns
+        emits = sum(row[2] for row in rows) / turns
+        label = "stream" if mode == "true" else "no stream"
+        print(f"{label:>10} {first * 1000:>14.0f}ms {total * 1000:>6.0f}ms {emits:>6.0f}")
+
+
+def main():
+    """Start the stub and compare both modes."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--turns", type=int, default=3)
+    parser.add_argument("--words", type=int, default=1000)
+    parser.add_argument("--token-rate", type=float, default=500)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{args.port}/v1"
+    os.environ["OPENAI_API_KEY"] = "stub"
+    os.environ["STORY_CHECKPOINTER"] = "memory"
+    os.environ["STORY_CACHE"] = "false"  # Both modes must call the model
+    os.environ["STORY_EMIT_DELTAS"] = "false"  # The story is read from each emitted state
+    with serve_stub(port=args.port, story_words=args.words, token_rate=args.token_rate):
+        asyncio.run(run(args.turns))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+"""
+Local OpenAI-compatible stub server for benchmarks.
+
+Answers /v1/chat/completions without calling a real model. When the request
+forces a tool call, the stub returns StoryContent arguments with a synthetic
+story, a StoryPatch that rewrites the first paragraph, or a StoryOutline.
+Otherwise it returns a short synthetic text, such as a chapter.
+
+Streaming requests are answered with server-sent events, one four character
+token per event, optionally paced at token_rate tokens per second.
+
+A share of the requests can be made slow or failing, to give two stubs
+different latency profiles.
+
+Like OpenAI, the stub reports the prompt tokens served from a prefix cache:
+prompts of 1024 tokens or more, in 128-token steps, that start the same as
+an earlier prompt.
+
+    with serve_stub(port=8765) as stats:
+        os.environ["OPENAI_BASE_URL"] = "http://127.0.0.1:8765/v1"
+        ...
+        print(stats["requests"], stats["prompt_tokens"])
+"""
+
+import asyncio
+import contextlib
+import hashlib
+import json
+import random
+import threading
+import time
+import uuid
+from typing import Any, AsyncIterator, Dict, Iterator, Optional, Set
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from benchmarks.diff import make_story
+
+
+# Four characters per token, as the stub counts them
+_CACHE_MIN_CHARS = 1024 * 4
+_CACHE_STEP_CHARS = 128 * 4
+
+
+def cached_prefix_tokens(seen: Set[str], text: str) -> int:
+    """Tokens of the longest cacheable prefix of text that was seen before, remembering its prefixes."""
+    digest = hashlib.sha256()
+    cached = 0
+    position = 0
+    for end in range(_CACHE_MIN_CHARS, len(text) + 1, _CACHE_STEP_CHARS):
+        digest.update(text[position:end].encode())
+        position = end
+        key = digest.copy().hexdigest()
+        if key in seen:
+            cached = end
+        seen.add(key)
+    return cached // 4
+
+
+def create_app(stats: Dict[str, Any], story_words: int = 300, chapters: int = 10,
+               token_rate: float = 0, latency: float = 0, slow_fraction: float = 0,
+               slow_latency: float = 0, error_rate: float = 0) -> FastAPI:
+    """
+    Build the stub app, counting requests and prompt sizes into stats.
+
+    Args:
+        stats: Counters updated for each request
+        story_words: Words in a generated story
+        chapters: Chapters in a generated outline
+        token_rate: Streamed tokens per second, 0 streams as fast as possible
+        latency: Seconds before the response, or its first token, is sent
+        slow_fraction: Share of requests that wait slow_latency seconds instead
+        slow_latency: Seconds a slow request waits
+        error_rate: Share of requests answered with a server error
+    """
+    app = FastAPI()
+    rng = random.Random(0)
+    profile = random.Random(1)
+    prefixes: Set[str] = set()
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        prompt_tokens = sum(len(json.dumps(message)) for message in body["messages"]) // 4
+        # Tools come first in the prompt, then the messages in order
+        prompt_text = json.dumps(body.get("tools")) + "".join(json.dumps(message) for message in body["messages"])
+        cached_tokens = min(cached_prefix_tokens(prefixes, prompt_text), prompt_tokens)
+        stats["requests"] += 1
+        stats["prompt_tokens"] += prompt_tokens
+        stats["cached_tokens"] += cached_tokens
+        stats["max_prompt_tokens"] = max(stats["max_prompt_tokens"], prompt_tokens)
+        wait = slow_latency if profile.random() < slow_fraction else latency
+        if wait:
+            await asyncio.sleep(wait)
+        if profile.random() < error_rate:
+            stats["errors"] += 1
+            return JSONResponse({"error": {"message": "stub failure", "type": "server_error"}}, status_code=500)
+
+        message: Dict[str, Any] = {"role": "assistant", "content": make_story(story_words // 4, rng)}
+        finish_reason = "stop"
+        if body.get("tools"):
+            tool_name = body["tools"][0]["function"]["name"]
+            if tool_name == "StoryOutline":
+                arguments = {
+                    "title": "The Stub Story",
+                    "genre": "Fantasy",
+                    "summary": "A story generated by the stub server.",
+                    "chapters": [
+                        {"title": f"Chapter {number + 1}", "synopsis": make_story(30, rng)}
+                        for number in range(chapters)
+                    ],
+                }
+            elif tool_name == "StoryPatch":
+                arguments = {
+                    "operations": [{"op": "replace", "index": 0, "text": make_story(40, rng)}],
+                    "title": "",
+                    "genre": "",
+                    "summary": "",
+                }
+            else:
+                arguments = {
+                    "title": "The Stub Story",
+                    "genre": "Fantasy",
+                    "summary": "A story generated by the stub server.",
+                    "story": make_story(story_words, rng),
+                }
+            message = {
+                "role": "assistant",
+                "content": None,
+                "tool_calls": [{
+                    "id": f"call_{uuid.uuid4().hex[:12]}",
+                    "type": "function",
+                    "function": {"name": tool_name, "arguments": json.dumps(arguments)},
+                }],
+            }
+            finish_reason = "tool_calls"
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        if body.get("stream"):
+            return StreamingResponse(
+                _stream_events(completion_id, body["model"], message, finish_reason, token_rate,
+                               prompt_tokens if (body.get("stream_options") or {}).get("include_usage") else None,
+                               cached_tokens),
+                media_type="text/event-stream",
+            )
+        completion_tokens = len(json.dumps(message)) // 4
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body["model"],
+            "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+                "prompt_tokens_details": {"cached_tokens": cached_tokens},
+            },
+        }
+
+    return app
+
+
+async def _stream_events(completion_id: str, model: str, message: Dict[str, Any],
+                         finish_reason: str, token_rate: float,
+                         prompt_tokens: Optional[int] = None, cached_tokens: int = 0) -> AsyncIterator[str]:
+    """
+    Yield a completion message as chat.completion.chunk server-sent events.
+
+    When prompt_tokens is given, a final chunk reports the token usage,
+    cached_tokens of them served from the prefix cache.
+    """
+    def event(delta: Dict[str, Any], finish: Any = None) -> str:
+        chunk = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish}],
+        }
+        return f"data: {json.dumps(chunk)}\n\n"
+
+    if message.get("tool_calls"):
+        call = message["tool_calls"][0]
+        yield event({"role": "assistant", "content": None, "tool_calls": [{
+            "index": 0, "id": call["id"], "type": "function",
+            "function": {"name": call["function"]["name"], "arguments": ""},
+        }]})
+        text = call["function"]["arguments"]
+    else:
+        yield event({"role": "assistant", "content": ""})
+        text = message["content"]
+
+    for start in range(0, len(text), 4):
+        token = text[start:start + 4]
+        if message.get("tool_calls"):
+            yield event({"tool_calls": [{"index": 0, "function": {"arguments": token}}]})
+        else:
+            yield event({"content": token})
+        if token_rate:
+            await asyncio.sleep(1 / token_rate)
+    yield event({}, finish_reason)
+    if prompt_tokens is not None:
+        completion_tokens = len(json.dumps(message)) // 4
+        usage = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+                "prompt_tokens_details": {"cached_tokens": cached_tokens},
+            },
+        }
+        yield f"data: {json.dumps(usage)}\n\n"
+    yield "data: [DONE]\n\n"
+
+
+@contextlib.contextmanager
+def serve_stub(port: int = 8765, **options: Any) -> Iterator[Dict[str, Any]]:
+    """Run the stub server in a background thread and yield its live stats."""
+    stats: Dict[str, Any] = {"requests": 0, "errors": 0, "prompt_tokens": 0, "cached_tokens": 0, "max_prompt_tokens": 0}
+    server = uvicorn.Server(uvicorn.Config(create_app(stats, **options), port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    try:
+        yield stats
+    finally:
+        server.should_exit = True
+        thread.join()
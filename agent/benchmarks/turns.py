@@ -0,0 +1,114 @@
+"""
+Measure the graph work of each kind of turn.
+
+Runs a session per thread against the local stub model: a new story and its
+confirmation, an edit and its confirmation, an edit that is cancelled and an
+undo. For each kind of turn the report has the nodes that ran, the
+checkpoints and pending writes the checkpointer stored, their serialized
+bytes, and the latency of the turn.
+
+The stub answers at once by default, so the latency is mostly the graph's
+own work rather than the model's.
+
+Run from the agent directory:
+
+    poetry run python -m benchmarks.turns
+    poetry run python -m benchmarks.turns --threads 50 --words 5000
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Sequence, Tuple
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.memory import MemorySaver
+
+from benchmarks.stub_llm import serve_stub
+
+
+class CountingSaver(MemorySaver):
+    """MemorySaver that counts the checkpoints and writes it stores, and their bytes."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.counts: Dict[str, int] = defaultdict(int)
+
+    def put(self, config: RunnableConfig, checkpoint: Any, metadata: Any, new_versions: Any) -> RunnableConfig:
+        self.counts["checkpoints"] += 1
+        self.counts["bytes"] += len(self.serde.dumps_typed(checkpoint)[1])
+        return super().put(config, checkpoint, metadata, new_versions)
+
+    def put_writes(self, config: RunnableConfig, writes: Sequence[Tuple[str, Any]], task_id: str,
+                   task_path: str = "") -> None:
+        self.counts["writes"] += len(writes)
+        self.counts["bytes"] += sum(len(self.serde.dumps_typed(value)[1]) for _, value in writes)
+        super().put_writes(config, writes, task_id, task_path)
+
+
+SESSION = [
+    ("create", "Write a story about a lighthouse"),
+    ("confirm", "Confirm"),
+    ("edit", "Make the storm in the first paragraph fiercer"),
+    ("confirm", "Confirm"),
+    ("edit", "Make the keeper older"),
+    ("cancel", "Cancel"),
+    ("undo", "undo"),
+]
+
+
+async def run(args: argparse.Namespace) -> None:
+    """Run the sessions and print one row per kind of turn."""
+    # Imported late so the environment set in main() is picked up
+    from langchain_core.messages import HumanMessage  # pylint: disable=import-outside-toplevel
+    from langgraph.types import Command  # pylint: disable=import-outside-toplevel
+    from translate_agent.agent import build_graph  # pylint: disable=import-outside-toplevel
+
+    saver = CountingSaver()
+    graph = build_graph({"checkpointer": saver})
+    rows: Dict[str, Dict[str, List[float]]] = defaultdict(lambda: defaultdict(list))
+    for thread in range(args.threads):
+        config = {"configurable": {"thread_id": f"turns-{thread}"}}
+        for kind, text in SESSION:
+            request: Any = Command(resume=text) if kind in ("confirm", "cancel") else {"messages": [HumanMessage(content=text)]}
+            before = dict(saver.counts)
+            nodes = 0
+            started = time.perf_counter()
+            async for update in graph.astream(request, config, stream_mode="updates"):
+                nodes += sum(name != "__interrupt__" for name in update)
+            elapsed = time.perf_counter() - started
+            row = rows[kind]
+            row["nodes"].append(nodes)
+            row["seconds"].append(elapsed)
+            for counter in ("checkpoints", "writes", "bytes"):
+                row[counter].append(saver.counts[counter] - before.get(counter, 0))
+
+    print(f"{'turn':<8} {'nodes':>6} {'checkpoints':>12} {'writes':>7} {'KB':>8} {'p50':>8} {'mean':>8}")
+    for kind, row in rows.items():
+        print(f"{kind:<8} {statistics.mean(row['nodes']):>6.1f} {statistics.mean(row['checkpoints']):>12.1f} "
+              f"{statistics.mean(row['writes']):>7.1f} {statistics.mean(row['bytes']) / 1e3:>8.1f} "
+              f"{statistics.median(row['seconds']) * 1e3:>6.1f}ms {statistics.mean(row['seconds']) * 1e3:>6.1f}ms")
+
+
+def main():
+    """Point the agent at the stub and run the sessions."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=20)
+    parser.add_argument("--words", type=int, default=2000, help="words in a generated story")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{args.port}/v1"
+    os.environ["OPENAI_API_KEY"] = "stub"
+    os.environ["STORY_CACHE"] = "false"
+    os.environ["STORY_LIBRARY"] = "false"
+    os.environ["STORY_VERSIONS_PATH"] = ":memory:"
+    with serve_stub(port=args.port, story_words=args.words):
+        asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Measure checkpoint bytes per edit with and without the version history.
+
+For each story size, a thread creates a story against the local stub model
+and then runs edit and confirm turns. The stub's edits rewrite one paragraph,
+so the change stays the same size while the story grows. Every checkpoint is
+kept, and the bytes each edit adds to the checkpoints, pending writes and
+version history are reported.
+
+Each mode runs in a process of its own, since the checkpointer's serializer
+is chosen when the graph is built.
+
+Run from the agent directory:
+
+    poetry run python -m benchmarks.versions
+    poetry run python -m benchmarks.versions --words 1000 10000 50000 --edits 10
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+from typing import Dict, List
+
+from benchmarks.stub_llm import serve_stub
+
+
+def stored_bytes(path: str, thread_id: str) -> int:
+    """Bytes stored for a thread in the checkpoint database, version history included."""
+    conn = sqlite3.connect(path)
+    try:
+        total = 0
+        for query in (
+            "SELECT SUM(LENGTH(checkpoint) + LENGTH(metadata)) FROM checkpoints WHERE thread_id = ?",
+            "SELECT SUM(LENGTH(value)) FROM writes WHERE thread_id = ?",
+            "SELECT SUM(LENGTH(fields) + IFNULL(LENGTH(snapshot), 0) + IFNULL(LENGTH(forward), 0) "
+            "+ IFNULL(LENGTH(reverse), 0)) FROM story_versions WHERE thread_id = ?",
+        ):
+            total += conn.execute(query, (thread_id,)).fetchone()[0] or 0
+        return total
+    finally:
+        conn.close()
+
+
+async def measure(words: int, edits: int, path: str) -> Dict[str, float]:
+    """Create a story of about words words, edit it edits times and return the bytes per turn."""
+    # Imported late so the environment set in child() is picked up
+    from langchain_core.messages import HumanMessage  # pylint: disable=import-outside-toplevel
+    from langgraph.types import Command  # pylint: disable=import-outside-toplevel
+    from translate_agent.agent import graph  # pylint: disable=import-outside-toplevel
+
+    thread_id = f"versions-{words}"
+    config = {"configurable": {"thread_id": thread_id}}
+    await graph.ainvoke({"messages": [HumanMessage(content=f"Write a story of {words} words")]}, config)
+    await graph.ainvoke(Command(resume="Confirm"), config)
+    graph.checkpointer.flush()
+    created = stored_bytes(path, thread_id)
+
+    for number in range(edits):
+        await graph.ainvoke({"messages": [HumanMessage(content=f"Change the opening, take {number}")]}, config)
+        await graph.ainvoke(Command(resume="Confirm"), config)
+    graph.checkpointer.flush()
+    story = (await graph.aget_state(config)).values["story_content"]["story"]
+    return {
+        "story_chars": len(story),
+        "create_bytes": created,
+        "edit_bytes": (stored_bytes(path, thread_id) - created) / edits,
+    }
+
+
+def child(words: List[int], edits: int, port: int) -> None:
+    """Measure every size in this process and print the results as JSON."""
+    path = os.path.join(tempfile.mkdtemp(prefix="story-versions-"), "checkpoints.sqlite")
+    os.environ["STORY_CHECKPOINT_PATH"] = path
+    os.environ["STORY_CHECKPOINTER"] = "sqlite"
+    os.environ["STORY_CHECKPOINT_KEEP_LAST"] = "0"
+    os.environ["STORY_HISTORY_MAX_MESSAGES"] = "0"
+    os.environ["STORY_CACHE"] = "false"
+    results = {}
+
+    async def run_all() -> None:
+        from translate_agent.models import reset_models  # pylint: disable=import-outside-toplevel
+        for size in words:
+            with serve_stub(port=port, story_words=size):
+                results[size] = await measure(size, edits, path)
+            await reset_models()
+
+    asyncio.run(run_all())
+    print(json.dumps(results))
+
+
+def main():
+    """Run both modes in child processes and print one row per size."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--words", type=int, nargs="+", default=[1000, 5000, 20000])
+    parser.add_argument("--edits", type=int, default=5)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{args.port}/v1"
+    os.environ["OPENAI_API_KEY"] = "stub"
+    if args.child:
+        child(args.words, args.edits, args.port)
+        return
+
+    rows = {}
+    for mode in ("false", "true"):
+        output = subprocess.run(
+            [sys.executable, "-m", "benchmarks.versions", "--child", "--edits", str(args.edits),
+             "--port", str(args.port), "--words", *map(str, args.words)],
+            env=dict(os.environ, STORY_VERSIONS=mode), capture_output=True, text=True, check=True,
+        ).stdout
+        rows[mode] = json.loads(output.strip().splitlines()[-1])
+
+    print(f"{'words':>7} {'story':>9} {'per edit, copies':>17} {'per edit, versions':>19}")
+    for size in args.words:
+        plain, versioned = rows["false"][str(size)], rows["true"][str(size)]
+        print(f"{size:>7} {plain['story_chars'] / 1024:>7.0f}KB {plain['edit_bytes'] / 1024:>15.1f}KB "
+              f"{versioned['edit_bytes'] / 1024:>17.1f}KB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+"""
+Event loop on a simulated clock.
+
+The admission scheduler reads time from the event loop, and
+SimulatedClockLoop moves its clock forward instead of sleeping, so minutes
+of rate-limited traffic run at once and give the same result every time.
+Used by the admission tests and by benchmarks.admission.
+"""
+
+import asyncio
+import selectors
+from typing import Any, List, Optional
+
+
+class _SimulatedSelector:
+    """Selector that advances the loop clock by the timeout instead of waiting for it."""
+
+    def __init__(self, selector: selectors.BaseSelector, loop: "SimulatedClockLoop"):
+        self._selector = selector
+        self._loop = loop
+
+    def select(self, timeout: Optional[float] = None) -> List[Any]:
+        if timeout is None:
+            return self._selector.select(None)
+        events = self._selector.select(0)
+        if not events:
+            self._loop.now += timeout
+        return events
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._selector, name)
+
+
+class SimulatedClockLoop(asyncio.SelectorEventLoop):  # pylint: disable=abstract-method
+    """Event loop on a simulated clock: when nothing is ready, time jumps to the next timer."""
+
+    def __init__(self):
+        super().__init__()
+        self.now = 0.0
+        self._selector = _SimulatedSelector(self._selector, self)  # type: ignore[has-type]
+
+    def time(self) -> float:
+        return self.now
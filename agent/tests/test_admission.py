@@ -0,0 +1,85 @@
+"""Tests of the order and rate at which the scheduler admits model calls, on a simulated clock."""
+
+import asyncio
+
+import pytest
+
+from tests.simulated_clock import SimulatedClockLoop
+from translate_agent.admission import BULK, INTERACTIVE, QueueFullError, Scheduler
+
+
+def simulate(main):
+    loop = SimulatedClockLoop()
+    try:
+        return loop.run_until_complete(main())
+    finally:
+        loop.close()
+
+
+def admit(calls, **limits):
+    """Queue calls, (name, tenant, tokens, priority) in order, and return the names and times they were admitted."""
+    async def main():
+        scheduler = Scheduler(**limits)
+        loop = asyncio.get_running_loop()
+        admitted = []
+
+        async def call(name, tenant, tokens, priority):
+            await scheduler.acquire(tenant, tokens, priority)
+            admitted.append((name, loop.time()))
+
+        await asyncio.gather(*(call(*args) for args in calls))
+        return admitted
+    return simulate(main)
+
+
+def test_requests_per_minute():
+    admitted = admit([(index, "tenant", 10, INTERACTIVE) for index in range(10)], requests_per_minute=6)
+
+    # The bucket starts with a minute's worth, then refills one request every ten seconds
+    assert [time for _, time in admitted] == pytest.approx([0] * 6 + [10, 20, 30, 40])
+
+
+def test_tokens_per_minute():
+    admitted = admit([(index, "tenant", 3000, INTERACTIVE) for index in range(5)], tokens_per_minute=6000)
+
+    assert [time for _, time in admitted] == pytest.approx([0, 0, 30, 60, 90])
+
+
+def test_tenants_take_turns():
+    calls = [("a", "heavy", 100, INTERACTIVE)] * 6 + [("b", "light", 100, INTERACTIVE)] * 2
+    admitted = admit(calls, requests_per_minute=1)
+
+    assert "".join(name for name, _ in admitted) == "aababaaa"
+    assert [time for _, time in admitted] == pytest.approx([60 * index for index in range(8)])
+
+
+def test_interactive_calls_go_first():
+    calls = [("first", "a", 100, BULK), ("story", "a", 100, BULK), ("edit", "b", 100, INTERACTIVE)]
+    admitted = admit(calls, requests_per_minute=1)
+
+    assert [name for name, _ in admitted] == ["first", "edit", "story"]
+
+
+def test_full_queue_rejects_calls():
+    async def main():
+        scheduler = Scheduler(requests_per_minute=1, max_queue=2)
+        await scheduler.acquire("tenant", 10)
+        waiting = [asyncio.ensure_future(scheduler.acquire("tenant", 10)) for _ in range(2)]
+        await asyncio.sleep(0)
+        assert scheduler.depth() == 2
+        with pytest.raises(QueueFullError):
+            await scheduler.acquire("tenant", 10)
+
+        # A cancelled call leaves its place to a new one, even behind the head of the queue
+        waiting[1].cancel()
+        await asyncio.sleep(0)
+        assert scheduler.depth() == 1
+        waiting.append(asyncio.ensure_future(scheduler.acquire("tenant", 10)))
+        await asyncio.sleep(0)
+        assert scheduler.depth() == 2
+        with pytest.raises(QueueFullError):
+            await scheduler.acquire("tenant", 10)
+
+        await asyncio.gather(waiting[0], waiting[2])
+        assert scheduler.depth() == 0
+    simulate(main)
@@ -0,0 +1,31 @@
+"""Tests of the model calls that identical requests share."""
+
+import asyncio
+
+from langchain_core.messages import AIMessage
+
+from translate_agent.cache import cached_call
+
+
+def test_bypass_makes_its_own_call(monkeypatch):
+    monkeypatch.setenv("STORY_CACHE", "false")
+    calls = []
+
+    async def call():
+        take = len(calls) + 1
+        calls.append(take)
+        await asyncio.sleep(0.01)
+        return AIMessage(content=f"Take {take}")
+
+    async def main():
+        return await asyncio.gather(
+            cached_call("same", call),
+            cached_call("same", call),
+            cached_call("same", call, bypass=True),
+        )
+
+    first, shared, fresh = asyncio.run(main())
+
+    assert calls == [1, 2]
+    assert first is shared
+    assert fresh.content != first.content
@@ -0,0 +1,58 @@
+"""Tests of the buffered writes of SQLiteSaver when the database is busy."""
+
+import sqlite3
+import time
+
+import pytest
+from langgraph.checkpoint.base import empty_checkpoint
+
+from translate_agent.checkpoint import SQLiteSaver
+
+
+def saver_and_lock(tmp_path, **options):
+    """A saver that gives up on a locked database at once, and a connection holding its write lock."""
+    path = str(tmp_path / "checkpoints.sqlite")
+    saver = SQLiteSaver(path, **options)
+    saver.conn.execute("PRAGMA busy_timeout=10")
+    other = sqlite3.connect(path, isolation_level=None)
+    other.execute("BEGIN IMMEDIATE")
+    return saver, other
+
+
+def put(saver, thread_id):
+    config = {"configurable": {"thread_id": thread_id, "checkpoint_ns": ""}}
+    return saver.put(config, empty_checkpoint(), {"source": "input", "step": -1}, {})
+
+
+def stored(path, thread_id):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM checkpoints WHERE thread_id = ?", (thread_id,)).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_failed_flush_keeps_the_writes(tmp_path):
+    saver, other = saver_and_lock(tmp_path, flush_interval=60)
+    config = put(saver, "busy")
+
+    with pytest.raises(sqlite3.OperationalError):
+        saver.flush()
+    assert saver.pending
+
+    other.execute("ROLLBACK")
+    saver.flush()
+    assert saver.get_tuple(config).checkpoint["id"] == config["configurable"]["checkpoint_id"]
+    saver.close()
+
+
+def test_timed_flush_retries_after_an_error(tmp_path):
+    saver, other = saver_and_lock(tmp_path, flush_interval=0.05)
+    put(saver, "timer")
+    time.sleep(0.2)
+    assert stored(str(tmp_path / "checkpoints.sqlite"), "timer") == 0
+
+    other.execute("ROLLBACK")
+    time.sleep(0.3)
+    assert stored(str(tmp_path / "checkpoints.sqlite"), "timer") == 1
+    saver.close()
@@ -0,0 +1,115 @@
+"""Tests of the message window and the summary that replaces what falls out of it."""
+
+import asyncio
+import itertools
+
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage
+from langchain_core.runnables import RunnableLambda
+from langgraph.checkpoint.memory import MemorySaver
+from langgraph.graph.message import add_messages
+from langgraph.types import Command
+
+from translate_agent.agent import build_graph
+from translate_agent.history import estimate_tokens, split_window, summary_messages, trim_history
+
+
+def conversation(turns):
+    """Turns of a request, a StoryContent tool call, its result and a question, with ids."""
+    messages = []
+    for turn in range(turns):
+        call_id = f"call-{turn}"
+        messages += [
+            HumanMessage(content=f"Request {turn}", id=f"human-{turn}"),
+            AIMessage(content="", id=f"ai-{turn}",
+                      tool_calls=[{"name": "StoryContent", "args": {"story": f"Story {turn}"}, "id": call_id}]),
+            ToolMessage(content="Story written", tool_call_id=call_id, id=f"tool-{turn}"),
+            AIMessage(content="Please confirm if you'd like to keep it.", id=f"question-{turn}"),
+        ]
+    return messages
+
+
+def tool_call_ids(messages):
+    return {call["id"] for message in messages if isinstance(message, AIMessage) for call in message.tool_calls}
+
+
+@pytest.mark.parametrize("max_messages", range(1, 14))
+def test_window_keeps_tool_calls_with_their_results(max_messages):
+    messages = conversation(4)
+    dropped, kept = split_window(messages, max_messages)
+
+    assert dropped + kept == messages
+    assert isinstance(kept[0], HumanMessage)
+    kept_results = {message.tool_call_id for message in kept if isinstance(message, ToolMessage)}
+    dropped_results = {message.tool_call_id for message in dropped if isinstance(message, ToolMessage)}
+    assert kept_results == tool_call_ids(kept)
+    assert dropped_results == tool_call_ids(dropped)
+
+
+def test_summary_replaces_the_trimmed_window(monkeypatch):
+    monkeypatch.setenv("STORY_HISTORY_MAX_MESSAGES", "6")
+    monkeypatch.setenv("STORY_HISTORY_SUMMARY", "extractive")
+    messages = conversation(3)
+    state = {"messages": messages, "history_summary": "- Request before"}
+
+    update = asyncio.run(trim_history(state, {}))
+    remaining = add_messages(messages, update["messages"])
+
+    assert [message.id for message in remaining] == [message.id for message in messages[8:]]
+    assert update["history_summary"] == "- Request before\n- Request 0\n- Request 1"
+    summary = summary_messages({**state, "history_summary": update["history_summary"]})
+    assert len(summary) == 1 and isinstance(summary[0], SystemMessage)
+    assert "- Request 1" in summary[0].content
+
+
+def test_history_that_fits_is_left_alone(monkeypatch):
+    monkeypatch.setenv("STORY_HISTORY_MAX_MESSAGES", "20")
+    assert asyncio.run(trim_history({"messages": conversation(3)}, {})) == {}
+
+
+def story_model(model, tools, tool_choice):
+    """Model factory whose models always answer with a new story."""
+    calls = itertools.count()
+
+    def answer(messages):
+        call = next(calls)
+        return AIMessage(content="", tool_calls=[{
+            "name": tool_choice,
+            "args": {"title": "The Lighthouse", "genre": "Drama", "summary": "A keeper grows old.",
+                     "story": f"Draft {call}. " + "The keeper climbed the stairs. " * 20},
+            "id": f"call-{call}",
+        }])
+    return RunnableLambda(answer)
+
+
+def test_long_session_stays_within_the_window(monkeypatch):
+    monkeypatch.setenv("STORY_HISTORY_MAX_MESSAGES", "10")
+    monkeypatch.setenv("STORY_HISTORY_SUMMARY", "extractive")
+    monkeypatch.setenv("STORY_HISTORY_SUMMARY_CHARS", "500")
+    monkeypatch.setenv("STORY_EDIT_MODE", "full")
+    for name in ("STORY_CACHE", "STORY_LIBRARY", "STORY_VERSIONS", "STORY_STREAM"):
+        monkeypatch.setenv(name, "false")
+    graph = build_graph({"model": story_model, "checkpointer": MemorySaver()})
+    config = {"configurable": {"thread_id": "long-session"}}
+
+    async def session():
+        sizes = []
+        for turn in range(50):
+            request = "Write a story about a lighthouse" if turn == 0 else f"Make the keeper {turn:02d} years older"
+            await graph.ainvoke({"messages": [HumanMessage(content=request)]}, config)
+            state = (await graph.aget_state(config)).values
+            assert state["pending_confirmation"]
+            await graph.ainvoke(Command(resume="Confirm"), config)
+            state = (await graph.aget_state(config)).values
+            sizes.append((len(state["messages"]), estimate_tokens(state["messages"]), state.get("history_summary", "")))
+        return sizes
+
+    sizes = asyncio.run(session())
+
+    # The window, plus the turn's tool call, its result, the question and the confirmation
+    assert max(count for count, _, _ in sizes) <= 10 + 4
+    # Every turn is the same size, so once the window is full the prompt stops growing
+    assert max(tokens for _, tokens, _ in sizes[10:]) <= max(tokens for _, tokens, _ in sizes[:10])
+    assert all(len(summary) <= 500 for _, _, summary in sizes)
+    assert "Make the keeper 49 years older" not in sizes[-1][2]
+    assert "Make the keeper 40 years older" in sizes[-1][2]
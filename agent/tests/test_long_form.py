@@ -0,0 +1,44 @@
+"""Tests of the chapters written from an outline."""
+
+import asyncio
+
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import RunnableLambda
+
+from translate_agent import long_form
+from translate_agent.long_form import chapter_node
+
+OUTLINE = {
+    "title": "The Lighthouse",
+    "genre": "Drama",
+    "summary": "A keeper grows old.",
+    "chapters": [
+        {"title": "The Storm", "synopsis": "A storm hits the coast."},
+        {"synopsis": "The keeper retires."},
+        {"title": "The Letter"},
+    ],
+}
+
+
+def chapter_model(model, tools, tool_choice):
+    return RunnableLambda(lambda messages: AIMessage(content="The waves rose."))
+
+
+def write(index):
+    config = {"configurable": {"thread_id": "long-form", "story_model": chapter_model}}
+    return asyncio.run(chapter_node({"outline": OUTLINE, "index": index}, config))["chapters"][0]
+
+
+def test_chapters_with_an_incomplete_plan():
+    assert write(0) == {"index": 0, "title": "The Storm", "text": "The waves rose."}
+    assert write(1) == {"index": 1, "title": "Chapter 2", "text": "The waves rose."}
+    # Only the chapter without a synopsis fails, the others are written
+    assert write(2)["error"] == "'synopsis'"
+    assert write(2)["title"] == "The Letter"
+
+
+def test_semaphores_of_closed_loops_are_dropped():
+    for _ in range(3):
+        write(0)
+
+    assert len(long_form._semaphores) == 1  # pylint: disable=protected-access
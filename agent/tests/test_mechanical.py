@@ -0,0 +1,54 @@
+"""Tests of which edit requests are applied without the model."""
+
+import pytest
+
+from translate_agent.mechanical import mechanical_edit, parse_edit
+
+
+@pytest.mark.parametrize("request_text", [
+    "change the title to something more exciting",
+    "Change the genre to something darker",
+    "rename it to something catchier",
+    "set the title as a question",
+    "rename it to Something Darker",
+    "switch the genre to a lighter one",
+    "change the genre to darker",
+    "change the title to The Storm and make it longer",
+    "make the ending happier",
+])
+def test_described_changes_go_to_the_model(request_text):
+    assert parse_edit(request_text) is None
+
+
+@pytest.mark.parametrize("request_text, expected", [
+    ("change the title to The Long Night", ("title", "", "The Long Night")),
+    ("Change the title to The Lighthouse at the End of the World",
+     ("title", "", "The Lighthouse at the End of the World")),
+    ('change the title to "something more exciting"', ("title", "", "something more exciting")),
+    ("call it The Keeper", ("title", "", "The Keeper")),
+    ("set the genre to mystery", ("genre", "", "mystery")),
+    ("set the genre to science fiction please", ("genre", "", "science fiction")),
+    ("change the genre to thriller", ("genre", "", "thriller")),
+    ("rename Mira to Lena", ("rename", "Mira", "Lena")),
+    ("replace 'forest' with 'desert'", ("replace", "forest", "desert")),
+])
+def test_literal_changes_are_mechanical(request_text, expected):
+    assert parse_edit(request_text) == expected
+
+
+def story(text):
+    return {"title": "The Trip", "genre": "Drama", "summary": "A trip abroad.", "story": text}
+
+
+def test_replace_keeps_the_case_of_each_occurrence():
+    edited, change = mechanical_edit(story("Forest paths. The forest was dark. FOREST!"), "replace 'forest' with 'desert'")
+
+    assert edited["story"] == "Desert paths. The desert was dark. DESERT!"
+    assert change == "replaced 'forest' with 'desert' (3 changes)"
+
+
+def test_replace_matches_an_acronym_in_its_own_case():
+    edited, change = mechanical_edit(story("Let us fly to the US. Us and them."), "replace 'US' with 'UK'")
+
+    assert edited["story"] == "Let us fly to the UK. Us and them."
+    assert change == "replaced 'US' with 'UK' (1 change)"
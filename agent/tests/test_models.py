@@ -0,0 +1,36 @@
+"""Tests of the connection pool that the registry models share."""
+
+import asyncio
+import socket
+
+from benchmarks.stub_llm import serve_stub
+from translate_agent.models import get_model, model_stats, reset_models
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_calls_reuse_one_connection(monkeypatch):
+    port = free_port()
+    monkeypatch.setenv("OPENAI_BASE_URL", f"http://127.0.0.1:{port}/v1")
+    monkeypatch.setenv("OPENAI_API_KEY", "stub")
+    monkeypatch.delenv("STORY_FALLBACK_MODEL", raising=False)
+
+    async def calls():
+        await reset_models()
+        before = model_stats()
+        for _ in range(5):
+            await get_model("gpt-4o").ainvoke("Write a story")
+        after = model_stats()
+        await reset_models()
+        return {key: after[key] - before[key] for key in ("http_requests", "http_connections_opened",
+                                                          "http_connections_reused")}
+
+    with serve_stub(port=port, story_words=40) as stats:
+        counts = asyncio.run(calls())
+
+    assert stats["requests"] == 5
+    assert counts == {"http_requests": 5, "http_connections_opened": 1, "http_connections_reused": 4}
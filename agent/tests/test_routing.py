@@ -0,0 +1,75 @@
+"""Tests of the answers RoutedModel returns and of the calls it cancels."""
+
+import asyncio
+import uuid
+
+import pytest
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import RunnableLambda
+
+from translate_agent.routing import RoutedModel, get_breaker
+
+
+def answering(message: AIMessage) -> RunnableLambda:
+    """A model that always answers with message."""
+    async def answer(_input):
+        return message
+    return RunnableLambda(answer)
+
+
+def provider() -> str:
+    """A provider name of its own, so each test has a fresh circuit breaker."""
+    return f"test-{uuid.uuid4().hex[:8]}"
+
+
+def patch_call(args) -> AIMessage:
+    return AIMessage(content="", tool_calls=[{"name": "StoryPatch", "args": args, "id": "call-1"}])
+
+
+def test_patch_with_only_operations_is_returned():
+    message = patch_call({"operations": [{"op": "replace", "index": 0, "text": "A storm."}]})
+    model = RoutedModel(answering(message), provider(), tool_choice="StoryPatch")
+
+    assert asyncio.run(model.ainvoke("edit")) is message
+
+
+def test_answer_without_tool_call_is_returned_without_a_fallback():
+    message = AIMessage(content="Which paragraph do you mean?")
+    name = provider()
+    model = RoutedModel(answering(message), name, tool_choice="StoryPatch")
+
+    assert asyncio.run(model.ainvoke("edit")) is message
+    breaker = get_breaker(name)
+    assert breaker.state == "closed" and breaker.consecutive == 0
+
+
+def test_answer_without_tool_call_fails_over_to_the_fallback():
+    message = patch_call({"operations": []})
+    model = RoutedModel(answering(AIMessage(content="Sure!")), provider(), answering(message), provider(),
+                        tool_choice="StoryPatch")
+
+    assert asyncio.run(model.ainvoke("edit")) is message
+
+
+def test_calls_past_the_deadline_are_cancelled(monkeypatch):
+    monkeypatch.setenv("STORY_MODEL_DEADLINE", "0.1")
+    started = asyncio.Event()
+    cancelled = asyncio.Event()
+
+    async def slow(_input):
+        started.set()
+        try:
+            await asyncio.sleep(1)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+        return patch_call({"operations": []})
+
+    async def call():
+        model = RoutedModel(RunnableLambda(slow), provider(), tool_choice="StoryPatch")
+        with pytest.raises(TimeoutError):
+            await model.ainvoke("edit")
+        await asyncio.sleep(0.05)
+        return started.is_set(), cancelled.is_set()
+
+    assert asyncio.run(call()) == (True, True)
@@ -0,0 +1,273 @@
+"""
+Admission control and fair scheduling for model calls.
+
+Without it every model call is sent as soon as a node makes it. Under load
+that runs into the provider's rate limits, the client retries, and a few
+threads generating long stories hold up everyone else. Calls now pass
+through a Scheduler first:
+
+- token buckets hold calls back to the requests and tokens per minute the
+  provider allows. A call takes its estimated tokens, prompt plus expected
+  completion, and the estimate is corrected from the usage it reports;
+- calls that generate a whole story (StoryContent and StoryOutline tool
+  calls) wait behind the cheap ones, such as patch edits and summaries;
+- within a priority, tenants are served in weighted fair order by tokens,
+  so a tenant with many queued calls doesn't starve the others. The tenant
+  is the tenant_id of the config, or the thread;
+- when the queue is full, a call is rejected at once with QueueFullError
+  rather than waiting behind work it can't catch up with.
+
+Limits apply per process. The scheduler reads time from the running event
+loop, so a loop with a simulated clock (see tests/simulated_clock.py) drives
+it without waiting.
+
+Configured through environment variables:
+
+    STORY_REQUESTS_PER_MINUTE        model requests allowed per minute, 0 no limit (default: 0)
+    STORY_TOKENS_PER_MINUTE          model tokens allowed per minute, 0 no limit (default: 0)
+    STORY_MODEL_QUEUE_LIMIT          calls waiting for admission before new ones are rejected (default: 100)
+    STORY_COMPLETION_TOKENS_ESTIMATE completion tokens assumed for a call until its usage is known (default: 1000)
+"""
+
+import asyncio
+import heapq
+import itertools
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain_core.runnables import RunnableConfig
+
+from translate_agent.metrics import increment, observe, register_collector
+
+# Priorities, lower is served first
+INTERACTIVE = 0
+BULK = 1
+_BULK_TOOLS = {"StoryContent", "StoryOutline"}
+
+_schedulers: Dict[asyncio.AbstractEventLoop, "Scheduler"] = {}
+_stats: Dict[str, float] = {
+    "admitted": 0,
+    "queued": 0,
+    "rejected": 0,
+    "cancelled": 0,
+    "wait_seconds_total": 0.0,
+    "tokens_estimated": 0,
+    "tokens_used": 0,
+}
+
+
+class QueueFullError(RuntimeError):
+    """Raised when a model call arrives while the admission queue is full."""
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at per_minute per minute.
+
+    The bucket holds at most a minute's worth. take() may drive it below
+    zero, for a call larger than the bucket or a usage above its estimate,
+    and later calls wait for the debt to be refilled.
+
+    Args:
+        per_minute: Refill rate, 0 or less for no limit
+        now: Current time in seconds
+    """
+
+    def __init__(self, per_minute: float, now: float):
+        self.rate = per_minute / 60
+        self.capacity = per_minute
+        self.level = float(per_minute)
+        self.updated = now
+
+    def _refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait(self, amount: float, now: float) -> float:
+        """Seconds until amount can be taken, a call larger than the bucket waits for a full one."""
+        if self.rate <= 0:
+            return 0.0
+        self._refill(now)
+        missing = min(amount, self.capacity) - self.level
+        # Refilling for the computed wait can leave the level a rounding error short
+        return missing / self.rate if missing > 1e-6 else 0.0
+
+    def take(self, amount: float, now: float) -> None:
+        """Take amount from the bucket, a negative amount gives it back."""
+        if self.rate <= 0:
+            return
+        self._refill(now)
+        self.level = min(self.capacity, self.level - amount)
+
+
+class _Waiter:
+    """A call waiting for admission."""
+
+    __slots__ = ("tenant", "tokens", "priority", "future", "queued_at")
+
+    def __init__(self, tenant: str, tokens: int, priority: int, future: "asyncio.Future[None]", queued_at: float):
+        self.tenant = tenant
+        self.tokens = tokens
+        self.priority = priority
+        self.future = future
+        self.queued_at = queued_at
+
+
+class Scheduler:
+    """
+    Admits model calls within rate limits, by priority and fairly between tenants.
+
+    Waiting calls are ordered by priority, then by a virtual finish tag: a
+    tenant's next call is tagged its tokens after the later of the tenant's
+    previous tag and the tag last admitted. A single dispatcher task admits
+    the head of the queue as soon as both buckets allow it.
+
+    Args:
+        requests_per_minute: Requests allowed per minute, 0 for no limit
+        tokens_per_minute: Tokens allowed per minute, 0 for no limit
+        max_queue: Calls allowed to wait before new ones are rejected
+    """
+
+    def __init__(self, requests_per_minute: float = 0, tokens_per_minute: float = 0, max_queue: int = 100):
+        self.loop = asyncio.get_running_loop()
+        now = self.loop.time()
+        self.requests = TokenBucket(requests_per_minute, now)
+        self.tokens = TokenBucket(tokens_per_minute, now)
+        self.max_queue = max_queue
+        self.queue: List[Tuple[int, float, int, _Waiter]] = []
+        self.waiting = 0  # Calls in the queue that are still waiting, the rest were cancelled
+        self.finish_tags: Dict[str, float] = {}
+        self.virtual_time = 0.0
+        self.sequence = itertools.count()
+        self.dispatcher: Optional["asyncio.Task[None]"] = None
+
+    def _ready_in(self, tokens: int) -> float:
+        now = self.loop.time()
+        return max(self.requests.wait(1, now), self.tokens.wait(tokens, now))
+
+    def _admit(self, waiter: _Waiter) -> None:
+        now = self.loop.time()
+        self.requests.take(1, now)
+        self.tokens.take(waiter.tokens, now)
+        _stats["admitted"] += 1
+        _stats["tokens_estimated"] += waiter.tokens
+        observe("story_admission_wait_seconds", now - waiter.queued_at)
+        _stats["wait_seconds_total"] += now - waiter.queued_at
+
+    async def acquire(self, tenant: str, tokens: int, priority: int = INTERACTIVE) -> None:
+        """
+        Wait until a call may be sent.
+
+        Args:
+            tenant: Who the call is made for
+            tokens: Estimated tokens of the call
+            priority: INTERACTIVE or BULK
+
+        Raises:
+            QueueFullError: The queue already holds max_queue calls
+        """
+        now = self.loop.time()
+        waiter = _Waiter(tenant, tokens, priority, self.loop.create_future(), now)
+        if not self.waiting and self._ready_in(tokens) == 0:
+            self._admit(waiter)
+            return
+        if self.waiting >= self.max_queue:
+            _stats["rejected"] += 1
+            increment("story_admission_rejected_total", tenant=tenant)
+            raise QueueFullError(f"{self.waiting} model calls are already waiting")
+
+        tag = max(self.virtual_time, self.finish_tags.get(tenant, 0.0)) + tokens
+        self.finish_tags[tenant] = tag
+        heapq.heappush(self.queue, (priority, tag, next(self.sequence), waiter))
+        self.waiting += 1
+        _stats["queued"] += 1
+        if self.dispatcher is None or self.dispatcher.done():
+            self.dispatcher = self.loop.create_task(self._dispatch())
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if not waiter.future.done() or waiter.future.cancelled():
+                waiter.future.cancel()
+                self.waiting -= 1
+                _stats["cancelled"] += 1
+                if len(self.queue) > 2 * self.waiting:
+                    # Cancelled calls are only dropped at the head, drop them all once they are most of the queue
+                    self.queue = [entry for entry in self.queue if not entry[3].future.done()]
+                    heapq.heapify(self.queue)
+            else:
+                # Admitted just as it was cancelled, give the tokens back
+                self.settle(tokens, 0)
+            raise
+
+    async def _dispatch(self) -> None:
+        while self.queue:
+            _, tag, _, waiter = self.queue[0]
+            if waiter.future.done():
+                heapq.heappop(self.queue)
+                continue
+            wait = self._ready_in(waiter.tokens)
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            heapq.heappop(self.queue)
+            self.waiting -= 1
+            self.virtual_time = max(self.virtual_time, tag)
+            self._admit(waiter)
+            waiter.future.set_result(None)
+        # Forget tenants that have nothing queued, their tags are behind virtual_time anyway
+        self.finish_tags.clear()
+
+    def settle(self, estimated: int, used: int) -> None:
+        """Correct the token bucket once a call reports the tokens it used."""
+        _stats["tokens_used"] += used
+        self.tokens.take(used - estimated, self.loop.time())
+
+    def depth(self) -> int:
+        """Calls waiting for admission."""
+        return self.waiting
+
+
+def get_scheduler() -> Scheduler:
+    """Return the scheduler of the running event loop, creating it on first use."""
+    loop = asyncio.get_running_loop()
+    scheduler = _schedulers.get(loop)
+    if scheduler is None:
+        for other in [other for other in _schedulers if other.is_closed()]:
+            del _schedulers[other]
+        scheduler = _schedulers[loop] = Scheduler(
+            requests_per_minute=float(os.getenv("STORY_REQUESTS_PER_MINUTE", "0")),
+            tokens_per_minute=float(os.getenv("STORY_TOKENS_PER_MINUTE", "0")),
+            max_queue=int(os.getenv("STORY_MODEL_QUEUE_LIMIT", "100")),
+        )
+    return scheduler
+
+
+def estimate_tokens(prompt: Any) -> int:
+    """Estimated tokens of a call: about four characters per prompt token, plus the expected completion."""
+    if isinstance(prompt, str):
+        characters = len(prompt)
+    else:
+        characters = sum(len(str(getattr(message, "content", message))) for message in prompt)
+    return characters // 4 + int(os.getenv("STORY_COMPLETION_TOKENS_ESTIMATE", "1000"))
+
+
+def call_priority(tool_choice: Optional[str]) -> int:
+    """BULK for calls that write a whole story or outline, INTERACTIVE for the rest."""
+    return BULK if tool_choice in _BULK_TOOLS else INTERACTIVE
+
+
+def tenant_of(config: Optional[RunnableConfig]) -> str:
+    """The tenant a call is made for: the tenant_id of the config, else its thread."""
+    configurable = (config or {}).get("configurable") or {}
+    return str(configurable.get("tenant_id") or configurable.get("thread_id") or "default")
+
+
+def admission_stats() -> Dict[str, float]:
+    """Return admission counters and the current queue depth."""
+    return {
+        **_stats,
+        "queue_depth": sum(scheduler.depth() for scheduler in list(_schedulers.values())),
+    }
+
+
+register_collector("story_admission", admission_stats)
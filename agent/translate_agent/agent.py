@@ -1,20 +1,53 @@
 """
 This is the main entry point for the AI.
 It defines the workflow graph and the entry point for the agent.
+
+route_turn sends each turn to the node that handles it: create_node, or
+outline_node for a long-form story, for a new story, edit_node for an edit
+request, revert_node for a version command and confirm_node for the answer to
+a confirmation. The nodes that start a turn trim the history first. A new or edited
+story goes on to confirm_node in the same turn, which waits for the user's
+answer.
+
+build_graph() compiles the graph on first use and caches it, so importing this
+module stays cheap: the OpenAI client, CopilotKit and the checkpoint database
+are only loaded when a graph is built or a node first runs. The module
+attribute graph is the default graph, built on first access.
 """
 # pylint: disable=line-too-long, unused-import
 
-from typing import cast, TypedDict, Any, Dict, List, Callable, Literal
-from langchain_openai import ChatOpenAI
+import functools
+import inspect
+import os
+import threading
+import time
+from typing import cast, TypedDict, Annotated, Any, Dict, List, Callable, Literal, Optional, Tuple
 from langchain_core.messages import SystemMessage, ToolMessage, AIMessage, HumanMessage
 from langchain_core.runnables import RunnableConfig
-from langgraph.graph import StateGraph, END
-from langgraph.checkpoint.memory import MemorySaver
+from langgraph.graph import StateGraph, START, END
 from langgraph.graph import MessagesState
+from langgraph.graph.state import CompiledStateGraph
+from langgraph.checkpoint.base import BaseCheckpointSaver
 from langgraph.types import interrupt
-from copilotkit.langgraph import copilotkit_customize_config
-import difflib
-import re
+from translate_agent.diff import StreamingDiff, compact_diff, coarse_compact_diff, render_diff_markup
+from translate_agent.workers import run_in_pool
+from translate_agent.models import ModelFactory, configured_model
+from translate_agent.history import trim_history, summary_messages
+from translate_agent.patch import StoryPatch, apply_patch
+from translate_agent.mechanical import mechanical_edit, mechanical_enabled
+from translate_agent.prompts import (
+    CREATE_INSTRUCTIONS, EDIT_INSTRUCTIONS, PATCH_INSTRUCTIONS, create_messages, edit_messages, patch_messages
+)
+from translate_agent.streaming import astream_tool_call
+from translate_agent.cache import cache_scope, cached_call, fingerprint
+from translate_agent.metrics import instrument_node, record
+from translate_agent.admission import QueueFullError
+from translate_agent.versions import get_history, parse_command, record_version, run_history, versions_enabled
+from translate_agent.library import finalize_story
+from translate_agent.long_form import (
+    outline_node, dispatch_chapters, chapter_node, assemble_node,
+    merge_chapters, is_long_form, story_prompt
+)
 
 class StoryContent(TypedDict):
     """Contains the story content and metadata."""
@@ -30,53 +63,49 @@ class AgentState(MessagesState):
     input: str
     pending_confirmation: bool
     is_edit: bool  # Flag to indicate if this is an edit to an existing story
-    diff_markup: str  # HTML markup with diff highlighting
+    diff_ops: List[List[Any]]  # Changed runs between previous_story_content and story_content
+    diff_markup: str  # HTML markup with diff highlighting, only set when STORY_DIFF_MARKUP is enabled
+    history_summary: str  # Rolling summary of messages trimmed from the history
+    long_form: bool  # Write new stories chapter by chapter
+    story_outline: Dict[str, Any]  # Outline of the long-form story being written
+    chapters: Annotated[List[Dict[str, Any]], merge_chapters]  # Chapters written so far
+    bypass_cache: bool  # Ask the model again instead of reusing a cached response
+    story_version: int  # Version of story_content in the thread's version history, 0 if not recorded
+
+class GraphConfig(TypedDict, total=False):
+    """Dependencies of the story graph, anything missing uses the default."""
+    model: ModelFactory  # Called like models.get_model(model, tools, tool_choice)
+    checkpointer: BaseCheckpointSaver  # Default: checkpoint.make_checkpointer()
+    tools: Dict[str, Any]  # "story" and "patch" tool schemas, with the fields of StoryContent and StoryPatch
+
+DEFAULT_TOOLS: Dict[str, Any] = {"story": StoryContent, "patch": StoryPatch}
+
+def story_tool(config: RunnableConfig, role: str) -> Any:
+    """Return the tool schema the graph uses for role, "story" or "patch"."""
+    tools = (config.get("configurable") or {}).get("story_tools") or {}
+    return tools.get(role) or DEFAULT_TOOLS[role]
+
+def last_request(state: AgentState) -> str:
+    """Return the text of the last message when the user sent it, or an empty string."""
+    if state["messages"]:
+        last_message = state["messages"][-1]
+        if isinstance(last_message, HumanMessage) and isinstance(last_message.content, str):
+            return last_message.content
+    return ""
 
-def generate_diff_markup(old_text: str, new_text: str) -> str:
-    """
-    Generate HTML markup with additions and deletions highlighted.
-    
-    Args:
-        old_text: The previous version of the text
-        new_text: The new version of the text
-        
-    Returns:
-        HTML markup with added words in green and deleted words in red
-    """
-    # For debugging
-    print(f"Generating diff between:\nOLD: {old_text[:100]}...\nNEW: {new_text[:100]}...")
-    
-    # Split text into words while preserving whitespace and punctuation
-    def tokenize(text):
-        # This pattern captures words, punctuation, and whitespace as separate tokens
-        return re.findall(r'\S+|\s+', text)
-    
-    old_tokens = tokenize(old_text)
-    new_tokens = tokenize(new_text)
-    
-    # Use difflib to find differences
-    diff = difflib.SequenceMatcher(None, old_tokens, new_tokens)
-    
-    # Generate markup
-    markup = []
-    for tag, i1, i2, j1, j2 in diff.get_opcodes():
-        if tag == 'equal':
-            # Unchanged text
-            markup.extend(old_tokens[i1:i2])
-        elif tag == 'delete':
-            # Deleted text (red)
-            markup.extend([f'<span class="deleted">{token}</span>' for token in old_tokens[i1:i2]])
-        elif tag == 'insert':
-            # Added text (green)
-            markup.extend([f'<span class="added">{token}</span>' for token in new_tokens[j1:j2]])
-        elif tag == 'replace':
-            # Replaced text (both red and green)
-            markup.extend([f'<span class="deleted">{token}</span>' for token in old_tokens[i1:i2]])
-            markup.extend([f'<span class="added">{token}</span>' for token in new_tokens[j1:j2]])
-    
-    result = ''.join(markup)
-    print(f"Generated diff markup (first 200 chars): {result[:200]}...")
-    return result
+def route_turn(state: AgentState) -> Literal["confirm_node", "outline_node", "revert_node", "edit_node", "create_node"]:
+    """Send each turn to the node that handles it."""
+    if state.get("pending_confirmation", False):
+        return "confirm_node"
+    if state.get("story_content"):
+        request = last_request(state)
+        if request and parse_command(request) is not None:
+            return "revert_node"
+        if request:
+            return "edit_node"
+    elif is_long_form(state):
+        return "outline_node"
+    return "create_node"
 
 def should_continue(state: AgentState) -> Literal["continue", "end"]:
     """Determine if we should continue or end the workflow."""
@@ -84,479 +113,324 @@ def should_continue(state: AgentState) -> Literal["continue", "end"]:
         return "continue"
     return "end"
 
-async def story_creator_node(state: AgentState, config: RunnableConfig):
-    """Chatbot that creates engaging stories"""
+def settle(state: AgentState, story: StoryContent) -> Dict[str, Any]:
+    """
+    Return the update that makes story the settled story, with no draft pending.
 
-    config = copilotkit_customize_config(
-        config,
-        emit_intermediate_state=[
-            {
-                "state_key": "story_content",
-                "tool": "StoryContent"
-            },
-            {
-                "state_key": "diff_markup",
-                "tool": "string"
-            }
+    Fields that already have their settled value are left out, so confirming
+    or cancelling writes only what changes.
+    """
+    update: Dict[str, Any] = {"pending_confirmation": False}
+    if state.get("is_edit"):
+        update["is_edit"] = False  # No longer in edit mode
+    if state.get("story_content") != story:
+        update["story_content"] = story
+    if state.get("previous_story_content") != story:
+        update["previous_story_content"] = story  # The next edit starts from this version
+    if state.get("diff_ops"):
+        update["diff_ops"] = []  # Clear the diff
+    if state.get("diff_markup"):
+        update["diff_markup"] = ""  # Clear the diff markup
+    return update
+
+def preview_story(args: Any) -> Optional[Dict[str, Any]]:
+    """Show the StoryContent arguments received so far."""
+    if not isinstance(args, dict) or not args:
+        return None
+    return {"story_content": args, "diff_ops": [], "diff_markup": ""}
+
+async def version_command(state: AgentState, config: RunnableConfig, command: Tuple[str, Optional[int]],
+                          started: float) -> Dict[str, Any]:
+    """List the story's versions, or go back to one of them without asking the model."""
+    if not versions_enabled():
+        return {"messages": [AIMessage(content="Version history is turned off.")]}
+    history = get_history()
+    thread_id = str(config["configurable"].get("thread_id", ""))
+    current = state.get("story_version", 0)
+    kind, target = command
+
+    if kind == "list":
+        versions = await run_history(history.list, thread_id)
+        lines = [
+            f"{'*' if version['version'] == current else ' '} {version['version']}. {version['title']} "
+            f"({version['status']}) {version['label']}".rstrip()
+            for version in versions if version["status"] != "cancelled"
         ]
-    )
+        record("story_branch_seconds", started, branch="versions")
+        return {"messages": [AIMessage(content="\n".join(["Versions of this story:", *lines]) if lines else
+                                       "There are no saved versions of this story yet.")]}
+
+    if kind == "undo":
+        target = await run_history(history.parent, thread_id, current) if current else None
+    if not target:
+        return {"messages": [AIMessage(content="There is no earlier version to go back to.")]}
+    try:
+        version, story = await run_history(history.revert, thread_id, target, current or None,
+                                           state.get("story_content"))
+    except KeyError:
+        return {"messages": [AIMessage(content=f"There is no version {target} of this story.")]}
+    await finalize_story(config, story)
+    record("story_branch_seconds", started, branch="revert")
+    return {
+        "messages": [AIMessage(content=f"I've restored version {target} of the story '{story['title']}'.")],
+        **settle(state, story),
+        "story_version": version,
+    }
 
-    # Check if we're waiting for confirmation
-    if state.get("pending_confirmation", False):
-        # We already have the story content in the state, now ask for confirmation
-        story_content = state.get("story_content")
-        previous_story_content = state.get("previous_story_content")
-        is_edit = state.get("is_edit", False)
-        
-        confirmation_message = ""
-        if is_edit:
-            confirmation_message = f"I've updated the story '{story_content['title']}' with your requested changes. Would you like to keep these changes?"
-        else:
-            confirmation_message = f"Would you like to proceed with this story?"
-        
-        answer = interrupt(confirmation_message)
-        
-        # If user cancels, revert to the previous version if this is an edit
-        if answer == "Cancel":
-            if is_edit and previous_story_content:
-                return {
-                    "messages": [
-                        *state["messages"],
-                        AIMessage(content="I've reverted back to the previous version of the story.")
-                    ],
-                    "story_content": previous_story_content,  # Revert to previous version
-                    "previous_story_content": previous_story_content,  # Keep track of the previous version
-                    "pending_confirmation": False,  # Reset the confirmation flag
-                    "is_edit": False,  # No longer in edit mode
-                    "diff_markup": ""  # Clear the diff markup
-                }
-            else:
-                # If this is the first story, just keep it in preview mode
-                return {
-                    "messages": [
-                        *state["messages"],
-                        AIMessage(content="I'll keep the story in preview mode. Let me know if you'd like to make any changes.")
-                    ],
-                    "story_content": story_content,
-                    "previous_story_content": story_content,  # Keep track of the current version
-                    "pending_confirmation": False,  # Reset the confirmation flag
-                    "is_edit": False,  # No longer in edit mode
-                    "diff_markup": ""  # Clear the diff markup
-                }
-        
-        # User confirmed, keep the new version
+async def confirm_node(state: AgentState, config: RunnableConfig):
+    """Ask the user to keep or cancel the story waiting for confirmation."""
+    # We already have the story content in the state, now ask for confirmation
+    story_content = state["story_content"]
+    previous_story_content = state.get("previous_story_content")
+    is_edit = state.get("is_edit", False)
+
+    confirmation_message = ""
+    if is_edit:
+        confirmation_message = f"I've updated the story '{story_content['title']}' with your requested changes. Would you like to keep these changes?"
+    else:
+        confirmation_message = f"Would you like to proceed with this story?"
+
+    # The node runs again from the start when the graph resumes, so nothing is done before the answer
+    answer = interrupt(confirmation_message)
+    started = time.perf_counter()
+    story_version = state.get("story_version", 0)
+    thread_id = str(config["configurable"].get("thread_id", ""))
+
+    # If user cancels, revert to the previous version if this is an edit
+    if answer == "Cancel":
+        record("story_branch_seconds", started, branch="cancel")
+        if is_edit and previous_story_content:
+            update: Dict[str, Any] = {}
+            if story_version:
+                history = get_history()
+                await run_history(history.set_status, thread_id, story_version, "cancelled")
+                update["story_version"] = await run_history(history.parent, thread_id, story_version) or 0  # The version the edit started from
+            return {
+                "messages": [
+                    AIMessage(content="I've reverted back to the previous version of the story.")
+                ],
+                **settle(state, previous_story_content),  # Revert to previous version
+                **update
+            }
+        # If this is the first story, just keep it in preview mode
         return {
             "messages": [
-                *state["messages"],
-                AIMessage(content=f"Great! I've finalized your story '{story_content['title']}'. You can view it in the main panel.")
+                AIMessage(content="I'll keep the story in preview mode. Let me know if you'd like to make any changes.")
             ],
-            "story_content": story_content,
-            "previous_story_content": story_content,  # Update the previous version to the current one
-            "pending_confirmation": False,  # Reset the confirmation flag
-            "is_edit": False,  # No longer in edit mode
-            "diff_markup": ""  # Clear the diff markup
+            **settle(state, story_content)
         }
 
-    # Check if we already have a story and this is an edit request
-    existing_story = state.get("story_content")
-    if existing_story and not state.get("pending_confirmation", False):
-        # Extract edit request from the last message
-        edit_request = ""
-        if state["messages"]:
-            last_message = state["messages"][-1]
-            if isinstance(last_message, HumanMessage):
-                edit_request = last_message.content
-        
-        # If we already have a story and received a new message, treat it as an edit request
-        if edit_request:
-            edit_config = copilotkit_customize_config(
-                config,  # Start with base config
-                emit_messages=False,  # Disable message streaming
-                emit_intermediate_state=None  # Disable intermediate state updates
-            )
-            
-            # This is an edit request, generate a new version of the story
-            model = ChatOpenAI(model="gpt-4o").bind_tools(
-                [StoryContent],
-                parallel_tool_calls=False,
-                tool_choice="StoryContent"  # Always generate story content
-            )
-            
-            response = await model.ainvoke([
-                SystemMessage(
-                    content=f"""
-                    You are a creative storyteller that edits stories based on user requests.
-                    You will be given an existing story and an edit request.
-                    Make the requested changes while maintaining the overall narrative structure and quality.
-                    
-                    Existing story:
-                    Title: {existing_story['title']}
-                    Genre: {existing_story['genre']}
-                    Summary: {existing_story['summary']}
-                    Story: {existing_story['story']}
-                    
-                    Edit request: "{edit_request}"
-                    
-                    Generate the updated story with the requested changes.
-                    """
-                ),
-            ], edit_config)
-            
-            if hasattr(response, "tool_calls") and len(getattr(response, "tool_calls")) > 0:
-                ai_message = cast(AIMessage, response)
-                updated_story = cast(AIMessage, response).tool_calls[0]["args"]
-                
-                # Generate diff markup for the story content
-                diff_markup = generate_diff_markup(existing_story['story'], updated_story['story'])
-                
-                # First, update the UI with the updated story content
-                return {
-                    "messages": [
-                        *state["messages"],
-                        response,  # Include the AI message with tool calls
-                        ToolMessage(  # Add the tool message to respond to the tool call
-                            content="Story updated successfully",
-                            tool_call_id=ai_message.tool_calls[0]["id"]
-                        ),
-                        AIMessage(content=f"I've updated the story with your requested changes. Please confirm if you'd like to keep these changes.")
-                    ],
-                    "story_content": updated_story,  # Set the updated story as the current version
-                    "previous_story_content": existing_story,  # Save the previous version
-                    "pending_confirmation": True,  # Set flag to indicate we're waiting for confirmation
-                    "is_edit": True,  # Flag this as an edit operation
-                    "diff_markup": diff_markup  # Include the diff markup
-                }
-
-    # If we don't have a story yet or it's not an edit request, generate a new story
-    model = ChatOpenAI(model="gpt-4o").bind_tools(
-        [StoryContent],
-        parallel_tool_calls=False,
-        tool_choice="StoryContent"  # Always generate story content
-    )
+    # User confirmed, keep the new version
+    if story_version:
+        await run_history(get_history().set_status, thread_id, story_version, "confirmed")
+    await finalize_story(config, story_content)
+    record("story_branch_seconds", started, branch="confirm")
+    return {
+        "messages": [
+            AIMessage(content=f"Great! I've finalized your story '{story_content['title']}'. You can view it in the main panel.")
+        ],
+        **settle(state, story_content)
+    }
 
-    # Extract story prompt from the input or last message
-    story_prompt = state.get("input", "")
-    if not story_prompt and state["messages"]:
-        last_message = state["messages"][-1]
-        if isinstance(last_message, HumanMessage):
-            story_prompt = last_message.content
-
-    response = await model.ainvoke([
-        SystemMessage(
-            content=f"""
-            You are a creative storyteller that creates engaging and imaginative stories based on user prompts or descriptions.
-            Generate stories with clear narrative structure, engaging characters, and vivid descriptions.
-            Always generate a complete story with a title, genre, summary, and the full story text.
-            Use the provided prompt to create an engaging story: "{story_prompt}"
-            """
-        ),
-        *state["messages"],
-    ], config)
+async def revert_node(state: AgentState, config: RunnableConfig):
+    """List the story's versions or go back to one of them."""
+    started = time.perf_counter()
+    return await version_command(state, config, cast(Tuple[str, Optional[int]], parse_command(last_request(state))), started)
+
+async def edit_node(state: AgentState, config: RunnableConfig):
+    """Apply the user's edit request to the current story"""
+
+    from copilotkit.langgraph import copilotkit_customize_config  # pylint: disable=import-outside-toplevel
+
+    # story_content is emitted by astream_tool_call while the story streams,
+    # throttled to STORY_EMIT_INTERVAL instead of once per token
+    config = copilotkit_customize_config(config)
+    story_schema = story_tool(config, "story")
+
+    started = time.perf_counter()
+    bypass_cache = bool(state.get("bypass_cache", False))
+    existing_story = state["story_content"]
+    edit_request = last_request(state)
+
+    response = None
+    updated_story = None
+    branch = "edit"
+
+    # Renames, title and genre changes and literal replacements don't need the model
+    mechanical = mechanical_edit(existing_story, edit_request) if mechanical_enabled() else None
+    if mechanical is not None:
+        updated_story, change = mechanical
+        response = AIMessage(content=f"I've {change}.")
+        branch = "mechanical_edit"
+
+    # Ask for targeted paragraph changes first, so small edits don't resend the whole story
+    if updated_story is None and os.getenv("STORY_EDIT_MODE", "patch").lower() == "patch":
+        patch_schema = story_tool(config, "patch")
+        patch_model = configured_model(
+            config,
+            "gpt-4o",
+            [patch_schema],
+            tool_choice=patch_schema.__name__  # Always generate a patch
+        )
+
+        def preview_patch(args: Any):
+            # Show the operations received so far, the last one may still be streaming
+            if not isinstance(args, dict):
+                return None
+            operations = [
+                operation for operation in args.get("operations") or []
+                if isinstance(operation, dict) and "index" in operation
+                and (operation.get("op") == "delete" or operation.get("text"))
+            ]
+            preview = apply_patch(existing_story, {**args, "operations": operations})
+            if preview is None:
+                return None
+            return {"story_content": preview, "diff_ops": [], "diff_markup": ""}
+
+        patch_response = await cached_call(
+            fingerprint(f"gpt-4o/{patch_schema.__name__}", PATCH_INSTRUCTIONS, edit_request, existing_story,
+                        cache_scope(config)),
+            lambda: astream_tool_call(patch_model, patch_messages(existing_story, edit_request), config, state, preview_patch),
+            bypass=bypass_cache
+        )
+
+        if hasattr(patch_response, "tool_calls") and len(getattr(patch_response, "tool_calls")) > 0:
+            updated_story = apply_patch(existing_story, cast(AIMessage, patch_response).tool_calls[0]["args"])
+            if updated_story is not None:
+                response = patch_response
+
+    # Fall back to regenerating the whole story when the patch is missing or invalid
+    streamed_diff = StreamingDiff(existing_story['story'])
+    streamed = False
+    if updated_story is None:
+        model = configured_model(
+            config,
+            "gpt-4o",
+            [story_schema],
+            tool_choice=story_schema.__name__  # Always generate story content
+        )
+
+        def preview_edit(args: Any):
+            # Highlight the changes in the paragraphs that are complete, the rest is still streaming
+            nonlocal streamed
+            update = preview_story(args)
+            if update is None or not isinstance(args.get("story"), str):
+                return update
+            streamed = True
+            return {
+                **update,
+                "previous_story_content": existing_story,
+                "is_edit": True,
+                "diff_ops": list(streamed_diff.update(args["story"])),
+                "diff_progress": list(streamed_diff.progress)  # Only in the emitted state, the UI shows the text after it as is
+            }
 
-    if hasattr(response, "tool_calls") and len(getattr(response, "tool_calls")) > 0:
-        ai_message = cast(AIMessage, response)
-        story_content = cast(AIMessage, response).tool_calls[0]["args"]
-        
-        # First, update the UI with the story content and include the tool message response
-        # to satisfy OpenAI's requirement that tool calls must be followed by tool messages
+        response = await cached_call(
+            fingerprint(f"gpt-4o/{story_schema.__name__}", EDIT_INSTRUCTIONS, edit_request, existing_story,
+                        cache_scope(config)),
+            lambda: astream_tool_call(model, edit_messages(existing_story, edit_request), config, state, preview_edit),
+            bypass=bypass_cache
+        )
+
+        if hasattr(response, "tool_calls") and len(getattr(response, "tool_calls")) > 0:
+            updated_story = cast(AIMessage, response).tool_calls[0]["args"]
+
+    if updated_story is None:
+        # The model answered without calling the tool
         return {
             "messages": [
-                *state["messages"],
-                response,  # Include the AI message with tool calls
-                ToolMessage(  # Add the tool message to respond to the tool call
-                    content="Story generated successfully",
-                    tool_call_id=ai_message.tool_calls[0]["id"]
-                ),
-                AIMessage(content=f"Please confirm if you'd like to keep it.")
+                response,
             ],
-            "story_content": story_content,
-            "previous_story_content": story_content,  # Initialize the previous version to be the same as the current
-            "pending_confirmation": True,  # Set flag to indicate we're waiting for confirmation
-            "is_edit": False,  # This is not an edit operation
-            "diff_markup": ""  # No diff markup for new stories
         }
 
+    ai_message = cast(AIMessage, response)
+
+    diff_started = time.perf_counter()
+    diff_ops = None
+    if streamed:
+        # Most of the story was diffed while it streamed
+        try:
+            diff_ops = streamed_diff.finish(updated_story['story'])
+        except ValueError:
+            pass  # The final story isn't the streamed one, diff it whole
+    if diff_ops is None:
+        # Diff the story content off the event loop
+        diff_ops = await run_in_pool(
+            compact_diff,
+            existing_story['story'],
+            updated_story['story'],
+            fallback=coarse_compact_diff
+        )
+    record("story_diff_seconds", diff_started, kind="ops")
+    diff_markup = ""
+    if os.getenv("STORY_DIFF_MARKUP", "false").lower() == "true":
+        diff_markup = render_diff_markup(existing_story['story'], updated_story['story'], diff_ops)
+    story_version = await record_version(
+        config, updated_story, state.get("story_version"), existing_story, diff_ops, str(edit_request)
+    )
+    record("story_branch_seconds", started, branch=branch)
+
+    # First, update the UI with the updated story content
     return {
-        "messages": [           
-            response,
+        "messages": [
+            response,  # Include the AI message with tool calls
+            *([ToolMessage(  # Add the tool message to respond to the tool call
+                content="Story updated successfully",
+                tool_call_id=ai_message.tool_calls[0]["id"]
+            )] if ai_message.tool_calls else []),  # A mechanical edit has no tool call
+            AIMessage(content=f"I've updated the story with your requested changes. Please confirm if you'd like to keep these changes.")
         ],
+        "story_content": updated_story,  # Set the updated story as the current version
+        "previous_story_content": existing_story,  # Save the previous version
+        "pending_confirmation": True,  # Set flag to indicate we're waiting for confirmation
+        "is_edit": True,  # Flag this as an edit operation
+        "diff_ops": diff_ops,  # Include the changed ranges
+        "diff_markup": diff_markup,  # Include the rendered diff, if enabled
+        "bypass_cache": False,  # The bypass only applies to this request
+        "story_version": story_version  # The draft version, confirmed or cancelled next
     }
 
-# Define the workflow
-workflow = StateGraph(AgentState)
-workflow.add_node("story_creator_node", cast(Any, story_creator_node))
-workflow.set_entry_point("story_creator_node")
-
-# Define the conditional edges
-workflow.add_conditional_edges(
-    "story_creator_node",
-    should_continue,
-    {
-        "continue": "story_creator_node",
-        "end": END
-    }
-)
-
-memory = MemorySaver()
-graph = workflow.compile(checkpointer=memory)
-"""
-This is the main entry point for the AI.
-It defines the workflow graph and the entry point for the agent.
-"""
-# pylint: disable=line-too-long, unused-import
-
-from typing import cast, TypedDict, Any, Dict, List, Callable, Literal
-from langchain_openai import ChatOpenAI
-from langchain_core.messages import SystemMessage, ToolMessage, AIMessage, HumanMessage
-from langchain_core.runnables import RunnableConfig
-from langgraph.graph import StateGraph, END
-from langgraph.checkpoint.memory import MemorySaver
-from langgraph.graph import MessagesState
-from langgraph.types import interrupt
-from copilotkit.langgraph import copilotkit_customize_config
-import difflib
-import re
-
-class StoryContent(TypedDict):
-    """Contains the story content and metadata."""
-    title: str
-    story: str
-    genre: str
-    summary: str
-
-class AgentState(MessagesState):
-    """Contains the state of the agent."""
-    story_content: StoryContent  # Current version of the story
-    previous_story_content: StoryContent  # Previous version of the story
-    input: str
-    pending_confirmation: bool
-    is_edit: bool  # Flag to indicate if this is an edit to an existing story
-    diff_markup: str  # HTML markup with diff highlighting
+async def create_node(state: AgentState, config: RunnableConfig):
+    """Chatbot that creates engaging stories"""
 
-def generate_diff_markup(old_text: str, new_text: str) -> str:
-    """
-    Generate HTML markup with additions and deletions highlighted.
-    
-    Args:
-        old_text: The previous version of the text
-        new_text: The new version of the text
-        
-    Returns:
-        HTML markup with added words in green and deleted words in red
-    """
-    # For debugging
-    print(f"Generating diff between:\nOLD: {old_text[:100]}...\nNEW: {new_text[:100]}...")
-    
-    # Split text into words while preserving whitespace and punctuation
-    def tokenize(text):
-        # This pattern captures words, punctuation, and whitespace as separate tokens
-        return re.findall(r'\S+|\s+', text)
-    
-    old_tokens = tokenize(old_text)
-    new_tokens = tokenize(new_text)
-    
-    # Use difflib to find differences
-    diff = difflib.SequenceMatcher(None, old_tokens, new_tokens)
-    
-    # Generate markup
-    markup = []
-    for tag, i1, i2, j1, j2 in diff.get_opcodes():
-        if tag == 'equal':
-            # Unchanged text
-            markup.extend(old_tokens[i1:i2])
-        elif tag == 'delete':
-            # Deleted text (red)
-            markup.extend([f'<span class="deleted">{token}</span>' for token in old_tokens[i1:i2]])
-        elif tag == 'insert':
-            # Added text (green)
-            markup.extend([f'<span class="added">{token}</span>' for token in new_tokens[j1:j2]])
-        elif tag == 'replace':
-            # Replaced text (both red and green)
-            markup.extend([f'<span class="deleted">{token}</span>' for token in old_tokens[i1:i2]])
-            markup.extend([f'<span class="added">{token}</span>' for token in new_tokens[j1:j2]])
-    
-    result = ''.join(markup)
-    print(f"Generated diff markup (first 200 chars): {result[:200]}...")
-    return result
+    from copilotkit.langgraph import copilotkit_customize_config  # pylint: disable=import-outside-toplevel
 
-def should_continue(state: AgentState) -> Literal["continue", "end"]:
-    """Determine if we should continue or end the workflow."""
-    if state.get("pending_confirmation", False):
-        return "continue"
-    return "end"
+    # story_content is emitted by astream_tool_call while the story streams,
+    # throttled to STORY_EMIT_INTERVAL instead of once per token
+    config = copilotkit_customize_config(config)
+    story_schema = story_tool(config, "story")
 
-async def story_creator_node(state: AgentState, config: RunnableConfig):
-    """Chatbot that creates engaging stories"""
+    started = time.perf_counter()
+    bypass_cache = bool(state.get("bypass_cache", False))
 
-    config = copilotkit_customize_config(
+    model = configured_model(
         config,
-        emit_intermediate_state=[
-            {
-                "state_key": "story_content",
-                "tool": "StoryContent"
-            },
-            {
-                "state_key": "diff_markup",
-                "tool": "string"
-            }
-        ]
+        "gpt-4o",
+        [story_schema],
+        tool_choice=story_schema.__name__  # Always generate story content
     )
 
-    # Check if we're waiting for confirmation
-    if state.get("pending_confirmation", False):
-        # We already have the story content in the state, now ask for confirmation
-        story_content = state.get("story_content")
-        previous_story_content = state.get("previous_story_content")
-        is_edit = state.get("is_edit", False)
-        
-        confirmation_message = ""
-        if is_edit:
-            confirmation_message = f"I've updated the story '{story_content['title']}' with your requested changes. Would you like to keep these changes?"
-        else:
-            confirmation_message = f"Would you like to proceed with this story?"
-        
-        answer = interrupt(confirmation_message)
-        
-        # If user cancels, revert to the previous version if this is an edit
-        if answer == "Cancel":
-            if is_edit and previous_story_content:
-                return {
-                    "messages": [
-                        *state["messages"],
-                        AIMessage(content="I've reverted back to the previous version of the story.")
-                    ],
-                    "story_content": previous_story_content,  # Revert to previous version
-                    "previous_story_content": previous_story_content,  # Keep track of the previous version
-                    "pending_confirmation": False,  # Reset the confirmation flag
-                    "is_edit": False,  # No longer in edit mode
-                    "diff_markup": ""  # Clear the diff markup
-                }
-            else:
-                # If this is the first story, just keep it in preview mode
-                return {
-                    "messages": [
-                        *state["messages"],
-                        AIMessage(content="I'll keep the story in preview mode. Let me know if you'd like to make any changes.")
-                    ],
-                    "story_content": story_content,
-                    "previous_story_content": story_content,  # Keep track of the current version
-                    "pending_confirmation": False,  # Reset the confirmation flag
-                    "is_edit": False,  # No longer in edit mode
-                    "diff_markup": ""  # Clear the diff markup
-                }
-        
-        # User confirmed, keep the new version
-        return {
-            "messages": [
-                *state["messages"],
-                AIMessage(content=f"Great! I've finalized your story '{story_content['title']}'. You can view it in the main panel.")
-            ],
-            "story_content": story_content,
-            "previous_story_content": story_content,  # Update the previous version to the current one
-            "pending_confirmation": False,  # Reset the confirmation flag
-            "is_edit": False,  # No longer in edit mode
-            "diff_markup": ""  # Clear the diff markup
-        }
+    # Extract story prompt from the input or last message
+    prompt = story_prompt(state)
 
-    # Check if we already have a story and this is an edit request
-    existing_story = state.get("story_content")
-    if existing_story and not state.get("pending_confirmation", False):
-        # Extract edit request from the last message
-        edit_request = ""
-        if state["messages"]:
-            last_message = state["messages"][-1]
-            if isinstance(last_message, HumanMessage):
-                edit_request = last_message.content
-        
-        # If we already have a story and received a new message, treat it as an edit request
-        if edit_request:
-            # This is an edit request, generate a new version of the story
-            model = ChatOpenAI(model="gpt-4o").bind_tools(
-                [StoryContent],
-                parallel_tool_calls=False,
-                tool_choice="StoryContent"  # Always generate story content
-            )
-            
-            response = await model.ainvoke([
-                SystemMessage(
-                    content=f"""
-                    You are a creative storyteller that edits stories based on user requests.
-                    You will be given an existing story and an edit request.
-                    Make the requested changes while maintaining the overall narrative structure and quality.
-                    
-                    Existing story:
-                    Title: {existing_story['title']}
-                    Genre: {existing_story['genre']}
-                    Summary: {existing_story['summary']}
-                    Story: {existing_story['story']}
-                    
-                    Edit request: "{edit_request}"
-                    
-                    Generate the updated story with the requested changes.
-                    """
-                ),
-            ], config)
-            
-            if hasattr(response, "tool_calls") and len(getattr(response, "tool_calls")) > 0:
-                ai_message = cast(AIMessage, response)
-                updated_story = cast(AIMessage, response).tool_calls[0]["args"]
-                
-                # Generate diff markup for the story content
-                diff_markup = generate_diff_markup(existing_story['story'], updated_story['story'])
-                
-                # First, update the UI with the updated story content
-                return {
-                    "messages": [
-                        *state["messages"],
-                        response,  # Include the AI message with tool calls
-                        ToolMessage(  # Add the tool message to respond to the tool call
-                            content="Story updated successfully",
-                            tool_call_id=ai_message.tool_calls[0]["id"]
-                        ),
-                        AIMessage(content=f"I've updated the story with your requested changes. Please confirm if you'd like to keep these changes.")
-                    ],
-                    "story_content": updated_story,  # Set the updated story as the current version
-                    "previous_story_content": existing_story,  # Save the previous version
-                    "pending_confirmation": True,  # Set flag to indicate we're waiting for confirmation
-                    "is_edit": True,  # Flag this as an edit operation
-                    "diff_markup": diff_markup  # Include the diff markup
-                }
-
-    # If we don't have a story yet or it's not an edit request, generate a new story
-    model = ChatOpenAI(model="gpt-4o").bind_tools(
-        [StoryContent],
-        parallel_tool_calls=False,
-        tool_choice="StoryContent"  # Always generate story content
+    # Retries of the same prompt by the same tenant are answered from the cache, the history is not part of the key
+    response = await cached_call(
+        fingerprint(f"gpt-4o/{story_schema.__name__}", CREATE_INSTRUCTIONS, prompt, scope=cache_scope(config)),
+        lambda: astream_tool_call(model, create_messages(prompt, summary_messages(state), state["messages"]), config, state, preview_story),
+        bypass=bypass_cache
     )
 
-    # Extract story prompt from the input or last message
-    story_prompt = state.get("input", "")
-    if not story_prompt and state["messages"]:
-        last_message = state["messages"][-1]
-        if isinstance(last_message, HumanMessage):
-            story_prompt = last_message.content
-
-    response = await model.ainvoke([
-        SystemMessage(
-            content=f"""
-            You are a creative storyteller that creates engaging and imaginative stories based on user prompts or descriptions.
-            Generate stories with clear narrative structure, engaging characters, and vivid descriptions.
-            Always generate a complete story with a title, genre, summary, and the full story text.
-            Use the provided prompt to create an engaging story: "{story_prompt}"
-            """
-        ),
-        *state["messages"],
-    ], config)
-
     if hasattr(response, "tool_calls") and len(getattr(response, "tool_calls")) > 0:
         ai_message = cast(AIMessage, response)
         story_content = cast(AIMessage, response).tool_calls[0]["args"]
         
+        story_version = await record_version(config, story_content, label=prompt)
+
         # First, update the UI with the story content and include the tool message response
         # to satisfy OpenAI's requirement that tool calls must be followed by tool messages
+        record("story_branch_seconds", started, branch="create")
         return {
             "messages": [
-                *state["messages"],
                 response,  # Include the AI message with tool calls
                 ToolMessage(  # Add the tool message to respond to the tool call
                     content="Story generated successfully",
@@ -568,7 +442,10 @@ async def story_creator_node(state: AgentState, config: RunnableConfig):
             "previous_story_content": story_content,  # Initialize the previous version to be the same as the current
             "pending_confirmation": True,  # Set flag to indicate we're waiting for confirmation
             "is_edit": False,  # This is not an edit operation
-            "diff_markup": ""  # No diff markup for new stories
+            "diff_ops": [],  # No diff for new stories
+            "diff_markup": "",  # No diff markup for new stories
+            "bypass_cache": False,  # The bypass only applies to this request
+            "story_version": story_version  # The first version of the story
         }
 
     return {
@@ -577,20 +454,125 @@ async def story_creator_node(state: AgentState, config: RunnableConfig):
         ],
     }
 
-# Define the workflow
-workflow = StateGraph(AgentState)
-workflow.add_node("story_creator_node", cast(Any, story_creator_node))
-workflow.set_entry_point("story_creator_node")
-
-# Define the conditional edges
-workflow.add_conditional_edges(
-    "story_creator_node",
-    should_continue,
-    {
-        "continue": "story_creator_node",
-        "end": END
-    }
-)
+def _with_configurable(node: Callable, configurable: Dict[str, Any]) -> Callable:
+    """Wrap an async node that takes a config, so its config carries configurable's keys."""
+    if not configurable or "config" not in inspect.signature(node).parameters:
+        return node
+
+    @functools.wraps(node)
+    async def wrapper(state: Any, config: RunnableConfig) -> Any:
+        # Keys given at invoke time win over the graph's
+        return await node(state, {**config, "configurable": {**configurable, **(config.get("configurable") or {})}})
+    return wrapper
+
+def _reply_when_busy(node: Callable, **update: Any) -> Callable:
+    """Wrap an async node, so a model call rejected by admission control ends the turn with a message."""
+    @functools.wraps(node)
+    async def wrapper(state: Any, config: RunnableConfig) -> Any:
+        try:
+            return await node(state, config)
+        except QueueFullError:
+            return {
+                "messages": [AIMessage(content="Too many stories are being written right now. Please try again in a moment.")],
+                **update
+            }
+    return wrapper
+
+def _with_trimmed_history(node: Callable) -> Callable:
+    """Wrap an async node that starts a turn, so it trims the history first and sees it trimmed."""
+    @functools.wraps(node)
+    async def wrapper(state: Any, config: RunnableConfig) -> Any:
+        trimmed = await trim_history(state, config)
+        if not trimmed:
+            return await node(state, config)
+        dropped = {message.id for message in trimmed["messages"]}
+        update = await node({
+            **state,
+            "messages": [message for message in state["messages"] if message.id not in dropped],
+            "history_summary": trimmed["history_summary"],
+        }, config) or {}
+        return {**update, "messages": [*trimmed["messages"], *update.get("messages", [])],
+                "history_summary": trimmed["history_summary"]}
+    return wrapper
+
+def _build_workflow(configurable: Dict[str, Any]) -> StateGraph:
+    """Define the workflow."""
+    def node(name: str, function: Callable) -> Any:
+        return cast(Any, instrument_node(name, _with_configurable(function, configurable)))
+
+    def turn_node(name: str, function: Callable, **busy_update: Any) -> Any:
+        # Trimming in the node that starts the turn saves the turn a step, and its checkpoint
+        return node(name, _reply_when_busy(_with_trimmed_history(function), **busy_update))
+
+    workflow = StateGraph(AgentState)
+    workflow.add_node("create_node", turn_node("create_node", create_node))
+    workflow.add_node("edit_node", turn_node("edit_node", edit_node))
+    # Confirm and revert don't call the model, they only settle the state. Confirm
+    # runs again when the turn resumes, so it leaves the history to the next turn
+    workflow.add_node("confirm_node", node("confirm_node", confirm_node))
+    workflow.add_node("revert_node", turn_node("revert_node", revert_node))
+    # An empty outline keeps dispatch_chapters from writing the chapters of an older one
+    workflow.add_node("outline_node", turn_node("outline_node", outline_node, story_outline={}))
+    workflow.add_node("chapter_node", node("chapter_node", chapter_node))
+    workflow.add_node("assemble_node", node("assemble_node", assemble_node))
+    # Routing is an edge rather than a node of its own, so it doesn't add a checkpoint to the turn
+    workflow.add_conditional_edges(START, route_turn)
+
+    # Long-form stories fan out one chapter_node per chapter, then get assembled
+    workflow.add_conditional_edges("outline_node", dispatch_chapters, ["chapter_node", END])
+    workflow.add_edge("chapter_node", "assemble_node")
+
+    # A new or edited story waits for confirmation in the same turn
+    for name in ("create_node", "edit_node", "assemble_node"):
+        workflow.add_conditional_edges(
+            name,
+            should_continue,
+            {
+                "continue": "confirm_node",
+                "end": END
+            }
+        )
+    workflow.add_edge("confirm_node", END)
+    workflow.add_edge("revert_node", END)
+    return workflow
 
-memory = MemorySaver()
-graph = workflow.compile(checkpointer=memory)
+_graphs: Dict[Tuple[int, ...], CompiledStateGraph] = {}
+_graphs_lock = threading.Lock()
+
+def build_graph(config: Optional[GraphConfig] = None) -> CompiledStateGraph:
+    """
+    Compile the story graph, or return the one already compiled for these dependencies.
+
+    Args:
+        config: The model factory, checkpointer and tools to use instead of
+            the defaults
+
+    Returns:
+        The compiled graph. Graphs are cached by the identity of the given
+        dependencies, so every call with the same ones returns the same graph.
+    """
+    config = config or {}
+    tools = config.get("tools") or {}
+    # The cached graph holds the dependencies, so their ids can't be reused while it is cached
+    key = (id(config.get("model")), id(config.get("checkpointer")), *(id(tools.get(role)) for role in DEFAULT_TOOLS))
+    with _graphs_lock:
+        compiled = _graphs.get(key)
+        if compiled is None:
+            checkpointer = config.get("checkpointer")
+            if checkpointer is None:
+                from translate_agent.checkpoint import make_checkpointer  # pylint: disable=import-outside-toplevel
+                checkpointer = make_checkpointer()
+            # Passed to the nodes rather than set with with_config(), which a
+            # configurable given at invoke time would replace
+            configurable = {
+                name: value for name, value in (("story_model", config.get("model")), ("story_tools", tools))
+                if value
+            }
+            compiled = _graphs[key] = _build_workflow(configurable).compile(checkpointer=checkpointer)
+        return compiled
+
+def __getattr__(name: str) -> Any:
+    # The default graph is compiled on first access, not at import
+    if name == "graph":
+        return build_graph()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,310 @@
+"""
+Batch story generation.
+
+Catalogs and A/B content need stories by the thousand, which the interactive
+endpoint can only write one confirmation at a time. run_batch() runs a list
+of prompts through the story graph, a bounded number at a time, confirms
+each story as soon as it is written and yields the results as they finish.
+The demo app serves it as POST /batch and main() as a command line:
+
+    poetry run batch prompts.jsonl --output stories.jsonl --progress progress.jsonl
+
+The input has one prompt per line, either plain text or a JSON object with
+a "prompt" and optionally an "id" and "long_form". Items without an id are
+numbered by their line. Each result is a JSON line with the id and thread
+of the item and either the story fields or an "error".
+
+Each item runs in a thread of its own, "<batch id>:<item id>", through the
+graph's checkpointer, with the batch as its admission tenant, so a batch
+shares the model fairly with interactive users and other batches. With a
+progress file, the ids of the stories that were written out are appended
+to it, and a batch started again with the same file skips them. An item
+that was cut off by a crash picks up from its thread: a story waiting for
+confirmation is confirmed instead of written again. A result is recorded
+only after the caller took it, so a crash can repeat a result but not lose
+one. Failed items are not recorded and run again.
+
+Configured through environment variables:
+
+    STORY_BATCH_CONCURRENCY      stories written at the same time (default: 8)
+    STORY_BATCH_DIR              directory of the progress files of POST /batch (default: batches)
+    STORY_BATCH_MAX_CONCURRENCY  most concurrency a POST /batch request may ask for (default: 32)
+    STORY_BATCH_MAX_ITEMS        most prompts in a POST /batch request (default: 10000)
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import re
+import sys
+import time
+from collections.abc import AsyncIterator, Iterable, Iterator
+from typing import Any, Dict, List, Optional, Set
+
+from langchain_core.messages import AIMessage, HumanMessage
+from langgraph.graph.state import CompiledStateGraph
+from langgraph.types import Command
+
+from translate_agent.metrics import register_collector
+
+# Confirmations answered for one item before giving up on it
+_MAX_CONFIRMATIONS = 3
+
+_BATCH_ID = re.compile(r"^[\w.-]{1,64}$")
+
+_stats: Dict[str, int] = {
+    "items": 0,
+    "succeeded": 0,
+    "failed": 0,
+    "skipped": 0,
+}
+
+
+def batch_concurrency() -> int:
+    """Stories a batch writes at the same time."""
+    return max(1, int(os.getenv("STORY_BATCH_CONCURRENCY", "8")))
+
+
+def batch_max_concurrency() -> int:
+    """Most stories a POST /batch request may write at the same time."""
+    return max(1, int(os.getenv("STORY_BATCH_MAX_CONCURRENCY", "32")))
+
+
+def batch_max_items() -> int:
+    """Most prompts a POST /batch request may hold."""
+    return max(1, int(os.getenv("STORY_BATCH_MAX_ITEMS", "10000")))
+
+
+def progress_path(batch_id: str) -> str:
+    """
+    Return the progress file of a batch started through POST /batch.
+
+    Raises:
+        ValueError: If the batch id isn't 1 to 64 letters, digits, ".", "-" or "_"
+    """
+    if not _BATCH_ID.match(batch_id):
+        raise ValueError(f"Invalid batch id {batch_id!r}")
+    return os.path.join(os.getenv("STORY_BATCH_DIR", "batches"), f"{batch_id}.progress.jsonl")
+
+
+def read_prompts(lines: Iterable[str]) -> Iterator[Dict[str, Any]]:
+    """
+    Parse batch input lines into items.
+
+    Args:
+        lines: Plain text prompts or JSON objects with a "prompt", one per line
+
+    Returns:
+        Items with a string "id", the "prompt" and "long_form" if given
+
+    Raises:
+        ValueError: On a line that isn't a prompt, or an id used twice
+    """
+    seen: Set[str] = set()
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith("{"):
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError as error:
+                raise ValueError(f"line {number}: {error}") from error
+            if not isinstance(item.get("prompt"), str) or not item["prompt"].strip():
+                raise ValueError(f"line {number}: no prompt")
+        else:
+            item = {"prompt": line}
+        item["id"] = str(item.get("id", number))
+        if item["id"] in seen:
+            raise ValueError(f"line {number}: id {item['id']!r} is used twice")
+        seen.add(item["id"])
+        yield {key: item[key] for key in ("id", "prompt", "long_form") if key in item}
+
+
+def read_progress(path: str) -> Set[str]:
+    """Return the ids recorded in a progress file, none if it doesn't exist yet."""
+    if not os.path.exists(path):
+        return set()
+    done = set()
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            try:
+                done.add(str(json.loads(line)["id"]))
+            except (ValueError, KeyError, TypeError):
+                # A line cut short by a crash
+                continue
+    return done
+
+
+async def generate_story(graph: CompiledStateGraph, item: Dict[str, Any], batch_id: str) -> Dict[str, Any]:
+    """
+    Write and confirm the story of one batch item.
+
+    Args:
+        graph: The compiled story graph
+        item: The item, from read_prompts()
+        batch_id: The batch, which names the thread and is the admission tenant
+
+    Returns:
+        The result line: the id, the thread and the story fields, or an error
+    """
+    thread_id = f"{batch_id}:{item['id']}"
+    config = {"configurable": {"thread_id": thread_id, "tenant_id": batch_id}}
+    result: Dict[str, Any] = {"id": item["id"], "thread_id": thread_id}
+    started = time.perf_counter()
+
+    # A thread left by an earlier run carries on from where it stopped
+    values = (await graph.aget_state(config)).values or {}
+    if not values.get("story_content"):
+        request: Dict[str, Any] = {"messages": [HumanMessage(content=item["prompt"])]}
+        if "long_form" in item:
+            request["long_form"] = bool(item["long_form"])
+        values = await graph.ainvoke(request, config)
+    for _ in range(_MAX_CONFIRMATIONS):
+        if not values.get("pending_confirmation"):
+            break
+        values = await graph.ainvoke(Command(resume="Confirm"), config)
+
+    story = values.get("story_content")
+    if not story or values.get("pending_confirmation"):
+        replies = [message for message in values.get("messages", []) if isinstance(message, AIMessage) and message.content]
+        result["error"] = str(replies[-1].content) if replies else "No story was written"
+        return result
+    result.update({field: story.get(field, "") for field in ("title", "genre", "summary", "story")})
+    result["seconds"] = round(time.perf_counter() - started, 3)
+    return result
+
+
+async def run_batch(items: Iterable[Dict[str, Any]], batch_id: str, concurrency: Optional[int] = None,
+                    progress: Optional[str] = None,
+                    graph: Optional[CompiledStateGraph] = None) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Write the stories of a batch, yielding each result as it finishes.
+
+    Args:
+        items: Items from read_prompts(), consumed as workers free up
+        batch_id: Names the threads, use the same one to resume a batch
+        concurrency: Stories written at the same time, STORY_BATCH_CONCURRENCY if None
+        progress: Progress file, the items recorded in it are skipped
+        graph: The graph to run, the default graph if None
+
+    Returns:
+        The results, in the order they finish
+    """
+    if graph is None:
+        from translate_agent.agent import build_graph  # pylint: disable=import-outside-toplevel
+        graph = build_graph()
+    done = read_progress(progress) if progress else set()
+    if progress and os.path.dirname(progress):
+        os.makedirs(os.path.dirname(progress), exist_ok=True)
+
+    def pending() -> Iterator[Dict[str, Any]]:
+        for item in items:
+            if item["id"] in done:
+                _stats["skipped"] += 1
+                continue
+            yield item
+
+    # The workers share the iterator, so items are read as they are needed
+    queue = pending()
+    results: "asyncio.Queue[Optional[Dict[str, Any]]]" = asyncio.Queue()
+
+    async def worker() -> None:
+        try:
+            for item in queue:
+                _stats["items"] += 1
+                try:
+                    result = await generate_story(graph, item, batch_id)
+                except Exception as error:  # pylint: disable=broad-except
+                    result = {"id": item["id"], "thread_id": f"{batch_id}:{item['id']}", "error": f"{type(error).__name__}: {error}"}
+                _stats["failed" if "error" in result else "succeeded"] += 1
+                await results.put(result)
+        finally:
+            await results.put(None)
+
+    workers = [asyncio.ensure_future(worker()) for _ in range(concurrency or batch_concurrency())]
+    progress_file = open(progress, "a", encoding="utf-8") if progress else None  # pylint: disable=consider-using-with
+    try:
+        running = len(workers)
+        while running:
+            result = await results.get()
+            if result is None:
+                running -= 1
+                continue
+            yield result
+            # The caller has taken the result by the time it asks for the next one
+            if progress_file is not None and "error" not in result:
+                progress_file.write(json.dumps({"id": result["id"]}) + "\n")
+                progress_file.flush()
+    finally:
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        if progress_file is not None:
+            progress_file.close()
+
+
+def batch_stats() -> Dict[str, int]:
+    """Return counters of batch items written, failed and skipped on resume."""
+    return dict(_stats)
+
+
+register_collector("story_batch", batch_stats)
+
+
+async def _run(args: argparse.Namespace, items: List[Dict[str, Any]]) -> int:
+    """Run the batch of the command line and return the number of failed items."""
+    from translate_agent.agent import build_graph  # pylint: disable=import-outside-toplevel
+    from translate_agent.models import reset_models  # pylint: disable=import-outside-toplevel
+    from translate_agent.workers import shutdown_pool  # pylint: disable=import-outside-toplevel
+
+    # Results are appended when resuming, so the ones written before the crash are kept
+    mode = "a" if args.progress else "w"
+    output = sys.stdout if args.output == "-" else open(args.output, mode, encoding="utf-8")  # pylint: disable=consider-using-with
+    graph = build_graph()
+    failed = 0
+    try:
+        async for result in run_batch(items, args.batch_id, args.concurrency, args.progress, graph):
+            failed += "error" in result
+            output.write(json.dumps(result, ensure_ascii=False) + "\n")
+            output.flush()
+    finally:
+        if output is not sys.stdout:
+            output.close()
+        close = getattr(graph.checkpointer, "close", None)
+        if close is not None:
+            close()
+        shutdown_pool(wait=False)
+        await reset_models()
+    return failed
+
+
+def main():
+    """Write the stories of a file of prompts and save them as JSON lines."""
+    from dotenv import load_dotenv  # pylint: disable=import-outside-toplevel
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Write a story for every prompt of a file.")
+    parser.add_argument("input", help='prompts, one per line as text or JSON, "-" for stdin')
+    parser.add_argument("--output", default="-", help='JSON lines of results, "-" for stdout (default)')
+    parser.add_argument("--progress", help="progress file, to resume the batch after a crash")
+    parser.add_argument("--concurrency", type=int, help="stories written at the same time (default: STORY_BATCH_CONCURRENCY)")
+    parser.add_argument("--batch-id", help="names the threads of the batch (default: the input file name)")
+    args = parser.parse_args()
+    if args.batch_id is None:
+        args.batch_id = "stdin" if args.input == "-" else os.path.splitext(os.path.basename(args.input))[0]
+
+    try:
+        with (sys.stdin if args.input == "-" else open(args.input, encoding="utf-8")) as file:
+            items = list(read_prompts(file))
+    except ValueError as error:
+        raise SystemExit(f"{args.input}: {error}") from error
+    failed = asyncio.run(_run(args, items))
+    if failed:
+        print(f"{failed} stories failed, run the batch again with the same progress file to retry them", file=sys.stderr)
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
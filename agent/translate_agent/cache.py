@@ -0,0 +1,295 @@
+"""
+Response cache for story generation and edit calls.
+
+Users often retry the same prompt, or cancel an edit and send it again. Each
+of those used to cost a full model call. Responses are cached under a hash of
+the model, the system prompt, the user's request, the story being edited and
+the scope of the call, in an in-memory LRU and optionally in a SQLite file
+shared by processes.
+
+The scope is the caller's tenant: the tenant_id of the config, else its
+thread (see admission.tenant_of), so one user's story is never served to
+another. STORY_CACHE_SCOPE=global shares responses between all callers, for
+deployments where every caller may see every story, such as batch runs.
+
+Configured through environment variables:
+
+    STORY_CACHE                   "true" or "false" (default: true)
+    STORY_CACHE_MAX_ENTRIES       responses kept in memory (default: 256)
+    STORY_CACHE_TTL               seconds a response stays valid, 0 forever (default: 3600)
+    STORY_CACHE_PATH              SQLite file for the on-disk tier, unset keeps the cache in memory only
+    STORY_CACHE_DISK_MAX_ENTRIES  responses kept on disk (default: 10000)
+    STORY_CACHE_SCOPE             "tenant" or "global", who a cached response is shared with (default: tenant)
+
+A request skips the cache when the bypass_cache state key is set, so the
+user can ask for a fresh take on the same prompt.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.runnables import RunnableConfig
+
+from translate_agent.admission import tenant_of
+from translate_agent.metrics import register_collector
+from translate_agent.singleflight import single_flight
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    created REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access);
+"""
+
+
+def _normalize(text: str) -> str:
+    return _WHITESPACE_RE.sub(" ", text).strip()
+
+
+def cache_scope(config: Optional[RunnableConfig]) -> str:
+    """The callers a response is cached for: the tenant of config, or everyone with STORY_CACHE_SCOPE=global."""
+    if os.getenv("STORY_CACHE_SCOPE", "tenant").lower() == "global":
+        return ""
+    return tenant_of(config)
+
+
+def fingerprint(model: str, system_prompt: str, request: str, story: Optional[Dict[str, Any]] = None,
+                scope: str = "") -> str:
+    """
+    Hash the parts of a call that decide its response.
+
+    Args:
+        model: The model name and the tool it must call
+        system_prompt: The system prompt sent to the model
+        request: The user's prompt or edit request
+        story: The StoryContent being edited, if any
+        scope: The callers the response may be shared with, from cache_scope()
+
+    Returns:
+        A hex digest that is the same for calls that differ only in whitespace
+        or in the case of the request
+    """
+    payload = json.dumps(
+        [model, _normalize(system_prompt), _normalize(request).casefold(), story, scope],
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class ResponseCache:
+    """
+    A two-tier cache of model responses.
+
+    The memory tier is an LRU of max_entries responses. When a path is given,
+    responses are also written to SQLite, which outlives the process and is
+    bounded to max_disk_entries by evicting the least recently used rows.
+    Entries older than ttl are treated as missing in both tiers.
+
+    Args:
+        max_entries: Responses kept in memory
+        ttl: Seconds a response stays valid, None forever
+        path: The SQLite database file, None for a memory-only cache
+        max_disk_entries: Responses kept on disk
+    """
+
+    def __init__(self, max_entries: int = 256, ttl: Optional[float] = None,
+                 path: Optional[str] = None, max_disk_entries: int = 10000) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl or None
+        self.max_disk_entries = max_disk_entries
+        self.lock = threading.Lock()
+        self.entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self.stats: Dict[str, int] = {
+            "hits": 0,
+            "misses": 0,
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "bypassed": 0,
+            "evictions": 0,
+        }
+        self.conn: Optional[sqlite3.Connection] = None
+        if path:
+            self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self.conn.execute("PRAGMA busy_timeout=5000")
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.executescript(_SCHEMA)
+
+    def _expired(self, created: float) -> bool:
+        return self.ttl is not None and time.time() - created > self.ttl
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached value for key, or None."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and self._expired(entry[0]):
+                del self.entries[key]
+                entry = None
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.stats["hits"] += 1
+                self.stats["memory_hits"] += 1
+                return entry[1]
+
+            if self.conn is not None:
+                row = self.conn.execute("SELECT value, created FROM responses WHERE key = ?", (key,)).fetchone()
+                if row is not None and not self._expired(row[1]):
+                    self.conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+                    self._remember(key, row[1], row[0])
+                    self.stats["hits"] += 1
+                    self.stats["disk_hits"] += 1
+                    return row[0]
+
+            self.stats["misses"] += 1
+            return None
+
+    def put(self, key: str, value: str) -> None:
+        """Store value under key in both tiers."""
+        now = time.time()
+        with self.lock:
+            self._remember(key, now, value)
+            if self.conn is not None:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO responses (key, value, created, last_access) VALUES (?, ?, ?, ?)",
+                    (key, value, now, now),
+                )
+                self._evict_disk(now)
+
+    def _remember(self, key: str, created: float, value: str) -> None:
+        self.entries[key] = (created, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def _evict_disk(self, now: float) -> None:
+        assert self.conn is not None
+        if self.ttl is not None:
+            self.conn.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+        excess = self.conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0] - self.max_disk_entries
+        if excess > 0:
+            self.conn.execute(
+                "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY last_access LIMIT ?)",
+                (excess,),
+            )
+            self.stats["evictions"] += excess
+
+    def clear(self) -> None:
+        """Drop every cached response."""
+        with self.lock:
+            self.entries.clear()
+            if self.conn is not None:
+                self.conn.execute("DELETE FROM responses")
+
+    def close(self) -> None:
+        """Close the SQLite connection, if any."""
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+
+_cache: Optional[ResponseCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> ResponseCache:
+    """Return the process-wide response cache, creating it on first use."""
+    global _cache  # pylint: disable=global-statement
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache(
+                max_entries=int(os.getenv("STORY_CACHE_MAX_ENTRIES", "256")),
+                ttl=float(os.getenv("STORY_CACHE_TTL", "3600")),
+                path=os.getenv("STORY_CACHE_PATH") or None,
+                max_disk_entries=int(os.getenv("STORY_CACHE_DISK_MAX_ENTRIES", "10000")),
+            )
+        return _cache
+
+
+def _dump_response(response: BaseMessage) -> Optional[str]:
+    tool_calls = getattr(response, "tool_calls", None)
+    if not tool_calls:
+        # Only complete tool calls are worth replaying
+        return None
+    return json.dumps({
+        "content": response.content,
+        "tool_calls": [{"name": call["name"], "args": call["args"]} for call in tool_calls],
+    })
+
+
+def _load_response(value: str) -> AIMessage:
+    data = json.loads(value)
+    # New ids, so the replayed call and its ToolMessage don't clash with the original
+    return AIMessage(
+        content=data["content"],
+        tool_calls=[
+            {"name": call["name"], "args": call["args"], "id": f"call_{uuid.uuid4().hex[:24]}", "type": "tool_call"}
+            for call in data["tool_calls"]
+        ],
+    )
+
+
+async def cached_call(key: str, call: Callable[[], Awaitable[BaseMessage]], bypass: bool = False) -> BaseMessage:
+    """
+    Return the cached response for key, or make the call and cache its response.
+
+    Identical calls that miss at the same time share one model call. A call
+    that bypasses the cache always makes its own, so it never gets the
+    response of an identical call already in flight.
+
+    Args:
+        key: The fingerprint of the call
+        call: Makes the model call on a miss
+        bypass: Skip the cache lookup, the fresh response is still stored
+
+    Returns:
+        The model response
+    """
+    cache = get_cache() if os.getenv("STORY_CACHE", "true").lower() == "true" else None
+    if cache is not None:
+        if bypass:
+            with cache.lock:
+                cache.stats["bypassed"] += 1
+        else:
+            value = await asyncio.to_thread(cache.get, key) if cache.conn is not None else cache.get(key)
+            if value is not None:
+                return _load_response(value)
+
+    async def fetch() -> BaseMessage:
+        response = await call()
+        value = _dump_response(response) if cache is not None else None
+        if cache is not None and value is not None:
+            if cache.conn is not None:
+                await asyncio.to_thread(cache.put, key, value)
+            else:
+                cache.put(key, value)
+        return response
+
+    if bypass:
+        return await fetch()
+    return await single_flight(key, fetch)
+
+
+def cache_stats() -> Dict[str, int]:
+    """Return hit, miss and eviction counters of the response cache."""
+    cache = get_cache()
+    return {**cache.stats, "entries": len(cache.entries)}
+
+
+register_collector("story_cache", cache_stats)
@@ -0,0 +1,574 @@
+"""
+Checkpointer backends for the story graph.
+
+MemorySaver keeps every checkpoint of every thread in RAM for the life of the
+process. SQLiteSaver stores them on disk instead, in WAL mode with batched
+writes, and bounds the store by keeping only the last N checkpoints per
+thread and evicting threads that are idle or least recently used.
+
+Configured through environment variables:
+
+    STORY_CHECKPOINTER               "sqlite" or "memory" (default: sqlite)
+    STORY_CHECKPOINT_PATH            SQLite database file (default: checkpoints.sqlite)
+    STORY_CHECKPOINT_KEEP_LAST       checkpoints kept per thread, 0 keeps all (default: 10)
+    STORY_CHECKPOINT_TTL             seconds before an idle thread is evicted, 0 never (default: 7 days)
+    STORY_CHECKPOINT_MAX_THREADS     threads kept before evicting the least recently used, 0 no limit (default: 10000)
+    STORY_CHECKPOINT_BATCH_SIZE      writes buffered before a flush, 1 turns buffering off (default: 64)
+    STORY_CHECKPOINT_FLUSH_INTERVAL  seconds a buffered write may wait (default: 0.05)
+
+Both backends store stories that are in the version history as references
+(see versions.py), and resolve references on load whether or not versions
+are enabled. The SQLite database also holds the version history: evicting a
+thread drops its versions too, and pruning its old checkpoints drops the
+versions that none of the kept checkpoints refer to.
+"""
+
+import asyncio
+import os
+import random
+import sqlite3
+import threading
+import time
+from collections.abc import AsyncIterator, Iterator, Sequence
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    SerializerProtocol,
+    get_checkpoint_id,
+)
+from langgraph.checkpoint.memory import MemorySaver
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+from langgraph.checkpoint.serde.types import INTERRUPT, TASKS, ChannelProtocol
+
+from translate_agent.metrics import increment, logger, observe
+from translate_agent.versions import SCHEMA as VERSIONS_SCHEMA, StoryReferenceSerializer, prune_versions
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS checkpoints (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    checkpoint_id TEXT NOT NULL,
+    parent_checkpoint_id TEXT,
+    type TEXT,
+    checkpoint BLOB,
+    metadata_type TEXT,
+    metadata BLOB,
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id)
+);
+CREATE TABLE IF NOT EXISTS writes (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    checkpoint_id TEXT NOT NULL,
+    task_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    channel TEXT NOT NULL,
+    type TEXT,
+    value BLOB,
+    task_path TEXT NOT NULL DEFAULT '',
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx)
+);
+CREATE TABLE IF NOT EXISTS threads (
+    thread_id TEXT PRIMARY KEY,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS threads_last_access ON threads (last_access);
+"""
+
+# Evicting idle threads scans the threads table, so it runs at most this often
+_EVICT_INTERVAL = 60.0
+
+
+class SQLiteSaver(BaseCheckpointSaver[str]):
+    """
+    A bounded checkpoint saver backed by SQLite.
+
+    Writes are buffered and committed in one transaction when the buffer
+    fills, when flush_interval elapses, when an interrupt is written, or
+    before any read, so reads in this process always see earlier writes.
+    The database runs in WAL mode, which lets several processes share one
+    file; other processes only see what has been flushed, so a server with
+    several workers sets batch_size to 1. The async methods flush in a
+    thread, off the event loop.
+
+    Args:
+        path: The SQLite database file
+        keep_last: Checkpoints kept per thread and namespace, None keeps all
+        ttl: Seconds before an idle thread is evicted, None never
+        max_threads: Threads kept before evicting the least recently used, None no limit
+        batch_size: Buffered writes that trigger a flush
+        flush_interval: Seconds a buffered write may wait before it is flushed
+        serde: The serializer for checkpoints and writes
+    """
+
+    def __init__(
+        self,
+        path: str,
+        *,
+        keep_last: Optional[int] = None,
+        ttl: Optional[float] = None,
+        max_threads: Optional[int] = None,
+        batch_size: int = 64,
+        flush_interval: float = 0.05,
+        serde: Optional[SerializerProtocol] = None,
+    ) -> None:
+        super().__init__(serde=serde)
+        # Reading a checkpoint needs its parent's writes, so keep at least two
+        self.keep_last = max(keep_last, 2) if keep_last else None
+        self.ttl = ttl or None
+        self.max_threads = max_threads or None
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        # Wait for other processes opening the same file before switching to WAL
+        self.conn.execute("PRAGMA busy_timeout=5000")
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(_SCHEMA + VERSIONS_SCHEMA)
+        self.pending: List[Tuple[str, Tuple[Any, ...]]] = []
+        self.touched: Dict[str, float] = {}
+        self.timer: Optional[threading.Timer] = None
+        self.last_evict = 0.0
+
+    def __enter__(self) -> "SQLiteSaver":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+    async def __aenter__(self) -> "SQLiteSaver":
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Flush buffered writes and close the database."""
+        self.flush()
+        with self.lock:
+            self.conn.close()
+
+    def _enqueue(self, sql: str, params: Tuple[Any, ...], thread_id: str) -> bool:
+        """Buffer a write, and return whether the buffer is full and should be flushed now."""
+        with self.lock:
+            self.pending.append((sql, params))
+            self.touched[thread_id] = time.time()
+            if len(self.pending) >= self.batch_size:
+                return True
+            if self.timer is None:
+                self._start_timer()
+            return False
+
+    def _start_timer(self) -> None:
+        self.timer = threading.Timer(self.flush_interval, self._timed_flush)
+        self.timer.daemon = True
+        self.timer.start()
+
+    def _timed_flush(self) -> None:
+        """Flush from the timer thread, where an error has no caller to go to: log it and try again later."""
+        try:
+            self.flush()
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Flushing buffered checkpoints failed, retrying in %ss", self.flush_interval)
+            with self.lock:
+                if self.timer is None and self.pending:
+                    self._start_timer()
+
+    def flush(self) -> None:
+        """
+        Commit buffered writes, then prune old checkpoints and idle threads.
+
+        Raises:
+            sqlite3.Error: If the transaction fails, such as when another process
+                holds the database past busy_timeout. The writes stay buffered
+                for the next flush.
+        """
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            if not self.pending and not self.touched:
+                return
+            pending, self.pending = self.pending, []
+            touched, self.touched = self.touched, {}
+            cursor = self.conn.cursor()
+            cursor.execute("BEGIN")
+            try:
+                for sql, params in pending:
+                    cursor.execute(sql, params)
+                cursor.executemany(
+                    "INSERT INTO threads (thread_id, last_access) VALUES (?, ?) "
+                    "ON CONFLICT(thread_id) DO UPDATE SET last_access = excluded.last_access",
+                    touched.items(),
+                )
+                if self.keep_last:
+                    self._prune(cursor, touched.keys())
+                if time.time() - self.last_evict >= _EVICT_INTERVAL:
+                    self._evict(cursor)
+                    self.last_evict = time.time()
+                cursor.execute("COMMIT")
+            except BaseException:
+                if self.conn.in_transaction:
+                    cursor.execute("ROLLBACK")
+                # Keep the writes, ahead of any buffered since, for the next flush
+                self.pending = pending + self.pending
+                self.touched = {**touched, **self.touched}
+                increment("story_checkpoint_flush_errors_total")
+                raise
+
+    def _prune(self, cursor: sqlite3.Cursor, thread_ids: Sequence[str]) -> None:
+        """Keep only the newest keep_last checkpoints of each touched thread."""
+        for thread_id in thread_ids:
+            cursor.execute(
+                """
+                DELETE FROM checkpoints
+                WHERE thread_id = ?1 AND checkpoint_id NOT IN (
+                    SELECT checkpoint_id FROM checkpoints AS newest
+                    WHERE newest.thread_id = ?1 AND newest.checkpoint_ns = checkpoints.checkpoint_ns
+                    ORDER BY checkpoint_id DESC LIMIT ?2
+                )
+                """,
+                (thread_id, self.keep_last),
+            )
+            if cursor.rowcount:
+                cursor.execute(
+                    """
+                    DELETE FROM writes
+                    WHERE thread_id = ?1 AND NOT EXISTS (
+                        SELECT 1 FROM checkpoints AS kept
+                        WHERE kept.thread_id = ?1 AND kept.checkpoint_ns = writes.checkpoint_ns
+                        AND kept.checkpoint_id = writes.checkpoint_id
+                    )
+                    """,
+                    (thread_id,),
+                )
+                self._prune_versions(cursor, thread_id)
+
+    @staticmethod
+    def _prune_versions(cursor: sqlite3.Cursor, thread_id: str) -> None:
+        """Drop the story versions of a thread that its kept checkpoints and writes don't refer to."""
+        blobs = [
+            blob for (blob,) in cursor.execute(
+                "SELECT checkpoint FROM checkpoints WHERE thread_id = ?1 "
+                "UNION ALL SELECT metadata FROM checkpoints WHERE thread_id = ?1 "
+                "UNION ALL SELECT value FROM writes WHERE thread_id = ?1",
+                (thread_id,),
+            ).fetchall()
+            if isinstance(blob, bytes)
+        ]
+        prune_versions(cursor, thread_id, blobs)
+
+    def _evict(self, cursor: sqlite3.Cursor) -> None:
+        """Drop threads past their TTL and the least recently used beyond max_threads."""
+        evicted: Set[str] = set()
+        if self.ttl:
+            cursor.execute("SELECT thread_id FROM threads WHERE last_access < ?", (time.time() - self.ttl,))
+            evicted.update(row[0] for row in cursor.fetchall())
+        if self.max_threads:
+            cursor.execute(
+                "SELECT thread_id FROM threads ORDER BY last_access DESC LIMIT -1 OFFSET ?",
+                (self.max_threads,),
+            )
+            evicted.update(row[0] for row in cursor.fetchall())
+        for thread_id in evicted:
+            self._delete_thread(cursor, thread_id)
+
+    @staticmethod
+    def _delete_thread(cursor: sqlite3.Cursor, thread_id: str) -> None:
+        cursor.execute("DELETE FROM checkpoints WHERE thread_id = ?", (thread_id,))
+        cursor.execute("DELETE FROM writes WHERE thread_id = ?", (thread_id,))
+        cursor.execute("DELETE FROM threads WHERE thread_id = ?", (thread_id,))
+        cursor.execute("DELETE FROM story_versions WHERE thread_id = ?", (thread_id,))
+
+    def delete_thread(self, thread_id: str) -> None:
+        """Delete every checkpoint of a thread."""
+        self.flush()
+        with self.lock:
+            cursor = self.conn.cursor()
+            cursor.execute("BEGIN")
+            self._delete_thread(cursor, thread_id)
+            cursor.execute("COMMIT")
+
+    def thread_ids(self) -> Iterator[str]:
+        """Yield the id of every thread with a checkpoint."""
+        self.flush()
+        with self.lock:
+            rows = self.conn.execute("SELECT DISTINCT thread_id FROM checkpoints").fetchall()
+        for (thread_id,) in rows:
+            yield thread_id
+
+    def _load_tuple(self, thread_id: str, checkpoint_ns: str, row: Tuple[Any, ...]) -> CheckpointTuple:
+        """Build a CheckpointTuple from a checkpoints row, with its writes and sends."""
+        checkpoint_id, parent_checkpoint_id, type_, checkpoint, metadata_type, metadata = row
+        with self.lock:
+            writes = self.conn.execute(
+                "SELECT task_id, channel, type, value FROM writes "
+                "WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ? ORDER BY task_id, idx",
+                (thread_id, checkpoint_ns, checkpoint_id),
+            ).fetchall()
+            sends = []
+            if parent_checkpoint_id:
+                sends = self.conn.execute(
+                    "SELECT type, value FROM writes "
+                    "WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ? AND channel = ? "
+                    "ORDER BY task_path, task_id, idx",
+                    (thread_id, checkpoint_ns, parent_checkpoint_id, TASKS),
+                ).fetchall()
+        return CheckpointTuple(
+            config={
+                "configurable": {
+                    "thread_id": thread_id,
+                    "checkpoint_ns": checkpoint_ns,
+                    "checkpoint_id": checkpoint_id,
+                }
+            },
+            checkpoint={
+                **self.serde.loads_typed((type_, checkpoint)),
+                "pending_sends": [self.serde.loads_typed(send) for send in sends],
+            },
+            metadata=self.serde.loads_typed((metadata_type, metadata)),
+            pending_writes=[
+                (task_id, channel, self.serde.loads_typed((value_type, value)))
+                for task_id, channel, value_type, value in writes
+            ],
+            parent_config={
+                "configurable": {
+                    "thread_id": thread_id,
+                    "checkpoint_ns": checkpoint_ns,
+                    "checkpoint_id": parent_checkpoint_id,
+                }
+            }
+            if parent_checkpoint_id
+            else None,
+        )
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        """Get the checkpoint named in config, or the latest one of its thread."""
+        self.flush()
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        query = (
+            "SELECT checkpoint_id, parent_checkpoint_id, type, checkpoint, metadata_type, metadata "
+            "FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ?"
+        )
+        params: Tuple[Any, ...] = (thread_id, checkpoint_ns)
+        if checkpoint_id := get_checkpoint_id(config):
+            query += " AND checkpoint_id = ?"
+            params += (checkpoint_id,)
+        else:
+            query += " ORDER BY checkpoint_id DESC LIMIT 1"
+        with self.lock:
+            row = self.conn.execute(query, params).fetchone()
+            self.touched[thread_id] = time.time()
+        if row is None:
+            return None
+        return self._load_tuple(thread_id, checkpoint_ns, row)
+
+    def list(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[Dict[str, Any]] = None,  # pylint: disable=redefined-builtin
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> Iterator[CheckpointTuple]:
+        """List checkpoints matching config, newest first."""
+        self.flush()
+        query = (
+            "SELECT thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, type, checkpoint, "
+            "metadata_type, metadata FROM checkpoints WHERE 1 = 1"
+        )
+        params: Tuple[Any, ...] = ()
+        if config:
+            query += " AND thread_id = ?"
+            params += (config["configurable"]["thread_id"],)
+            if (checkpoint_ns := config["configurable"].get("checkpoint_ns")) is not None:
+                query += " AND checkpoint_ns = ?"
+                params += (checkpoint_ns,)
+            if checkpoint_id := get_checkpoint_id(config):
+                query += " AND checkpoint_id = ?"
+                params += (checkpoint_id,)
+        if before and (before_checkpoint_id := get_checkpoint_id(before)):
+            query += " AND checkpoint_id < ?"
+            params += (before_checkpoint_id,)
+        query += " ORDER BY thread_id, checkpoint_ns, checkpoint_id DESC"
+        with self.lock:
+            rows = self.conn.execute(query, params).fetchall()
+
+        for thread_id, checkpoint_ns, *row in rows:
+            if limit is not None and limit <= 0:
+                break
+            item = self._load_tuple(thread_id, checkpoint_ns, tuple(row))
+            if filter and not all(item.metadata.get(key) == value for key, value in filter.items()):
+                continue
+            if limit is not None:
+                limit -= 1
+            yield item
+
+    def put(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        """Buffer a checkpoint for the next flush."""
+        next_config, due = self._buffer_checkpoint(config, checkpoint, metadata)
+        if due:
+            self.flush()
+        return next_config
+
+    def _buffer_checkpoint(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+    ) -> Tuple[RunnableConfig, bool]:
+        """Buffer a checkpoint, and return its config and whether to flush now."""
+        c = checkpoint.copy()
+        c.pop("pending_sends")  # type: ignore[misc]
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"]["checkpoint_ns"]
+        type_, serialized = self.serde.dumps_typed(c)
+        metadata_type, serialized_metadata = self.serde.dumps_typed(metadata)
+        observe("story_checkpoint_bytes", len(serialized) + len(serialized_metadata))
+        due = self._enqueue(
+            "INSERT OR REPLACE INTO checkpoints (thread_id, checkpoint_ns, checkpoint_id, "
+            "parent_checkpoint_id, type, checkpoint, metadata_type, metadata) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                thread_id,
+                checkpoint_ns,
+                checkpoint["id"],
+                config["configurable"].get("checkpoint_id"),  # parent
+                type_,
+                serialized,
+                metadata_type,
+                serialized_metadata,
+            ),
+            thread_id,
+        )
+        return {
+            "configurable": {
+                "thread_id": thread_id,
+                "checkpoint_ns": checkpoint_ns,
+                "checkpoint_id": checkpoint["id"],
+            }
+        }, due
+
+    def put_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[Tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        """Buffer the pending writes of a task for the next flush."""
+        if self._buffer_writes(config, writes, task_id, task_path):
+            self.flush()
+
+    def _buffer_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[Tuple[str, Any]],
+        task_id: str,
+        task_path: str,
+    ) -> bool:
+        """Buffer the pending writes of a task, and return whether to flush now."""
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = config["configurable"]["checkpoint_id"]
+        # An interrupt ends the run until it is resumed, perhaps by another process
+        due = any(channel == INTERRUPT for channel, _ in writes)
+        for idx, (channel, value) in enumerate(writes):
+            write_idx = WRITES_IDX_MAP.get(channel, idx)
+            # Regular writes are kept on retry, special channels are overwritten
+            verb = "INSERT OR IGNORE" if write_idx >= 0 else "INSERT OR REPLACE"
+            type_, serialized = self.serde.dumps_typed(value)
+            due = self._enqueue(
+                f"{verb} INTO writes (thread_id, checkpoint_ns, checkpoint_id, task_id, idx, "
+                "channel, type, value, task_path) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (thread_id, checkpoint_ns, checkpoint_id, task_id, write_idx,
+                 channel, type_, serialized, task_path),
+                thread_id,
+            ) or due
+        return due
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        """Asynchronous version of get_tuple, run in a thread."""
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[Dict[str, Any]] = None,  # pylint: disable=redefined-builtin
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> AsyncIterator[CheckpointTuple]:
+        """Asynchronous version of list, run in a thread."""
+        items = await asyncio.to_thread(
+            lambda: list(self.list(config, filter=filter, before=before, limit=limit))
+        )
+        for item in items:
+            yield item
+
+    async def aput(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        """Asynchronous version of put. Buffering is cheap and runs inline, a flush runs in a thread."""
+        next_config, due = self._buffer_checkpoint(config, checkpoint, metadata)
+        if due:
+            await asyncio.to_thread(self.flush)
+        return next_config
+
+    async def aput_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[Tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        """Asynchronous version of put_writes. Buffering is cheap and runs inline, a flush runs in a thread."""
+        if self._buffer_writes(config, writes, task_id, task_path):
+            await asyncio.to_thread(self.flush)
+
+    def get_next_version(self, current: Optional[str], channel: ChannelProtocol) -> str:
+        if current is None:
+            current_v = 0
+        elif isinstance(current, int):
+            current_v = current
+        else:
+            current_v = int(current.split(".")[0])
+        return f"{current_v + 1:032}.{random.random():016}"
+
+
+def make_checkpointer() -> BaseCheckpointSaver:
+    """Create the checkpointer selected by STORY_CHECKPOINTER."""
+    backend = os.getenv("STORY_CHECKPOINTER", "sqlite").lower()
+    # Installed even with versions off, to load the references written while they were on
+    serde = StoryReferenceSerializer(JsonPlusSerializer())
+    if backend == "memory":
+        return MemorySaver(serde=serde)
+    if backend == "sqlite":
+        return SQLiteSaver(
+            os.getenv("STORY_CHECKPOINT_PATH", "checkpoints.sqlite"),
+            keep_last=int(os.getenv("STORY_CHECKPOINT_KEEP_LAST", "10")),
+            ttl=float(os.getenv("STORY_CHECKPOINT_TTL", str(7 * 24 * 3600))),
+            max_threads=int(os.getenv("STORY_CHECKPOINT_MAX_THREADS", "10000")),
+            batch_size=int(os.getenv("STORY_CHECKPOINT_BATCH_SIZE", "64")),
+            flush_interval=float(os.getenv("STORY_CHECKPOINT_FLUSH_INTERVAL", "0.05")),
+            serde=serde,
+        )
+    raise ValueError(f"Unknown checkpointer backend: {backend}")
@@ -1,17 +1,66 @@
-"""Demo"""
+"""
+Demo
 
+main() runs the development server with auto-reload. serve() runs the
+production server: several worker processes, no reloader, uvloop and
+httptools when they are installed, and a graceful shutdown that lets runs in
+flight reach their confirmation interrupt and be checkpointed before a
+worker exits.
+
+serve() is configured through environment variables:
+
+    PORT                           port to listen on (default: 8000)
+    STORY_SERVER_HOST              interface to bind (default: 0.0.0.0)
+    STORY_SERVER_WORKERS           worker processes (default: CPU count)
+    STORY_SERVER_KEEP_ALIVE        seconds an idle keep-alive connection stays open (default: 5)
+    STORY_SERVER_LIMIT_CONCURRENCY connections per worker before answering 503, 0 no limit (default: 0)
+    STORY_SERVER_BACKLOG           connections waiting to be accepted (default: 2048)
+    STORY_SERVER_GRACEFUL_TIMEOUT  seconds to drain in-flight requests on shutdown (default: 30)
+
+Every worker resumes interrupts from the shared SQLite checkpointer, so a
+confirmation can land on any worker. With more than one worker, checkpoints
+are written as they are made rather than buffered (STORY_CHECKPOINT_BATCH_SIZE
+defaults to 1), so the next turn of a thread sees them whichever worker it
+lands on. The memory checkpointer is refused with more than one worker.
+"""
+
+import importlib.util
+import itertools
+import json
 import os
+import uuid
+from contextlib import asynccontextmanager
+from typing import List, Optional
 from dotenv import load_dotenv
 load_dotenv() # pylint: disable=wrong-import-position
 
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse
 import uvicorn
 from copilotkit.integrations.fastapi import add_fastapi_endpoint
 from copilotkit import CopilotKitRemoteEndpoint, LangGraphAgent
 from translate_agent.agent import graph
+from translate_agent.batch import (
+    batch_concurrency, batch_max_concurrency, batch_max_items, progress_path, read_prompts, run_batch
+)
+from translate_agent.library import get_library, library_api_enabled, run_library
+from translate_agent.metrics import render_prometheus
+from translate_agent.models import reset_models
+from translate_agent.workers import shutdown_pool
 
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    """Flush checkpoints and release workers and connections when the server stops."""
+    yield
+    close = getattr(graph.checkpointer, "close", None)
+    if close is not None:
+        close()
+    shutdown_pool(wait=False)
+    await reset_models()
+
+
+app = FastAPI(lifespan=lifespan)
 sdk = CopilotKitRemoteEndpoint(
     agents=[
         LangGraphAgent(
@@ -24,6 +73,58 @@ sdk = CopilotKitRemoteEndpoint(
 
 add_fastapi_endpoint(app, sdk, "/copilotkit")
 
+@app.get("/metrics")
+def metrics():
+    """Prometheus metrics of this process."""
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
+
+@app.post("/batch")
+async def batch(request: Request, batch_id: Optional[str] = None, concurrency: Optional[int] = None):
+    """
+    Write a story for every prompt of the body, and stream the results back as JSON lines.
+
+    The body has one prompt per line, as text or JSON (see batch.py). Post the
+    same body with the same batch_id to resume a batch, the stories already
+    sent back are skipped. The prompts and the concurrency of a request are
+    capped by STORY_BATCH_MAX_ITEMS and STORY_BATCH_MAX_CONCURRENCY.
+    """
+    max_concurrency = batch_max_concurrency()
+    if concurrency is not None and not 1 <= concurrency <= max_concurrency:
+        raise HTTPException(status_code=400, detail=f"concurrency must be between 1 and {max_concurrency}")
+    max_items = batch_max_items()
+    try:
+        lines = (await request.body()).decode("utf-8").splitlines()
+        items = list(itertools.islice(read_prompts(lines), max_items + 1))
+        progress = progress_path(batch_id) if batch_id else None
+    except (UnicodeDecodeError, ValueError) as error:
+        raise HTTPException(status_code=400, detail=str(error)) from error
+    if len(items) > max_items:
+        raise HTTPException(status_code=413, detail=f"A batch may hold at most {max_items} prompts")
+    concurrency = min(concurrency or batch_concurrency(), max_concurrency)
+
+    async def lines():
+        async for result in run_batch(items, batch_id or uuid.uuid4().hex, concurrency, progress, graph):
+            yield json.dumps(result, ensure_ascii=False) + "\n"
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+@app.get("/library")
+async def library(q: str = "", genre: List[str] = Query(default=[]),
+                  limit: int = Query(default=20, ge=1, le=100), offset: int = Query(default=0, ge=0)):
+    """Search the finalized stories, see library.py."""
+    if not library_api_enabled():
+        raise HTTPException(status_code=404, detail="The library API is disabled, see STORY_LIBRARY_API")
+    return await run_library(get_library().search, q, genre, limit, offset)
+
+@app.get("/library/{thread_id}")
+async def library_story(thread_id: str):
+    """The finalized story of a thread."""
+    if not library_api_enabled():
+        raise HTTPException(status_code=404, detail="The library API is disabled, see STORY_LIBRARY_API")
+    story = await run_library(get_library().get, thread_id)
+    if story is None:
+        raise HTTPException(status_code=404, detail=f"No story for thread {thread_id}")
+    return story
+
 def main():
     """Run the uvicorn server."""
     port = int(os.getenv("PORT", "8000"))
@@ -40,3 +141,30 @@ def main():
              )
         )
     )
+
+
+def serve():
+    """Run the production server."""
+    workers = int(os.getenv("STORY_SERVER_WORKERS", str(os.cpu_count() or 1)))
+    if workers > 1 and os.getenv("STORY_CHECKPOINTER", "sqlite").lower() == "memory":
+        raise SystemExit("STORY_CHECKPOINTER=memory can't be shared by several workers, use sqlite")
+    if workers > 1:
+        # A checkpoint still buffered in one worker would be missing in the others
+        os.environ.setdefault("STORY_CHECKPOINT_BATCH_SIZE", "1")
+    # Share the CPUs between the server workers and their diff pools
+    os.environ.setdefault("STORY_WORKER_POOL_SIZE", str(max(1, (os.cpu_count() or 1) // workers)))
+
+    loop = "uvloop" if importlib.util.find_spec("uvloop") else "asyncio"
+    http = "httptools" if importlib.util.find_spec("httptools") else "h11"
+    uvicorn.run(
+        "translate_agent.demo:app",
+        host=os.getenv("STORY_SERVER_HOST", "0.0.0.0"),
+        port=int(os.getenv("PORT", "8000")),
+        workers=workers,
+        loop=loop,
+        http=http,
+        timeout_keep_alive=int(os.getenv("STORY_SERVER_KEEP_ALIVE", "5")),
+        limit_concurrency=int(os.getenv("STORY_SERVER_LIMIT_CONCURRENCY", "0")) or None,
+        backlog=int(os.getenv("STORY_SERVER_BACKLOG", "2048")),
+        timeout_graceful_shutdown=int(os.getenv("STORY_SERVER_GRACEFUL_TIMEOUT", "30")),
+    )
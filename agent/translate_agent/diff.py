@@ -0,0 +1,510 @@
+"""
+Word-level diffing for story edits.
+
+Stories are compared in two passes. Paragraphs are matched first, so
+paragraphs that did not change are skipped without looking at their words.
+A Myers O(ND) word diff then runs only over the paragraphs that changed.
+
+StreamingDiff does the same for a story that is still being generated,
+aligning each new paragraph against the old story once it is complete.
+"""
+
+import bisect
+import re
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# (tag, old_start, old_end, new_start, new_end), offsets are characters
+Opcode = Tuple[str, int, int, int, int]
+
+# Upper bound on the Myers search depth for a single changed region.
+# Regions that differ by more than this are reported as a whole replacement.
+DEFAULT_MAX_COST = 1000
+
+_TOKEN_RE = re.compile(r'\S+|\s+')
+_PARAGRAPH_BREAK_RE = re.compile(r'\n[ \t]*\n\s*')
+
+
+def tokenize(text: str) -> List[str]:
+    """Split text into words and whitespace runs."""
+    return _TOKEN_RE.findall(text)
+
+
+def split_paragraphs(text: str) -> List[Tuple[int, int]]:
+    """
+    Return the (start, end) offsets of each paragraph in text.
+
+    A paragraph keeps the blank lines that follow it, so the spans cover
+    the whole text and never split a whitespace token.
+    """
+    spans = []
+    start = 0
+    for match in _PARAGRAPH_BREAK_RE.finditer(text):
+        spans.append((start, match.end()))
+        start = match.end()
+    if start < len(text):
+        spans.append((start, len(text)))
+    return spans
+
+
+def _bisect(a: Sequence[int], b: Sequence[int], a0: int, a1: int, b0: int, b1: int,
+            max_cost: Optional[int]) -> Optional[Tuple[int, int]]:
+    """
+    Find the middle of the shortest edit path between a[a0:a1] and b[b0:b1].
+
+    Returns the split point relative to (a0, b0), or None when the two ranges
+    share nothing or differ by more than max_cost edits.
+    """
+    n = a1 - a0
+    m = b1 - b0
+    max_d = (n + m + 1) // 2
+    v_offset = max_d
+    v_length = 2 * max_d + 2
+    v1 = [-1] * v_length
+    v1[v_offset + 1] = 0
+    v2 = v1[:]
+    delta = n - m
+    front = delta % 2 != 0
+    k1start = k1end = k2start = k2end = 0
+    steps = max_d if max_cost is None else min(max_d, max_cost)
+    for d in range(steps):
+        # Walk the forward path one step
+        for k1 in range(-d + k1start, d + 1 - k1end, 2):
+            k1_offset = v_offset + k1
+            if k1 == -d or (k1 != d and v1[k1_offset - 1] < v1[k1_offset + 1]):
+                x1 = v1[k1_offset + 1]
+            else:
+                x1 = v1[k1_offset - 1] + 1
+            y1 = x1 - k1
+            while x1 < n and y1 < m and a[a0 + x1] == b[b0 + y1]:
+                x1 += 1
+                y1 += 1
+            v1[k1_offset] = x1
+            if x1 > n:
+                k1end += 2
+            elif y1 > m:
+                k1start += 2
+            elif front:
+                k2_offset = v_offset + delta - k1
+                if 0 <= k2_offset < v_length and v2[k2_offset] != -1:
+                    if x1 >= n - v2[k2_offset]:
+                        return x1, y1
+
+        # Walk the reverse path one step
+        for k2 in range(-d + k2start, d + 1 - k2end, 2):
+            k2_offset = v_offset + k2
+            if k2 == -d or (k2 != d and v2[k2_offset - 1] < v2[k2_offset + 1]):
+                x2 = v2[k2_offset + 1]
+            else:
+                x2 = v2[k2_offset - 1] + 1
+            y2 = x2 - k2
+            while x2 < n and y2 < m and a[a1 - 1 - x2] == b[b1 - 1 - y2]:
+                x2 += 1
+                y2 += 1
+            v2[k2_offset] = x2
+            if x2 > n:
+                k2end += 2
+            elif y2 > m:
+                k2start += 2
+            elif not front:
+                k1_offset = v_offset + delta - k2
+                if 0 <= k1_offset < v_length and v1[k1_offset] != -1:
+                    x1 = v1[k1_offset]
+                    if x1 >= n - x2:
+                        return x1, v_offset + x1 - k1_offset
+    return None
+
+
+def matching_blocks(a: Sequence[int], b: Sequence[int],
+                    max_cost: Optional[int] = None) -> List[Tuple[int, int, int]]:
+    """
+    Return the (i, j, size) runs that a and b have in common, in order.
+
+    Uses Myers' linear-space O(ND) algorithm, trimming the common prefix and
+    suffix of every sub-problem before bisecting it.
+    """
+    blocks: List[Tuple[int, int, int]] = []
+    # Work items are ("solve", a0, a1, b0, b1) or ("match", i, j, size)
+    stack: List[Tuple[str, int, int, int, int]] = [("solve", 0, len(a), 0, len(b))]
+    while stack:
+        kind, a0, a1, b0, b1 = stack.pop()
+        if kind == "match":
+            blocks.append((a0, a1, b0))
+            continue
+
+        prefix = 0
+        while a0 + prefix < a1 and b0 + prefix < b1 and a[a0 + prefix] == b[b0 + prefix]:
+            prefix += 1
+        if prefix:
+            blocks.append((a0, b0, prefix))
+            a0 += prefix
+            b0 += prefix
+
+        suffix = 0
+        while a0 < a1 - suffix and b0 < b1 - suffix and a[a1 - 1 - suffix] == b[b1 - 1 - suffix]:
+            suffix += 1
+        if suffix:
+            stack.append(("match", a1 - suffix, b1 - suffix, suffix, 0))
+            a1 -= suffix
+            b1 -= suffix
+
+        if a0 == a1 or b0 == b1:
+            continue
+
+        split = _bisect(a, b, a0, a1, b0, b1, max_cost)
+        if split is None:
+            continue
+        x, y = split
+        # Pushed in reverse so the left half is solved first
+        stack.append(("solve", a0 + x, a1, b0 + y, b1))
+        stack.append(("solve", a0, a0 + x, b0, b0 + y))
+
+    # Merge runs that touch, so callers see maximal blocks
+    merged: List[Tuple[int, int, int]] = []
+    for i, j, size in blocks:
+        if merged and merged[-1][0] + merged[-1][2] == i and merged[-1][1] + merged[-1][2] == j:
+            merged[-1] = (merged[-1][0], merged[-1][1], merged[-1][2] + size)
+        else:
+            merged.append((i, j, size))
+    return merged
+
+
+def _intern(items: Sequence[str], ids: Dict[str, int]) -> List[int]:
+    """Map each string to a small integer so comparisons stay cheap."""
+    return [ids.setdefault(item, len(ids)) for item in items]
+
+
+def _word_opcodes(old_text: str, new_text: str, old_start: int, old_end: int,
+                  new_start: int, new_end: int, ids: Dict[str, int],
+                  max_cost: Optional[int]) -> Iterator[Opcode]:
+    """Yield word-level opcodes for old_text[old_start:old_end] against new_text[new_start:new_end]."""
+    old_matches = list(_TOKEN_RE.finditer(old_text, old_start, old_end))
+    new_matches = list(_TOKEN_RE.finditer(new_text, new_start, new_end))
+    old_offsets = [match.start() for match in old_matches] + [old_end]
+    new_offsets = [match.start() for match in new_matches] + [new_end]
+    a = _intern([match.group() for match in old_matches], ids)
+    b = _intern([match.group() for match in new_matches], ids)
+
+    i = j = 0
+    for bi, bj, size in matching_blocks(a, b, max_cost) + [(len(a), len(b), 0)]:
+        if i < bi or j < bj:
+            yield ("change", old_offsets[i], old_offsets[bi], new_offsets[j], new_offsets[bj])
+        if size:
+            yield ("equal", old_offsets[bi], old_offsets[bi + size], new_offsets[bj], new_offsets[bj + size])
+        i = bi + size
+        j = bj + size
+
+
+def _raw_opcodes(old_text: str, new_text: str, max_cost: Optional[int]) -> Iterator[Opcode]:
+    """Yield unmerged opcodes, diffing words only inside changed paragraphs."""
+    old_paragraphs = split_paragraphs(old_text)
+    new_paragraphs = split_paragraphs(new_text)
+    paragraph_ids: Dict[str, int] = {}
+    a = _intern([old_text[start:end] for start, end in old_paragraphs], paragraph_ids)
+    b = _intern([new_text[start:end] for start, end in new_paragraphs], paragraph_ids)
+    old_offsets = [start for start, _ in old_paragraphs] + [len(old_text)]
+    new_offsets = [start for start, _ in new_paragraphs] + [len(new_text)]
+
+    token_ids: Dict[str, int] = {}
+    i = j = 0
+    for bi, bj, size in matching_blocks(a, b) + [(len(a), len(b), 0)]:
+        if i < bi and j < bj and bi - i == bj - j:
+            # Same number of paragraphs on both sides, diff them pairwise
+            for offset in range(bi - i):
+                yield from _word_opcodes(
+                    old_text, new_text,
+                    old_offsets[i + offset], old_offsets[i + offset + 1],
+                    new_offsets[j + offset], new_offsets[j + offset + 1],
+                    token_ids, max_cost
+                )
+        elif i < bi and j < bj:
+            yield from _word_opcodes(
+                old_text, new_text,
+                old_offsets[i], old_offsets[bi], new_offsets[j], new_offsets[bj],
+                token_ids, max_cost
+            )
+        elif i < bi or j < bj:
+            yield ("change", old_offsets[i], old_offsets[bi], new_offsets[j], new_offsets[bj])
+        if size:
+            yield ("equal", old_offsets[bi], old_offsets[bi + size], new_offsets[bj], new_offsets[bj + size])
+        i = bi + size
+        j = bj + size
+
+
+def diff_opcodes(old_text: str, new_text: str,
+                 max_cost: Optional[int] = DEFAULT_MAX_COST) -> List[Opcode]:
+    """
+    Compute word-level differences between two texts.
+
+    Args:
+        old_text: The previous version of the text
+        new_text: The new version of the text
+        max_cost: Search depth limit per changed region, None for no limit
+
+    Returns:
+        Opcodes in the style of difflib's get_opcodes(), with character offsets.
+        Adjacent changes are merged, so equal and non-equal runs alternate.
+    """
+    opcodes: List[Opcode] = []
+    for tag, i1, i2, j1, j2 in _raw_opcodes(old_text, new_text, max_cost):
+        if i1 == i2 and j1 == j2:
+            continue
+        if opcodes and (opcodes[-1][0] == "equal") == (tag == "equal"):
+            _, p1, _, q1, _ = opcodes[-1]
+            opcodes[-1] = (tag, p1, i2, q1, j2)
+        else:
+            opcodes.append((tag, i1, i2, j1, j2))
+
+    result: List[Opcode] = []
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag != "equal":
+            if i1 == i2:
+                tag = "insert"
+            elif j1 == j2:
+                tag = "delete"
+            else:
+                tag = "replace"
+        result.append((tag, i1, i2, j1, j2))
+    return result
+
+
+def compact_diff(old_text: str, new_text: str,
+                 max_cost: Optional[int] = DEFAULT_MAX_COST) -> List[List[Any]]:
+    """
+    Compute a compact diff payload for storing in agent state.
+
+    Args:
+        old_text: The previous version of the text
+        new_text: The new version of the text
+        max_cost: Search depth limit per changed region, None for no limit
+
+    Returns:
+        One [op, old_start, old_end, new_start, new_end] entry per changed run,
+        where op is "insert", "delete" or "replace". Unchanged text between
+        runs is implied, so the payload does not repeat the story.
+    """
+    return [
+        [tag, i1, i2, j1, j2]
+        for tag, i1, i2, j1, j2 in diff_opcodes(old_text, new_text, max_cost)
+        if tag != 'equal'
+    ]
+
+
+def coarse_compact_diff(old_text: str, new_text: str) -> List[List[Any]]:
+    """
+    Compute a compact diff without searching inside changed paragraphs.
+
+    Only the common leading and trailing words of each changed paragraph are
+    kept, so this runs in linear time. Used when the worker pool is busy.
+    """
+    return compact_diff(old_text, new_text, max_cost=0)
+
+
+# Changed paragraphs held until a paragraph matches, before the oldest one is
+# finalized on its own, so the changes of a story that is rewritten throughout
+# still show up a couple of paragraphs after they are generated
+_MAX_PENDING = 2
+
+# Share of the words of the shorter paragraph that two paragraphs need in common
+# for one to be taken as a rewrite of the other
+_SIMILARITY = 0.5
+
+
+def _similar(old_paragraph: str, new_paragraph: str) -> bool:
+    """Whether new_paragraph looks like a rewrite of old_paragraph."""
+    old_words = set(old_paragraph.lower().split())
+    new_words = set(new_paragraph.lower().split())
+    return len(old_words & new_words) >= _SIMILARITY * max(1, min(len(old_words), len(new_words)))
+
+
+class StreamingDiff:
+    """
+    Word-level diff of a story that is still being generated against the old one.
+
+    update() takes the new text so far, which must extend the text of the
+    previous call. Each new paragraph is aligned with the old paragraphs
+    once it is complete, that is once the text after its blank line has
+    started, and the changes before it become final. A paragraph equal to
+    the next old paragraph matches it; one equal to an old paragraph further
+    on matches it only if that paragraph is unique in the old story, and
+    the old paragraphs in between are deleted. Paragraphs that match
+    nothing wait for the next match, then are diffed word by word against
+    the old paragraphs they replace, the way diff_opcodes() does. When more
+    than a couple are waiting, the oldest is taken as a rewrite of the next
+    old paragraph if most of their words are shared, and as an inserted
+    paragraph otherwise, so a story rewritten throughout still shows its
+    changes as it streams. A change in place is final one paragraph after
+    it was generated.
+
+    Each paragraph is aligned once and each call only scans the text added
+    since the previous one, so the work over a whole stream is linear in
+    the length of the story, plus the word diffs of the changed paragraphs.
+
+    Args:
+        old_text: The previous version of the story
+        max_cost: Search depth limit per changed region, None for no limit
+    """
+
+    def __init__(self, old_text: str, max_cost: Optional[int] = DEFAULT_MAX_COST) -> None:
+        self.old_text = old_text
+        self.max_cost = max_cost
+        spans = split_paragraphs(old_text)
+        self._old_offsets = [start for start, _ in spans] + [len(old_text)]
+        # Paragraphs are keyed without their trailing blank lines, the last one has none
+        self._positions: Dict[str, List[int]] = {}
+        for index, (start, end) in enumerate(spans):
+            self._positions.setdefault(old_text[start:end].rstrip(), []).append(index)
+        self._token_ids: Dict[str, int] = {}
+        self._old_index = 0  # First old paragraph that isn't aligned yet
+        self._pending: List[Tuple[int, int]] = []  # New paragraphs that match nothing yet
+        self._new_done = 0  # End of the last complete new paragraph
+        self._scan = 0  # Paragraph breaks end after this offset of the new text
+        self._text = ""  # The new text of the last call
+        self._ops: List[List[Any]] = []
+
+    @property
+    def ops(self) -> List[List[Any]]:
+        """The final changes so far, in the format of compact_diff()."""
+        return self._ops
+
+    @property
+    def progress(self) -> Tuple[int, int]:
+        """Offsets in the old and the new text up to which the changes are final."""
+        if self._pending:
+            return self._old_offsets[self._old_index], self._pending[0][0]
+        return self._old_offsets[self._old_index], self._new_done
+
+    def update(self, new_text: str) -> List[List[Any]]:
+        """Align the paragraphs completed in new_text and return the changes so far."""
+        for match in _PARAGRAPH_BREAK_RE.finditer(new_text, self._scan):
+            if match.end() == len(new_text):
+                # The blank lines may go on in the next chunk
+                break
+            self._paragraph(new_text, self._new_done, match.end())
+            self._new_done = match.end()
+        self._text = new_text
+        # A paragraph break can only start after the last character that isn't whitespace
+        self._scan = len(new_text)
+        while self._scan > self._new_done and new_text[self._scan - 1].isspace():
+            self._scan -= 1
+        return self._ops
+
+    def finish(self, new_text: str) -> List[List[Any]]:
+        """
+        Align the rest of the complete new text and return all the changes.
+
+        Raises:
+            ValueError: If new_text doesn't extend the text given to update()
+        """
+        if not new_text.startswith(self._text):
+            raise ValueError("The new text doesn't extend the streamed text")
+        self.update(new_text)
+        if self._new_done < len(new_text):
+            self._paragraph(new_text, self._new_done, len(new_text))
+            self._new_done = len(new_text)
+        self._flush(new_text, len(self._old_offsets) - 1, self._new_done)
+        return self._ops
+
+    def _paragraph(self, new_text: str, start: int, end: int) -> None:
+        """Align the complete new paragraph new_text[start:end]."""
+        candidates = self._positions.get(new_text[start:end].rstrip(), ())
+        position = bisect.bisect_left(candidates, self._old_index)
+        index = candidates[position] if position < len(candidates) else None
+        if index is not None and index > self._old_index and len(candidates) > 1:
+            # A repeated paragraph, such as a scene break, is only matched in place
+            index = None
+        if index is None:
+            self._pending.append((start, end))
+            if len(self._pending) > _MAX_PENDING:
+                # The oldest held paragraph is a rewrite of the next old one if they
+                # share most of their words, and a new paragraph otherwise
+                first_start, first_end = self._pending.pop(0)
+                old_first = self._old_index
+                if old_first < len(self._old_offsets) - 1 and _similar(
+                        self.old_text[self._old_offsets[old_first]:self._old_offsets[old_first + 1]],
+                        new_text[first_start:first_end]):
+                    self._old_index += 1
+                self._region(new_text, old_first, self._old_index, first_start, first_end)
+            return
+        self._flush(new_text, index, start)
+        # Equal apart from the blank lines after them, which only the last paragraph may lack
+        self._region(new_text, index, index + 1, start, end)
+        self._old_index = index + 1
+
+    def _flush(self, new_text: str, old_end: int, new_end: int) -> None:
+        """Diff the held paragraphs against the old paragraphs up to old_end."""
+        new_start = self._pending[0][0] if self._pending else new_end
+        if old_end > self._old_index and len(self._pending) == old_end - self._old_index:
+            # Same number of paragraphs on both sides, diff them pairwise
+            for offset, (start, end) in enumerate(self._pending):
+                self._region(new_text, self._old_index + offset, self._old_index + offset + 1, start, end)
+        else:
+            self._region(new_text, self._old_index, old_end, new_start, new_end)
+        self._pending = []
+        self._old_index = old_end
+
+    def _region(self, new_text: str, old_first: int, old_last: int, new_start: int, new_end: int) -> None:
+        """Add the changes between old paragraphs old_first to old_last and new_text[new_start:new_end]."""
+        old_start, old_end = self._old_offsets[old_first], self._old_offsets[old_last]
+        if old_start == old_end or new_start == new_end:
+            self._add(old_start, old_end, new_start, new_end)
+        elif self.old_text[old_start:old_end] != new_text[new_start:new_end]:
+            for tag, i1, i2, j1, j2 in _word_opcodes(self.old_text, new_text, old_start, old_end,
+                                                      new_start, new_end, self._token_ids, self.max_cost):
+                if tag != "equal":
+                    self._add(i1, i2, j1, j2)
+
+    def _add(self, i1: int, i2: int, j1: int, j2: int) -> None:
+        """Add a change, merged with the previous one when they touch."""
+        if i1 == i2 and j1 == j2:
+            return
+        if self._ops and self._ops[-1][2] == i1 and self._ops[-1][4] == j1:
+            i1, j1 = self._ops[-1][1], self._ops[-1][3]
+            self._ops.pop()
+        tag = "insert" if i1 == i2 else "delete" if j1 == j2 else "replace"
+        self._ops.append([tag, i1, i2, j1, j2])
+
+
+def render_diff_markup(old_text: str, new_text: str, ops: Sequence[Sequence[Any]]) -> str:
+    """
+    Render a compact diff as HTML markup.
+
+    Args:
+        old_text: The previous version of the text
+        new_text: The new version of the text
+        ops: Changed runs as returned by compact_diff
+
+    Returns:
+        HTML markup with added words in green and deleted words in red
+    """
+    markup = []
+    position = 0
+    for _, i1, i2, j1, j2 in ops:
+        # Unchanged text
+        markup.append(old_text[position:i1])
+        # Deleted text (red) comes before added text (green)
+        markup.extend([f'<span class="deleted">{token}</span>' for token in tokenize(old_text[i1:i2])])
+        markup.extend([f'<span class="added">{token}</span>' for token in tokenize(new_text[j1:j2])])
+        position = i2
+    markup.append(old_text[position:])
+    return ''.join(markup)
+
+
+def generate_diff_markup(old_text: str, new_text: str,
+                         max_cost: Optional[int] = DEFAULT_MAX_COST) -> str:
+    """
+    Generate HTML markup with additions and deletions highlighted.
+
+    Args:
+        old_text: The previous version of the text
+        new_text: The new version of the text
+        max_cost: Search depth limit per changed region, None for no limit
+
+    Returns:
+        HTML markup with added words in green and deleted words in red
+    """
+    # Imported here so worker processes that only diff stay free of the LangChain imports
+    from translate_agent.metrics import span  # pylint: disable=import-outside-toplevel
+
+    with span("story_diff_seconds", kind="markup"):
+        result = render_diff_markup(old_text, new_text, compact_diff(old_text, new_text, max_cost))
+    return result
@@ -0,0 +1,247 @@
+"""
+Delta emission of intermediate state to the UI.
+
+While a story streams, every emit used to send the whole state: the story so
+far, the previous story and the diff, tens of kilobytes on a long story,
+several times a second. StateEmitter sends what changed instead, as
+JSON-Patch-style operations against the state the UI already has.
+
+CopilotKit sends the UI the full graph state when a node starts, so that is
+the base of the first delta of a stream, and each delta after it applies to
+the one before. A node can stream more than once, an edit falls back to the
+whole story when its patch doesn't apply, and each stream starts again from
+the node's state. The emitted state keeps the small fields as they are and
+replaces the large ones (DELTA_FIELDS) with a "state_patch":
+
+    {"stream": "5f0c2a91", "seq": 3, "base": 2, "ops": [
+        {"op": "append", "path": "/story_content/story", "value": " and the sea"},
+        {"op": "splice", "path": "/story_content/story", "start": 120, "delete": 8, "value": "storm"},
+        {"op": "replace", "path": "/diff_markup", "value": "..."},
+        {"op": "add", "path": "/chapters/-", "value": {...}},
+        {"op": "remove", "path": "/story_outline/title"}
+    ]}
+
+"add", "replace" and "remove" are JSON Patch operations. "append" adds text at
+the end of a string that is still streaming, and "splice" replaces a part of
+a string in the middle; their offsets count UTF-16 code units, the way
+JavaScript indexes strings. The UI applies a delta whose base is the last
+seq it has of the same stream, or the state of the node when the base is 0,
+and ignores deltas after one it missed until the next full state. CopilotKit
+can send the same state twice, so a delta is applied once per stream and
+seq. Every resync_interval emits, the state is sent whole, with
+{"stream": ..., "seq": n, "full": true}, and the node's final state is
+always sent whole by CopilotKit.
+
+apply_ops() applies operations the way the UI does, in
+ui/components/statePatch.ts.
+
+Configured through environment variables:
+
+    STORY_EMIT_DELTAS           send intermediate state as deltas (default: true)
+    STORY_EMIT_RESYNC_INTERVAL  emits between two full states (default: 600)
+"""
+
+import os
+import uuid
+from typing import Any, Dict, List
+
+from translate_agent.metrics import register_collector
+
+# State keys sent as deltas, the others are small and sent as they are
+DELTA_FIELDS = ("story_content", "previous_story_content", "diff_ops", "diff_markup", "story_outline", "chapters")
+
+# Characters compared at once when looking for the common prefix of two texts
+_BLOCK = 4096
+
+_stats: Dict[str, int] = {
+    "deltas": 0,
+    "resyncs": 0,
+    "ops": 0,
+}
+
+
+def deltas_enabled() -> bool:
+    """Whether intermediate state is sent as deltas."""
+    return os.getenv("STORY_EMIT_DELTAS", "true").lower() == "true"
+
+
+def _escape(key: str) -> str:
+    return key.replace("~", "~0").replace("/", "~1")
+
+
+def _unescape(segment: str) -> str:
+    return segment.replace("~1", "/").replace("~0", "~")
+
+
+def _utf16_length(text: str) -> int:
+    return len(text) if text.isascii() else len(text.encode("utf-16-le")) // 2
+
+
+def common_prefix(old: str, new: str) -> int:
+    """Length of the common prefix of two strings, comparing a block at a time."""
+    limit = min(len(old), len(new))
+    start = 0
+    while start < limit and old[start:start + _BLOCK] == new[start:start + _BLOCK]:
+        start += _BLOCK
+    if start >= limit:
+        return limit
+    end = min(start + _BLOCK, limit)
+    while start < end and old[start] == new[start]:
+        start += 1
+    return start
+
+
+def common_suffix(old: str, new: str, limit: int) -> int:
+    """Length of the common suffix of two strings, at most limit."""
+    length = 0
+    while length < limit:
+        step = min(_BLOCK, limit - length)
+        if old[len(old) - length - step:len(old) - length] == new[len(new) - length - step:len(new) - length]:
+            length += step
+            continue
+        while length < limit and old[len(old) - length - 1] == new[len(new) - length - 1]:
+            length += 1
+        break
+    return length
+
+
+def _text_op(old: str, new: str, path: str) -> Dict[str, Any]:
+    if new.startswith(old):
+        return {"op": "append", "path": path, "value": new[len(old):]}
+    prefix = common_prefix(old, new)
+    suffix = common_suffix(old, new, min(len(old), len(new)) - prefix)
+    return {
+        "op": "splice",
+        "path": path,
+        "start": _utf16_length(old[:prefix]),
+        "delete": _utf16_length(old[prefix:len(old) - suffix]),
+        "value": new[prefix:len(new) - suffix],
+    }
+
+
+def diff_values(old: Any, new: Any, path: str = "") -> List[Dict[str, Any]]:
+    """
+    Compute the operations that turn old into new.
+
+    Args:
+        old: The value the UI has
+        new: The value to send
+        path: JSON Pointer of the values
+
+    Returns:
+        The operations, none when the values are equal
+    """
+    if old == new:
+        return []
+    if isinstance(old, dict) and isinstance(new, dict):
+        ops: List[Dict[str, Any]] = [{"op": "remove", "path": f"{path}/{_escape(key)}"} for key in old if key not in new]
+        for key, value in new.items():
+            if key not in old:
+                ops.append({"op": "add", "path": f"{path}/{_escape(key)}", "value": value})
+            else:
+                ops.extend(diff_values(old[key], value, f"{path}/{_escape(key)}"))
+        return ops
+    if isinstance(old, str) and isinstance(new, str):
+        return [_text_op(old, new, path)]
+    if isinstance(old, list) and isinstance(new, list) and len(new) >= len(old):
+        # Lists grow at the end while they stream, and the last item may still change
+        ops = []
+        for index, item in enumerate(old):
+            ops.extend(diff_values(item, new[index], f"{path}/{index}"))
+        return ops + [{"op": "add", "path": f"{path}/-", "value": item} for item in new[len(old):]]
+    return [{"op": "replace", "path": path, "value": new}]
+
+
+def _utf16_index(text: str, units: int) -> int:
+    """Index in text of an offset counted in UTF-16 code units."""
+    if text.isascii():
+        return units
+    return len(text.encode("utf-16-le")[:units * 2].decode("utf-16-le", errors="ignore"))
+
+
+def apply_ops(value: Dict[str, Any], ops: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Apply operations from diff_values() to value, copying what they change.
+
+    The containers on the path of an operation are copied and the rest is
+    shared with value, so a value used in two places changes in one only.
+
+    Raises:
+        KeyError: If a path doesn't exist in value
+    """
+    value = dict(value)
+    for op in ops:
+        *parents, last = [_unescape(segment) for segment in op["path"].split("/")[1:]]
+        target: Any = value
+        for segment in parents:
+            key: Any = int(segment) if isinstance(target, list) else segment
+            target[key] = list(target[key]) if isinstance(target[key], list) else dict(target[key])
+            target = target[key]
+        if isinstance(target, list):
+            if op["op"] == "add" and last == "-":
+                target.append(op["value"])
+                continue
+            key = int(last)
+        else:
+            key = last
+        if op["op"] == "remove":
+            del target[key]
+        elif op["op"] == "append":
+            target[key] += op["value"]
+        elif op["op"] == "splice":
+            text = target[key]
+            start = _utf16_index(text, op["start"])
+            end = start + _utf16_index(text[start:], op["delete"])
+            target[key] = text[:start] + op["value"] + text[end:]
+        else:
+            target[key] = op["value"]
+    return value
+
+
+class StateEmitter:
+    """
+    Turns the states emitted during one stream into deltas.
+
+    Args:
+        base: The state the UI has when the stream starts, the node's state
+        resync_interval: Emits between two full states
+    """
+
+    def __init__(self, base: Dict[str, Any], resync_interval: int = 600) -> None:
+        self.view = {field: base[field] for field in DELTA_FIELDS if field in base}
+        self.resync_interval = max(resync_interval, 1)
+        self.stream = uuid.uuid4().hex[:8]
+        self.seq = 0
+        self.since_resync = 0
+
+    def message(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        """Return what to emit for state: the small fields and a delta, or the whole state."""
+        large = {field: state[field] for field in DELTA_FIELDS if field in state}
+        self.seq += 1
+        if self.since_resync >= self.resync_interval:
+            self.since_resync = 0
+            self.view = large
+            _stats["resyncs"] += 1
+            return {**state, "state_patch": {"stream": self.stream, "seq": self.seq, "full": True}}
+        ops = diff_values(self.view, large)
+        self.since_resync += 1
+        self.view = large
+        _stats["deltas"] += 1
+        _stats["ops"] += len(ops)
+        small = {key: value for key, value in state.items() if key not in DELTA_FIELDS}
+        return {**small, "state_patch": {"stream": self.stream, "seq": self.seq, "base": self.seq - 1, "ops": ops}}
+
+
+def make_emitter(base: Dict[str, Any]) -> "StateEmitter | None":
+    """Return a StateEmitter for a stream that starts from base, or None when deltas are off."""
+    if not deltas_enabled():
+        return None
+    return StateEmitter(base, int(os.getenv("STORY_EMIT_RESYNC_INTERVAL", "600")))
+
+
+def emission_stats() -> Dict[str, int]:
+    """Return counters of deltas, full resyncs and operations sent."""
+    return dict(_stats)
+
+
+register_collector("story_emission", emission_stats)
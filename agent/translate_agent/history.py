@@ -0,0 +1,116 @@
+"""
+Bounded message history for the story graph.
+
+Only a window of recent messages is kept in state and sent to the model.
+Messages that fall out of the window are folded into a rolling summary, so
+long sessions keep a constant prompt size.
+
+Configured through environment variables:
+
+    STORY_HISTORY_MAX_MESSAGES   messages kept in the window, 0 keeps all (default: 20)
+    STORY_HISTORY_SUMMARY        "extractive", "llm" or "off" (default: extractive)
+    STORY_HISTORY_SUMMARY_CHARS  longest rolling summary kept (default: 2000)
+    STORY_HISTORY_SUMMARY_MODEL  model used by the "llm" summary (default: gpt-4o-mini)
+"""
+
+import os
+from typing import Any, Dict, List, Sequence, Tuple
+
+from langchain_core.messages import AnyMessage, HumanMessage, RemoveMessage, SystemMessage
+from langchain_core.runnables import RunnableConfig
+
+from translate_agent.models import configured_model
+
+
+def estimate_tokens(messages: Sequence[AnyMessage]) -> int:
+    """Roughly estimate the prompt tokens of messages, at four characters per token."""
+    return sum(len(str(message.content)) + len(str(message.additional_kwargs)) for message in messages) // 4
+
+
+def split_window(messages: Sequence[AnyMessage], max_messages: int) -> Tuple[List[AnyMessage], List[AnyMessage]]:
+    """
+    Split messages into the ones that fall out of the window and the ones kept.
+
+    The window always starts at a human message, so a tool call is never
+    separated from its tool response.
+    """
+    if max_messages <= 0 or len(messages) <= max_messages:
+        return [], list(messages)
+    start = len(messages) - max_messages
+    while start < len(messages) and not isinstance(messages[start], HumanMessage):
+        start += 1
+    if start == len(messages):
+        # No human message in the window, keep the latest turn whole
+        start = max(
+            (index for index, message in enumerate(messages) if isinstance(message, HumanMessage)),
+            default=0,
+        )
+    return list(messages[:start]), list(messages[start:])
+
+
+def _extractive_summary(summary: str, dropped: Sequence[AnyMessage]) -> str:
+    """Append the user requests in dropped to the summary."""
+    requests = [str(message.content) for message in dropped if isinstance(message, HumanMessage)]
+    if not requests:
+        return summary
+    lines = [summary] if summary else []
+    lines.extend(f"- {request}" for request in requests)
+    return "\n".join(lines)
+
+
+async def _llm_summary(summary: str, dropped: Sequence[AnyMessage], config: RunnableConfig) -> str:
+    """Ask a small model to fold dropped into the summary."""
+    model = configured_model(config, os.getenv("STORY_HISTORY_SUMMARY_MODEL", "gpt-4o-mini"))
+    transcript = "\n".join(f"{message.type}: {message.content}" for message in dropped if message.content)
+    response = await model.ainvoke([
+        SystemMessage(
+            content=f"""
+            Update the summary of an earlier conversation about a story.
+            Keep the user's requests and decisions, drop pleasantries.
+
+            Current summary:
+            {summary or "(none)"}
+
+            New messages:
+            {transcript}
+            """
+        ),
+    ], config)
+    return str(response.content)
+
+
+async def trim_history(state: Dict[str, Any], config: RunnableConfig) -> Dict[str, Any]:
+    """
+    Drop messages outside the window and fold them into history_summary.
+
+    Returns a state update with RemoveMessage entries for the dropped
+    messages, or an empty update when the history already fits.
+    """
+    max_messages = int(os.getenv("STORY_HISTORY_MAX_MESSAGES", "20"))
+    dropped, _ = split_window(state.get("messages", []), max_messages)
+    if not dropped:
+        return {}
+
+    summary = state.get("history_summary", "")
+    mode = os.getenv("STORY_HISTORY_SUMMARY", "extractive").lower()
+    if mode == "llm":
+        summary = await _llm_summary(summary, dropped, config)
+    elif mode == "extractive":
+        summary = _extractive_summary(summary, dropped)
+    max_chars = int(os.getenv("STORY_HISTORY_SUMMARY_CHARS", "2000"))
+    if len(summary) > max_chars:
+        # Oldest requests go first
+        summary = summary[-max_chars:].split("\n", 1)[-1]
+
+    return {
+        "messages": [RemoveMessage(id=message.id) for message in dropped if message.id],
+        "history_summary": summary,
+    }
+
+
+def summary_messages(state: Dict[str, Any]) -> List[AnyMessage]:
+    """Return the rolling summary as a message to put ahead of the window."""
+    summary = state.get("history_summary", "")
+    if not summary:
+        return []
+    return [SystemMessage(content=f"Summary of the earlier conversation:\n{summary}")]
@@ -0,0 +1,396 @@
+"""
+Library of finalized stories, with full-text search.
+
+A story only lives in its thread's checkpoints, so finding a past story
+would mean loading every thread. When a story is confirmed, or an earlier
+version restored, the library stores it under its thread, replacing the
+thread's previous story, in a SQLite file of its own that outlives the
+checkpoints. An FTS5 index over the title, genre, summary and text ranks
+matches with BM25, weighing a match in the title most and one in the text
+least.
+
+search() takes words to look for, genres to keep and a page. Each word has
+to match, a trailing "*" matches a prefix, and without words the most
+recently added stories are listed. Ranking scores every match, which
+for a word found in most of a million stories takes seconds, so a query
+with more than rank_window matches ranks the most recent rank_window of
+them and pages through those. Genres are compared case-insensitively
+through an index of their own, among the ranked matches or, without
+words, the whole library. A page is a limit and an offset.
+
+backfill() indexes the stories that are already in the checkpoints. It
+reads the latest checkpoint of each thread and indexes its story, or the
+one an edit waiting for confirmation started from. Run it once with:
+
+    poetry run library backfill
+    poetry run library search "lighthouse keeper" --genre Mystery
+
+Configured through environment variables:
+
+    STORY_LIBRARY              index confirmed stories (default: true)
+    STORY_LIBRARY_API          serve GET /library to any caller (default: false)
+    STORY_LIBRARY_PATH         SQLite file of the library (default: library.sqlite)
+    STORY_LIBRARY_RANK_WINDOW  most recent matches of a query that are ranked (default: 2000)
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections.abc import Iterable, Iterator
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from langgraph.checkpoint.base import BaseCheckpointSaver
+
+from translate_agent.metrics import observe, register_collector
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS library (
+    id INTEGER PRIMARY KEY,
+    thread_id TEXT NOT NULL UNIQUE,
+    title TEXT NOT NULL,
+    genre TEXT NOT NULL,
+    genre_key TEXT NOT NULL,
+    summary TEXT NOT NULL,
+    story TEXT NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS library_genre ON library (genre_key, id);
+CREATE VIRTUAL TABLE IF NOT EXISTS library_fts USING fts5(
+    title, genre, summary, story,
+    content='library', content_rowid='id', tokenize='porter unicode61'
+);
+CREATE TRIGGER IF NOT EXISTS library_insert AFTER INSERT ON library BEGIN
+    INSERT INTO library_fts (rowid, title, genre, summary, story)
+    VALUES (new.id, new.title, new.genre, new.summary, new.story);
+END;
+CREATE TRIGGER IF NOT EXISTS library_delete AFTER DELETE ON library BEGIN
+    INSERT INTO library_fts (library_fts, rowid, title, genre, summary, story)
+    VALUES ('delete', old.id, old.title, old.genre, old.summary, old.story);
+END;
+CREATE TRIGGER IF NOT EXISTS library_update AFTER UPDATE ON library BEGIN
+    INSERT INTO library_fts (library_fts, rowid, title, genre, summary, story)
+    VALUES ('delete', old.id, old.title, old.genre, old.summary, old.story);
+    INSERT INTO library_fts (rowid, title, genre, summary, story)
+    VALUES (new.id, new.title, new.genre, new.summary, new.story);
+END;
+"""
+
+# BM25 weights of the title, genre, summary and story columns
+_RANK = "bm25(10.0, 2.0, 5.0, 1.0)"
+
+_UPSERT = (
+    "INSERT INTO library (thread_id, title, genre, genre_key, summary, story, updated) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?) "
+    "ON CONFLICT (thread_id) DO UPDATE SET title = excluded.title, genre = excluded.genre, "
+    "genre_key = excluded.genre_key, summary = excluded.summary, story = excluded.story, "
+    "updated = excluded.updated"
+)
+
+_stats: Dict[str, int] = {
+    "indexed": 0,
+    "searches": 0,
+    "backfilled": 0,
+}
+
+
+def library_enabled() -> bool:
+    """Whether confirmed stories are added to the library."""
+    return os.getenv("STORY_LIBRARY", "true").lower() == "true"
+
+
+def library_api_enabled() -> bool:
+    """Whether the server answers library searches. The library holds every tenant's stories."""
+    return os.getenv("STORY_LIBRARY_API", "false").lower() == "true"
+
+
+def match_query(text: str) -> str:
+    """
+    Turn search words into an FTS5 query.
+
+    Every word is quoted, so FTS5 operators in the text are searched for as
+    words, and every word has to match. A trailing "*" is kept as a prefix
+    match.
+    """
+    return " ".join(f'"{word.rstrip("*")}"' + ("*" if word.endswith("*") else "")
+                    for word in re.findall(r"\w+\*?", text))
+
+
+def _row(thread_id: str, story: Dict[str, Any]) -> Tuple[Any, ...]:
+    genre = str(story.get("genre") or "")
+    return (thread_id, str(story.get("title") or ""), genre, genre.strip().lower(),
+            str(story.get("summary") or ""), str(story.get("story") or ""), time.time())
+
+
+class StoryLibrary:
+    """
+    The finalized stories, one per thread, and their full-text index.
+
+    Args:
+        path: The SQLite database file, ":memory:" to keep the library in this process
+        rank_window: Most recent matches of a query that are ranked
+    """
+
+    def __init__(self, path: str = ":memory:", rank_window: int = 2000) -> None:
+        self.path = path
+        self.rank_window = max(rank_window, 1)
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA busy_timeout=5000")
+        if path != ":memory:":
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self.conn.execute("INSERT INTO library_fts (library_fts, rank) VALUES ('rank', ?)", (_RANK,))
+
+    def close(self) -> None:
+        """Close the SQLite connection."""
+        with self.lock:
+            self.conn.close()
+
+    def add(self, thread_id: str, story: Dict[str, Any]) -> None:
+        """Store a thread's finalized StoryContent, replacing its previous story."""
+        with self.lock:
+            self.conn.execute(_UPSERT, _row(thread_id, story))
+            _stats["indexed"] += 1
+
+    def add_many(self, stories: Iterable[Tuple[str, Dict[str, Any]]], batch_size: int = 1000) -> int:
+        """
+        Store many (thread_id, StoryContent) pairs, batch_size to a transaction.
+
+        Returns:
+            The number of stories stored
+        """
+        count = 0
+        rows: List[Tuple[Any, ...]] = []
+
+        def write() -> None:
+            with self.lock:
+                self.conn.execute("BEGIN")
+                self.conn.executemany(_UPSERT, rows)
+                self.conn.execute("COMMIT")
+            rows.clear()
+
+        for thread_id, story in stories:
+            rows.append(_row(thread_id, story))
+            count += 1
+            if len(rows) >= batch_size:
+                write()
+        if rows:
+            write()
+        _stats["indexed"] += count
+        return count
+
+    def get(self, thread_id: str) -> Optional[Dict[str, Any]]:
+        """Return a thread's story in the library, or None."""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT title, genre, summary, story, updated FROM library WHERE thread_id = ?", (thread_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        title, genre, summary, story, updated = row
+        return {"thread_id": thread_id, "title": title, "genre": genre, "summary": summary, "story": story,
+                "updated": updated}
+
+    def search(self, query: str = "", genres: Sequence[str] = (), limit: int = 20,
+               offset: int = 0) -> Dict[str, Any]:
+        """
+        Find stories by their words.
+
+        Args:
+            query: Words that must all match, best matches first; empty lists
+                the stories most recently added to the library
+            genres: Keep only stories of these genres, compared case-insensitively
+            limit: Results on the page
+            offset: Results skipped before the page
+
+        Returns:
+            {"results": [...], "has_more": bool}, each result with the
+            thread_id, title, genre, summary, a snippet of the matching text
+            and the BM25 score, higher is better
+        """
+        started = time.perf_counter()
+        match = match_query(query)
+        keys = sorted({genre.strip().lower() for genre in genres if genre.strip()})
+        params: List[Any] = []
+        if match:
+            # Scoring every match of a word that is in most stories would take
+            # seconds, rank the newest rank_window matches instead
+            with self.lock:
+                bound = self.conn.execute(
+                    "SELECT rowid FROM library_fts WHERE library_fts MATCH ? ORDER BY rowid DESC LIMIT 1 OFFSET ?",
+                    (match, self.rank_window - 1),
+                ).fetchone()
+            sql = (
+                "SELECT library.thread_id, library.title, library.genre, library.summary, "
+                "snippet(library_fts, 3, '[', ']', '…', 16), -library_fts.rank "
+                "FROM library_fts JOIN library ON library.id = library_fts.rowid "
+                "WHERE library_fts MATCH ?"
+            )
+            params.append(match)
+            if bound is not None:
+                sql += " AND library_fts.rowid >= ?"
+                params.append(bound[0])
+            order = " ORDER BY library_fts.rank"
+        else:
+            sql = "SELECT thread_id, title, genre, summary, substr(story, 1, 200), 0.0 FROM library WHERE 1 = 1"
+            order = " ORDER BY id DESC"
+        if keys:
+            sql += f" AND library.genre_key IN ({', '.join('?' * len(keys))})"
+            params.extend(keys)
+        # One more than the page tells whether there is a next page
+        sql += order + " LIMIT ? OFFSET ?"
+        params.extend((limit + 1, offset))
+        with self.lock:
+            rows = self.conn.execute(sql, params).fetchall()
+        _stats["searches"] += 1
+        observe("story_library_search_seconds", time.perf_counter() - started)
+        return {
+            "results": [
+                {"thread_id": thread_id, "title": title, "genre": genre, "summary": summary,
+                 "snippet": snippet, "score": round(score, 4)}
+                for thread_id, title, genre, summary, snippet, score in rows[:limit]
+            ],
+            "has_more": len(rows) > limit,
+        }
+
+    def count(self) -> int:
+        """Return the number of stories in the library."""
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM library").fetchone()[0]
+
+    def optimize(self) -> None:
+        """Merge the index segments, worth doing after a large backfill."""
+        with self.lock:
+            self.conn.execute("INSERT INTO library_fts (library_fts) VALUES ('optimize')")
+
+
+_library: Optional[StoryLibrary] = None
+_library_lock = threading.Lock()
+
+
+def get_library() -> StoryLibrary:
+    """Return the process-wide story library, creating it on first use."""
+    global _library  # pylint: disable=global-statement
+    with _library_lock:
+        if _library is None:
+            _library = StoryLibrary(
+                os.getenv("STORY_LIBRARY_PATH", "library.sqlite"),
+                rank_window=int(os.getenv("STORY_LIBRARY_RANK_WINDOW", "2000")),
+            )
+        return _library
+
+
+async def run_library(method: Any, *args: Any, **kwargs: Any) -> Any:
+    """Call a StoryLibrary method, off the event loop when the library is on disk."""
+    if get_library().path == ":memory:":
+        return method(*args, **kwargs)
+    return await asyncio.to_thread(method, *args, **kwargs)
+
+
+async def finalize_story(config: Dict[str, Any], story: Optional[Dict[str, Any]]) -> None:
+    """Add the story a node's thread has just finalized to the library."""
+    thread_id = (config.get("configurable") or {}).get("thread_id")
+    if not library_enabled() or thread_id is None or not story:
+        return
+    await run_library(get_library().add, str(thread_id), story)
+
+
+def _thread_ids(checkpointer: BaseCheckpointSaver) -> Iterator[str]:
+    thread_ids = getattr(checkpointer, "thread_ids", None)
+    if thread_ids is not None:
+        yield from thread_ids()
+        return
+    storage = getattr(checkpointer, "storage", None)
+    if isinstance(storage, dict):
+        yield from list(storage)
+        return
+    seen = set()
+    for item in checkpointer.list(None):
+        thread_id = item.config["configurable"]["thread_id"]
+        if thread_id not in seen:
+            seen.add(thread_id)
+            yield thread_id
+
+
+def finalized_stories(checkpointer: BaseCheckpointSaver) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """
+    Yield the finalized story of every thread in a checkpointer.
+
+    A thread waiting for the confirmation of an edit yields the story the
+    edit started from, and one waiting for the confirmation of its first
+    story yields nothing.
+    """
+    for thread_id in _thread_ids(checkpointer):
+        latest = next(iter(checkpointer.list({"configurable": {"thread_id": thread_id, "checkpoint_ns": ""}},
+                                             limit=1)), None)
+        if latest is None:
+            continue
+        values = latest.checkpoint["channel_values"]
+        story = values.get("story_content")
+        if values.get("pending_confirmation"):
+            story = values.get("previous_story_content") if values.get("is_edit") else None
+        if isinstance(story, dict) and story.get("story"):
+            yield thread_id, story
+
+
+def backfill(checkpointer: BaseCheckpointSaver, library: Optional[StoryLibrary] = None) -> int:
+    """
+    Index the finalized stories of every thread in a checkpointer.
+
+    Returns:
+        The number of stories indexed
+    """
+    library = library or get_library()
+    count = library.add_many(finalized_stories(checkpointer))
+    library.optimize()
+    _stats["backfilled"] += count
+    return count
+
+
+def library_stats() -> Dict[str, int]:
+    """Return counters of stories indexed and searches."""
+    return dict(_stats)
+
+
+register_collector("story_library", library_stats)
+
+
+def main():
+    """Backfill or search the story library from the command line."""
+    from dotenv import load_dotenv  # pylint: disable=import-outside-toplevel
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Backfill or search the story library.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("backfill", help="index the stories of the checkpoint database")
+    search = commands.add_parser("search", help="print the stories matching a query as JSON lines")
+    search.add_argument("query", nargs="?", default="")
+    search.add_argument("--genre", action="append", default=[])
+    search.add_argument("--limit", type=int, default=20)
+    search.add_argument("--offset", type=int, default=0)
+    args = parser.parse_args()
+
+    library = get_library()
+    if args.command == "backfill":
+        from translate_agent.checkpoint import make_checkpointer  # pylint: disable=import-outside-toplevel
+        checkpointer = make_checkpointer()
+        started = time.perf_counter()
+        count = backfill(checkpointer, library)
+        print(f"indexed {count} stories in {time.perf_counter() - started:.1f}s, {library.count()} in the library")
+        close = getattr(checkpointer, "close", None)
+        if close is not None:
+            close()
+        return
+    page = library.search(args.query, args.genre, args.limit, args.offset)
+    for result in page["results"]:
+        print(json.dumps(result, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+"""
+Long-form story generation with parallel chapters.
+
+A single tool call that emits the whole story is slow for long stories and
+runs into output token limits. In long-form mode the outline node plans the
+story, the chapter nodes write each chapter concurrently through a LangGraph
+fan-out, and the assemble node joins them into one StoryContent. Wall-clock
+time is close to the slowest chapter rather than the sum of all of them.
+
+A chapter whose model call fails, or is turned away by admission control,
+doesn't fail the others: the assemble node joins the chapters that were
+written and names the missing ones in its message.
+
+Configured through environment variables:
+
+    STORY_LONG_FORM            use long-form mode for new stories (default: false),
+                               the long_form state key overrides it per thread
+    STORY_MAX_CHAPTERS         most chapters an outline may plan (default: 10)
+    STORY_CHAPTER_CONCURRENCY  chapters written at once in this process (default: 10)
+"""
+
+import asyncio
+import os
+from typing import Any, Dict, List, Optional, TypedDict
+
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+from langchain_core.runnables import RunnableConfig
+from langgraph.graph import END
+from langgraph.types import Send
+
+from translate_agent.admission import QueueFullError
+from translate_agent.models import configured_model
+from translate_agent.versions import record_version
+
+
+class ChapterPlan(TypedDict):
+    """
+    The plan for one chapter.
+
+    Args:
+        title: The chapter title
+        synopsis: What happens in the chapter, in two or three sentences
+    """
+    title: str
+    synopsis: str
+
+
+class StoryOutline(TypedDict):
+    """
+    The outline of a long story.
+
+    Args:
+        title: The story title
+        genre: The story genre
+        summary: A short summary of the whole story
+        chapters: The chapters in reading order
+    """
+    title: str
+    genre: str
+    summary: str
+    chapters: List[ChapterPlan]
+
+
+def merge_chapters(current: Optional[List[Dict[str, Any]]],
+                   update: Optional[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """Reducer for the chapters state key. An update of None starts a new story."""
+    if update is None:
+        return []
+    return (current or []) + update
+
+
+def is_long_form(state: Dict[str, Any]) -> bool:
+    """Whether new stories for this thread are written chapter by chapter."""
+    if state.get("long_form") is not None:
+        return bool(state["long_form"])
+    return os.getenv("STORY_LONG_FORM", "false").lower() == "true"
+
+
+def story_prompt(state: Dict[str, Any]) -> str:
+    """Extract the story prompt from the input or the last message."""
+    prompt = state.get("input", "")
+    if not prompt and state["messages"]:
+        last_message = state["messages"][-1]
+        if isinstance(last_message, HumanMessage):
+            prompt = last_message.content
+    return prompt
+
+
+_semaphores: Dict[asyncio.AbstractEventLoop, asyncio.Semaphore] = {}
+
+
+def _chapter_semaphore() -> asyncio.Semaphore:
+    """Return the semaphore that limits chapter calls on the running loop."""
+    loop = asyncio.get_running_loop()
+    semaphore = _semaphores.get(loop)
+    if semaphore is None:
+        for other in [other for other in _semaphores if other.is_closed()]:
+            del _semaphores[other]
+        semaphore = _semaphores[loop] = asyncio.Semaphore(int(os.getenv("STORY_CHAPTER_CONCURRENCY", "10")))
+    return semaphore
+
+
+async def outline_node(state: Dict[str, Any], config: RunnableConfig):
+    """Plan the title, genre, summary and chapters of a long story."""
+    from copilotkit.langgraph import copilotkit_customize_config  # pylint: disable=import-outside-toplevel
+    config = copilotkit_customize_config(config, emit_messages=False, emit_tool_calls=False)
+    max_chapters = int(os.getenv("STORY_MAX_CHAPTERS", "10"))
+    model = configured_model(
+        config,
+        "gpt-4o",
+        [StoryOutline],
+        tool_choice="StoryOutline"  # Always generate an outline
+    )
+
+    response = await model.ainvoke([
+        SystemMessage(
+            content=f"""
+            You are a creative storyteller that plans long, engaging stories based on user prompts or descriptions.
+            Plan a story with a clear narrative structure split into at most {max_chapters} chapters.
+            Give each chapter a title and a short synopsis that continues from the previous chapter.
+            Use the provided prompt to plan the story: "{story_prompt(state)}"
+            """
+        ),
+    ], config)
+
+    outline = response.tool_calls[0]["args"] if getattr(response, "tool_calls", None) else None
+    if not outline or not outline.get("chapters"):
+        return {
+            "messages": [AIMessage(content="I couldn't plan that story. Could you describe it differently?")],
+            "story_outline": {},
+            "chapters": None,
+        }
+    outline["chapters"] = outline["chapters"][:max_chapters]
+    return {
+        "story_outline": outline,
+        "chapters": None,  # Start from an empty chapter list
+    }
+
+
+def dispatch_chapters(state: Dict[str, Any]):
+    """Fan out one chapter_node task per planned chapter."""
+    outline = state.get("story_outline") or {}
+    if not outline.get("chapters"):
+        return END
+    return [
+        Send("chapter_node", {"outline": outline, "index": index})
+        for index in range(len(outline["chapters"]))
+    ]
+
+
+async def chapter_node(task: Dict[str, Any], config: RunnableConfig):
+    """Write one chapter of the outline."""
+    from copilotkit.langgraph import copilotkit_customize_config  # pylint: disable=import-outside-toplevel
+    config = copilotkit_customize_config(config, emit_messages=False, emit_tool_calls=False)
+    outline = task["outline"]
+    index = task["index"]
+    plan = outline["chapters"][index]
+    # The outline may plan a chapter without a title or synopsis, only a missing synopsis fails the chapter
+    title = plan.get("title") or f"Chapter {index + 1}"
+
+    try:
+        chapter_list = "\n".join(
+            f"{number + 1}. {chapter.get('title', '')}: {chapter.get('synopsis', '')}"
+            for number, chapter in enumerate(outline["chapters"])
+        )
+        async with _chapter_semaphore():
+            response = await configured_model(config, "gpt-4o").ainvoke([
+                SystemMessage(
+                    content=f"""
+                    You are a creative storyteller writing one chapter of a longer story.
+                    Write vivid, engaging prose with a consistent voice across chapters.
+                    Only write the chapter text, without the chapter title.
+
+                    Title: {outline['title']}
+                    Genre: {outline['genre']}
+                    Summary: {outline['summary']}
+                    Chapters:
+                    {chapter_list}
+
+                    Write chapter {index + 1}, "{title}": {plan['synopsis']}
+                    """
+                ),
+            ], config)
+    except QueueFullError:
+        return {"chapters": [{"index": index, "title": title, "text": "", "error": "busy"}]}
+    except Exception as error:  # pylint: disable=broad-except
+        # The other chapters go on, assemble_node reports the missing one
+        return {"chapters": [{"index": index, "title": title, "text": "", "error": str(error) or type(error).__name__}]}
+
+    return {"chapters": [{"index": index, "title": title, "text": str(response.content).strip()}]}
+
+
+async def assemble_node(state: Dict[str, Any], config: RunnableConfig):
+    """Join the chapters that were written into one story and ask for confirmation."""
+    outline = state["story_outline"]
+    chapters = sorted(state.get("chapters") or [], key=lambda chapter: chapter["index"])
+    missing = [chapter for chapter in chapters if chapter.get("error")]
+    chapters = [chapter for chapter in chapters if not chapter.get("error")]
+    if not chapters:
+        busy = all(chapter["error"] == "busy" for chapter in missing)
+        return {
+            "messages": [AIMessage(content="Too many stories are being written right now. Please try again in a moment."
+                                   if busy else "I couldn't write that story. Please try again.")],
+            "pending_confirmation": False,
+            "story_outline": {},
+            "chapters": None,
+        }
+    story_content = {
+        "title": outline["title"],
+        "genre": outline["genre"],
+        "summary": outline["summary"],
+        "story": "\n\n".join(f"{chapter['title']}\n\n{chapter['text']}" for chapter in chapters),
+    }
+    story_version = await record_version(config, story_content, label=story_prompt(state))
+    message = "Please confirm if you'd like to keep it."
+    if missing:
+        names = ", ".join(f'{chapter["index"] + 1} ("{chapter["title"]}")' for chapter in missing)
+        message = (f"I couldn't write chapter{'s' if len(missing) > 1 else ''} {names}, so the story "
+                   f"leaves {'them' if len(missing) > 1 else 'it'} out. {message}")
+    return {
+        "messages": [AIMessage(content=message)],
+        "story_content": story_content,
+        "previous_story_content": story_content,  # Initialize the previous version to be the same as the current
+        "pending_confirmation": True,  # Set flag to indicate we're waiting for confirmation
+        "is_edit": False,  # This is not an edit operation
+        "diff_ops": [],  # No diff for new stories
+        "diff_markup": "",  # No diff markup for new stories
+        "story_outline": {},
+        "chapters": None,  # Drop the chapters now that they are part of the story
+        "story_version": story_version,
+    }
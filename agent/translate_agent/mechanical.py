@@ -0,0 +1,223 @@
+"""
+Mechanical story edits applied without the model.
+
+Requests such as "rename Mira to Lena", "change the title to The Long Night",
+"set the genre to mystery" or "replace 'forest' with 'desert'" don't need a
+rewrite. The edit branch tries mechanical_edit() first. A request that matches one
+of the patterns whole, and whose edit applies cleanly, is applied here in
+microseconds. It then goes through the same diff and confirmation as a model
+edit. Anything else, including a pattern with more asked of it ("rename Mira
+to Lena and make her older") or a title or genre that is described rather
+than given ("change the title to something more exciting"), goes to the model.
+
+Configured through environment variables:
+
+    STORY_MECHANICAL_EDITS  apply mechanical edits without the model (default: true)
+"""
+
+import os
+import re
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from translate_agent.metrics import register_collector
+
+# A character name: one to three capitalized words
+_NAME = r"(?P<{}>[A-Z][\w'’-]*(?: [A-Z][\w'’-]*){{0,2}})"
+# A quoted phrase, or a single word
+_TERM = r"""(?:["'“‘](?P<{0}_quoted>[^"'”’]{{1,80}})["'”’]|(?P<{0}_word>[\w'’-]+))"""
+_QUOTED_OR_REST = r"""(?:["'“‘](?P<{0}_quoted>[^"'”’]{{1,200}})["'”’]|(?P<{0}_rest>[^"'“‘].{{0,199}}?))"""
+_END = r"\s*[.!?]?\s*(?i:please\s*[.!]?)?\s*$"
+# Words that describe the title or genre wanted instead of giving it
+_DESCRIPTIVE = {"something", "anything", "more", "less", "different", "other", "better", "a", "an", "the"}
+# Words that may be lowercase inside a title
+_MINOR = {"a", "an", "the", "of", "in", "on", "at", "to", "for", "with", "by", "from", "or"}
+# Comparatives such as "darker" or "catchier", apart from genres that end the same way
+_COMPARATIVE = re.compile(r"^\w+er$")
+_ER_GENRES = {"thriller"}
+_PLEASE = r"^\s*(?i:please\s+|can you\s+|could you\s+)?"
+
+_PATTERNS = [
+    ("title", re.compile(
+        _PLEASE + r"(?:change|set|make|update) the (?:story'?s? )?title (?:to|:|as)\s*" + _QUOTED_OR_REST.format("title") + _END,
+        re.IGNORECASE)),
+    ("title", re.compile(
+        _PLEASE + r"(?:rename|retitle|call) (?:the story|it) (?:to |as )?" + _QUOTED_OR_REST.format("title") + _END,
+        re.IGNORECASE)),
+    ("genre", re.compile(
+        _PLEASE + r"(?:change|set|make|update|switch) the genre (?:to|:)\s*" + _QUOTED_OR_REST.format("genre") + _END,
+        re.IGNORECASE)),
+    ("rename", re.compile(
+        _PLEASE + r"(?i:rename|change the name of|change) " + _NAME.format("old") + r"(?:'s name)? (?i:to|as|into) " + _NAME.format("new") + _END)),
+    ("replace", re.compile(
+        _PLEASE + r"(?:replace|swap) (?:all |every )?(?:occurrences of |instances of )?" + _TERM.format("old")
+        + r" (?:with|for|by) " + _TERM.format("new") + r"(?: everywhere| throughout(?: the story)?)?" + _END,
+        re.IGNORECASE)),
+    ("replace", re.compile(
+        _PLEASE + r"change (?:all |every )" + _TERM.format("old") + r" to " + _TERM.format("new")
+        + r"(?: everywhere| throughout(?: the story)?)?" + _END,
+        re.IGNORECASE)),
+]
+
+_stats: Dict[str, int] = {
+    "requests": 0,
+    "applied": 0,
+    "unmatched": 0,
+    "rejected": 0,
+}
+
+
+def mechanical_enabled() -> bool:
+    """Whether mechanical edits skip the model."""
+    return os.getenv("STORY_MECHANICAL_EDITS", "true").lower() == "true"
+
+
+def _group(match: "re.Match[str]", name: str) -> str:
+    for suffix in ("", "_quoted", "_word", "_rest"):
+        value = match.groupdict().get(name + suffix)
+        if value:
+            return value.strip()
+    return ""
+
+
+def _literal(kind: str, value: str) -> bool:
+    """
+    Whether an unquoted title or genre is the value itself, not a description of it.
+
+    A title is capitalized, apart from its minor words, and has no
+    descriptive words; a genre is one to three words, none of them
+    descriptive or comparative.
+    """
+    words = value.split()
+    if kind == "title":
+        return bool(words) and words[0][:1].isupper() and not any(
+            word.lower() in _DESCRIPTIVE - _MINOR for word in words) and all(
+            word[:1].isupper() or not word[:1].isalpha() or word.lower() in _MINOR for word in words[1:])
+    return 0 < len(words) <= 3 and not any(
+        word.lower() in _DESCRIPTIVE or (_COMPARATIVE.match(word.lower()) and word.lower() not in _ER_GENRES)
+        for word in words)
+
+
+def parse_edit(request: str) -> Optional[Tuple[str, str, str]]:
+    """
+    Classify an edit request.
+
+    Args:
+        request: The user's edit request
+
+    Returns:
+        (kind, old, new) where kind is "title", "genre", "rename" or
+        "replace", and old is empty for title and genre changes, or None
+        when the request isn't a mechanical edit
+    """
+    for kind, pattern in _PATTERNS:
+        match = pattern.match(request)
+        if match is None:
+            continue
+        if kind in ("title", "genre"):
+            new = _group(match, kind).rstrip(".!?")
+            rest = match.group(f"{kind}_rest")
+            if rest is not None and (not _literal(kind, new) or re.search(r"\b(?:and|then|also)\b", rest)):
+                # An unquoted value that describes what is wanted, or goes on to ask for more
+                return None
+            return (kind, "", new) if new else None
+        old, new = _group(match, "old"), _group(match, "new")
+        if old and new and old != new:
+            return kind, old, new
+    return None
+
+
+def _matched_case(replacement: str) -> Callable[["re.Match[str]"], str]:
+    def replace(match: "re.Match[str]") -> str:
+        found = match.group(0)
+        if found.isupper() and len(found) > 1:
+            return replacement.upper()
+        if found[:1].isupper():
+            return replacement[:1].upper() + replacement[1:]
+        return replacement
+    return replace
+
+
+def _replace(text: str, old: str, new: str) -> Tuple[str, int]:
+    """
+    Replace whole-word occurrences of old in any case, keeping the case of each.
+
+    A term with capitals after its first letter, such as "US" or "McKay", is
+    only matched as written and replaced by new as written, so replacing
+    "US" leaves "us" alone.
+    """
+    start = r"\b" if re.match(r"\w", old) else ""
+    end = r"\b" if re.search(r"\w$", old) else ""
+    pattern = start + re.escape(old) + end
+    if any(char.isupper() for char in old[1:]):
+        return re.subn(pattern, lambda _: new, text)
+    return re.subn(pattern, _matched_case(new), text, flags=re.IGNORECASE)
+
+
+def apply_edit(story: Dict[str, Any], kind: str, old: str, new: str) -> Optional[Tuple[Dict[str, Any], str]]:
+    """
+    Apply a mechanical edit to a story.
+
+    Args:
+        story: The current StoryContent
+        kind: "title", "genre", "rename" or "replace", from parse_edit()
+        old: The name or text to replace
+        new: The new title, genre, name or text
+
+    Returns:
+        The edited story and a description of the change, or None when the
+        edit doesn't apply cleanly: the name or text isn't in the story, or
+        the new name already belongs to someone in it
+    """
+    if kind in ("title", "genre"):
+        if story.get(kind) == new:
+            return None
+        return {**story, kind: new}, f"changed the {kind} to '{new}'"
+
+    if kind == "rename":
+        # Renaming to a name that is already used would merge two characters
+        if new in story["story"] and re.search(rf"\b{re.escape(new)}\b", story["story"]):
+            return None
+        # Shouted names too, such as "MIRA!"
+        name = re.compile(rf"\b(?:{re.escape(old)}|{re.escape(old.upper())})\b")
+        renamed = {old: new, old.upper(): new.upper()}
+        fields = {field: name.subn(lambda match: renamed[match.group(0)], story[field]) for field in ("title", "summary", "story")}
+        what = f"renamed {old} to {new}"
+    else:
+        fields = {field: _replace(story[field], old, new) for field in ("title", "summary", "story")}
+        what = f"replaced '{old}' with '{new}'"
+
+    count = sum(found for _, found in fields.values())
+    if not count:
+        return None
+    updated = {**story, **{field: text for field, (text, _) in fields.items()}}
+    return updated, f"{what} ({count} {'change' if count == 1 else 'changes'})"
+
+
+def mechanical_edit(story: Dict[str, Any], request: str) -> Optional[Tuple[Dict[str, Any], str]]:
+    """
+    Apply an edit request without the model, when it is a mechanical edit.
+
+    Args:
+        story: The current StoryContent
+        request: The user's edit request
+
+    Returns:
+        The edited story and a description of the change, or None when
+        the request should go to the model
+    """
+    _stats["requests"] += 1
+    parsed = parse_edit(request)
+    if parsed is None:
+        _stats["unmatched"] += 1
+        return None
+    result = apply_edit(story, *parsed)
+    _stats["applied" if result is not None else "rejected"] += 1
+    return result
+
+
+def mechanical_stats() -> Dict[str, int]:
+    """Return counters of requests applied without the model, and of the ones sent to it."""
+    return dict(_stats)
+
+
+register_collector("story_mechanical_edits", mechanical_stats)
@@ -0,0 +1,267 @@
+"""
+Metrics and structured logs for the story graph.
+
+Node and branch timings, model latency and token counts, diff time and the
+size of emitted state and checkpoints are kept in process as Prometheus-style
+counters and histograms. render_prometheus() writes them in the Prometheus
+text format, together with the counters of the model registry, worker pool,
+response cache and the other modules that register a collector. The demo
+app serves it at /metrics.
+
+Events are logged as one JSON object per line through the "translate_agent"
+logger at INFO level.
+
+Configured through environment variables:
+
+    STORY_METRICS  record metrics (default: true)
+    STORY_LOG      "json" to log events, "off" to skip them entirely (default: json)
+"""
+
+import functools
+import inspect
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+from langgraph.errors import GraphBubbleUp
+
+logger = logging.getLogger("translate_agent")
+
+_SECONDS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+_BYTES = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+# name: (type, help, histogram buckets)
+_METRICS: Dict[str, Tuple[str, str, Sequence[float]]] = {
+    "story_node_seconds": ("histogram", "Time spent in each graph node", _SECONDS),
+    "story_node_errors_total": ("counter", "Graph node runs that raised an error", ()),
+    "story_branch_seconds": ("histogram", "Time spent in each branch of the story nodes", _SECONDS),
+    "story_llm_first_token_seconds": ("histogram", "Time to the first streamed token of a model call", _SECONDS),
+    "story_llm_seconds": ("histogram", "Total time of a model call", _SECONDS),
+    "story_llm_tokens_total": ("counter", "Prompt, cached prompt and completion tokens of model calls", ()),
+    "story_diff_seconds": ("histogram", "Time to diff an edited story", _SECONDS),
+    "story_emitted_state_bytes": ("histogram", "Size of the state emitted to the UI while streaming", _BYTES),
+    "story_checkpoint_bytes": ("histogram", "Size of each serialized checkpoint", _BYTES),
+    "story_routing_wins_total": ("counter", "Model calls answered by the primary or the hedge request", ()),
+    "story_routing_circuit_opened_total": ("counter", "Times a provider's circuit breaker opened", ()),
+    "story_admission_wait_seconds": ("histogram", "Time a model call waited for admission", _SECONDS),
+    "story_admission_rejected_total": ("counter", "Model calls rejected because the admission queue was full", ()),
+    "story_library_search_seconds": ("histogram", "Time to search the story library", _SECONDS),
+}
+
+_Labels = Tuple[Tuple[str, str], ...]
+
+_lock = threading.Lock()
+_counters: Dict[Tuple[str, _Labels], float] = {}
+# (name, labels): [bucket counts..., sum, count]
+_histograms: Dict[Tuple[str, _Labels], List[float]] = {}
+_collectors: Dict[str, Callable[[], Dict[str, Any]]] = {}
+
+
+def metrics_enabled() -> bool:
+    """Whether metrics are recorded."""
+    return os.getenv("STORY_METRICS", "true").lower() == "true"
+
+
+def increment(name: str, value: float = 1, **labels: str) -> None:
+    """Add value to a counter."""
+    if not metrics_enabled():
+        return
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name: str, value: float, **labels: str) -> None:
+    """Record one observation in a histogram."""
+    if not metrics_enabled():
+        return
+    buckets = _METRICS[name][2]
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        series = _histograms.get(key)
+        if series is None:
+            series = _histograms[key] = [0.0] * (len(buckets) + 2)
+        for index, bound in enumerate(buckets):
+            if value <= bound:
+                series[index] += 1
+        series[-2] += value
+        series[-1] += 1
+
+
+def register_collector(prefix: str, collect: Callable[[], Dict[str, Any]]) -> None:
+    """Export the numeric values of collect() as gauges named prefix_key."""
+    _collectors[prefix] = collect
+
+
+def log_event(event: str, **fields: Any) -> None:
+    """Log an event as a JSON line, unless logging is off."""
+    if os.getenv("STORY_LOG", "json").lower() == "off" or not logger.isEnabledFor(logging.INFO):
+        return
+    logger.info(json.dumps({"event": event, **fields}, default=str))
+
+
+@contextmanager
+def span(name: str, **labels: str) -> Iterator[Dict[str, str]]:
+    """
+    Time a block into the histogram name and log it.
+
+    Yields the labels, so the block can fill in labels it only knows at the
+    end. Interrupts and errors are not timed.
+    """
+    started = time.perf_counter()
+    yield labels
+    record(name, started, **labels)
+
+
+def record(name: str, started: float, **labels: str) -> None:
+    """Record the time since started, a time.perf_counter() value, into the histogram name and log it."""
+    seconds = time.perf_counter() - started
+    observe(name, seconds, **labels)
+    log_event(name, seconds=round(seconds, 6), **labels)
+
+
+def instrument_node(name: str, node: Callable) -> Callable:
+    """Wrap a graph node so each run is timed as story_node_seconds{node=name}."""
+
+    def failed(exc: BaseException) -> None:
+        if not isinstance(exc, GraphBubbleUp):
+            increment("story_node_errors_total", node=name)
+            log_event("node_error", node=name, error=repr(exc))
+
+    if inspect.iscoroutinefunction(node):
+        @functools.wraps(node)
+        async def async_wrapper(*args: Any, **kwargs: Any) -> Any:
+            try:
+                with span("story_node_seconds", node=name):
+                    return await node(*args, **kwargs)
+            except BaseException as exc:
+                failed(exc)
+                raise
+        return async_wrapper
+
+    @functools.wraps(node)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        try:
+            with span("story_node_seconds", node=name):
+                return node(*args, **kwargs)
+        except BaseException as exc:
+            failed(exc)
+            raise
+    return wrapper
+
+
+class LLMMetrics(BaseCallbackHandler):
+    """Callback handler that records model latency, time to first token and token counts."""
+
+    run_inline = True
+
+    def __init__(self):
+        self.runs: Dict[UUID, List[Any]] = {}
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: Any, *, run_id: UUID,
+                            metadata: Optional[Dict[str, Any]] = None, **kwargs: Any) -> None:
+        model = (metadata or {}).get("ls_model_name") or (serialized or {}).get("name", "")
+        self.runs[run_id] = [time.perf_counter(), None, model]
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any) -> None:
+        run = self.runs.get(run_id)
+        if run is not None and run[1] is None:
+            run[1] = time.perf_counter()
+            observe("story_llm_first_token_seconds", run[1] - run[0], model=run[2])
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> None:
+        run = self.runs.pop(run_id, None)
+        if run is None:
+            return
+        seconds = time.perf_counter() - run[0]
+        observe("story_llm_seconds", seconds, model=run[2])
+        usage: Dict[str, Any] = {}
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None) or usage
+        cached = (usage.get("input_token_details") or {}).get("cache_read") or 0
+        if usage:
+            increment("story_llm_tokens_total", usage.get("input_tokens", 0), model=run[2], kind="prompt")
+            increment("story_llm_tokens_total", usage.get("output_tokens", 0), model=run[2], kind="completion")
+            increment("story_llm_tokens_total", cached, model=run[2], kind="cached_prompt")
+            _prompt_cache["calls"] += 1
+            _prompt_cache["prompt_tokens"] += usage.get("input_tokens", 0)
+            _prompt_cache["cached_tokens"] += cached
+        log_event(
+            "llm_call",
+            model=run[2],
+            seconds=round(seconds, 6),
+            first_token_seconds=round(run[1] - run[0], 6) if run[1] else None,
+            prompt_tokens=usage.get("input_tokens"),
+            completion_tokens=usage.get("output_tokens"),
+            cached_prompt_tokens=cached,
+        )
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self.runs.pop(run_id, None)
+
+
+llm_metrics = LLMMetrics()
+
+_prompt_cache: Dict[str, int] = {"calls": 0, "prompt_tokens": 0, "cached_tokens": 0}
+
+
+def prompt_cache_stats() -> Dict[str, float]:
+    """Return prompt tokens, the ones the provider served from its prefix cache, and their ratio."""
+    return {
+        **_prompt_cache,
+        "hit_ratio": _prompt_cache["cached_tokens"] / max(_prompt_cache["prompt_tokens"], 1),
+    }
+
+
+register_collector("story_prompt_cache", prompt_cache_stats)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: _Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    items = list(labels) + ([extra] if extra else [])
+    if not items:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(str(value))}"' for key, value in items) + "}"
+
+
+def render_prometheus() -> str:
+    """Render every metric and registered collector in the Prometheus text format."""
+    lines: List[str] = []
+    with _lock:
+        counters = dict(_counters)
+        histograms = {key: list(series) for key, series in _histograms.items()}
+
+    for name, (kind, help_text, buckets) in _METRICS.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        if kind == "counter":
+            for (series_name, labels), value in sorted(counters.items()):
+                if series_name == name:
+                    lines.append(f"{name}{_format_labels(labels)} {value:g}")
+            continue
+        for (series_name, labels), series in sorted(histograms.items()):
+            if series_name != name:
+                continue
+            for bound, count in zip(buckets, series):
+                lines.append(f"{name}_bucket{_format_labels(labels, ('le', f'{bound:g}'))} {count:g}")
+            lines.append(f"{name}_bucket{_format_labels(labels, ('le', '+Inf'))} {series[-1]:g}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {series[-2]:g}")
+            lines.append(f"{name}_count{_format_labels(labels)} {series[-1]:g}")
+
+    for prefix, collect in sorted(_collectors.items()):
+        for key, value in sorted(collect().items()):
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                lines.append(f"# TYPE {prefix}_{key} gauge")
+                lines.append(f"{prefix}_{key} {value:g}")
+    return "\n".join(lines) + "\n"
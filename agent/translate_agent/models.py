@@ -0,0 +1,198 @@
+"""
+Process-wide registry of chat models.
+
+Building a ChatOpenAI client and binding tools to it is not free, and a new
+client also means a new HTTP connection pool. Models are built once per
+(model, tools, tool_choice) key and share one keep-alive connection pool.
+Tools are keyed by the schema objects themselves, not their names, so two
+injected schemas that share a class name get models of their own.
+
+Configured through environment variables:
+
+    STORY_HTTP_MAX_CONNECTIONS   open connections allowed in the pool (default: 100)
+    STORY_HTTP_MAX_KEEPALIVE     idle connections kept alive (default: 20)
+    STORY_HTTP_KEEPALIVE_EXPIRY  seconds an idle connection is kept (default: 30)
+    STORY_HTTP_TIMEOUT           request timeout in seconds (default: 120)
+
+The shared HTTP client belongs to the event loop that first uses it. Call
+reset_models() before reusing the registry from another event loop.
+
+langchain_openai is only imported when the first model is built, it is the
+largest part of the agent's import time.
+
+Nodes get their model through configured_model(), so a graph built with
+another model factory (see agent.build_graph) uses it in every node.
+
+Registry models are wrapped in a routing.RoutedModel, which adds a deadline
+to each call and hedges slow calls to STORY_FALLBACK_MODEL when it is set.
+claude-* models are served by langchain_anthropic.
+"""
+
+import json
+import os
+import threading
+from typing import Any, Callable, Dict, Optional, Sequence, Tuple
+
+import httpx
+from langchain_core.language_models import BaseChatModel
+from langchain_core.runnables import Runnable, RunnableConfig
+
+from translate_agent.metrics import llm_metrics, register_collector
+from translate_agent.routing import RoutedModel, fallback_model, provider_name
+
+_ModelKey = Tuple[str, Tuple[Any, ...], Optional[str]]
+ModelFactory = Callable[[str, Sequence[Any], Optional[str]], Runnable]
+
+_lock = threading.Lock()
+_models: Dict[_ModelKey, Runnable] = {}
+_http_client: Optional[httpx.AsyncClient] = None
+_stats: Dict[str, int] = {
+    "model_hits": 0,
+    "model_misses": 0,
+    "http_requests": 0,
+    "http_connections_opened": 0,
+}
+
+
+class _CountingTransport(httpx.AsyncHTTPTransport):
+    """Transport that counts requests and the connections opened for them."""
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        _stats["http_requests"] += 1
+        request.extensions = {**request.extensions, "trace": _trace}
+        return await super().handle_async_request(request)
+
+
+async def _trace(event_name: str, _info: Dict[str, Any]) -> None:
+    """httpcore trace hook, called for each connection lifecycle event."""
+    if event_name == "connection.connect_tcp.complete":
+        _stats["http_connections_opened"] += 1
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Return the shared keep-alive HTTP client, creating it on first use."""
+    global _http_client  # pylint: disable=global-statement
+    with _lock:
+        if _http_client is None:
+            limits = httpx.Limits(
+                max_connections=int(os.getenv("STORY_HTTP_MAX_CONNECTIONS", "100")),
+                max_keepalive_connections=int(os.getenv("STORY_HTTP_MAX_KEEPALIVE", "20")),
+                keepalive_expiry=float(os.getenv("STORY_HTTP_KEEPALIVE_EXPIRY", "30")),
+            )
+            _http_client = httpx.AsyncClient(
+                transport=_CountingTransport(limits=limits),
+                limits=limits,
+                timeout=float(os.getenv("STORY_HTTP_TIMEOUT", "120")),
+            )
+        return _http_client
+
+
+def _build_chat_model(model: str, base_url: Optional[str] = None) -> BaseChatModel:
+    if model.startswith("claude"):
+        from langchain_anthropic import ChatAnthropic  # pylint: disable=import-outside-toplevel
+        options: Dict[str, Any] = {"anthropic_api_url": base_url} if base_url else {}
+        return ChatAnthropic(
+            model=model,
+            stream_usage=True,
+            callbacks=[llm_metrics],
+            **options,
+        )
+    from langchain_openai import ChatOpenAI  # pylint: disable=import-outside-toplevel
+    return ChatOpenAI(
+        model=model,
+        http_async_client=get_http_client(),
+        stream_usage=True,  # Token counts for streamed calls too
+        callbacks=[llm_metrics],
+        **({"base_url": base_url} if base_url else {}),
+    )
+
+
+def _bind(chat_model: BaseChatModel, tools: Sequence[Any], tool_choice: Optional[str]) -> Runnable:
+    if not tools:
+        return chat_model
+    if chat_model.__class__.__name__ == "ChatAnthropic":
+        # Anthropic has no parallel_tool_calls option, a forced tool call is a single call
+        return chat_model.bind_tools(list(tools), tool_choice=tool_choice)
+    return chat_model.bind_tools(list(tools), parallel_tool_calls=False, tool_choice=tool_choice)
+
+
+def _tool_key(tool: Any) -> Any:
+    """The registry key of a tool: the schema object, or its JSON when it isn't hashable."""
+    try:
+        hash(tool)
+    except TypeError:
+        return json.dumps(tool, sort_keys=True, default=str)
+    return tool
+
+
+def get_model(model: str = "gpt-4o", tools: Sequence[Any] = (),
+              tool_choice: Optional[str] = None) -> Runnable:
+    """
+    Return the shared chat model for this configuration.
+
+    Args:
+        model: The model name
+        tools: Tool schemas to bind, such as TypedDict classes
+        tool_choice: Name of the tool the model must call, if any
+
+    Returns:
+        A routed chat model, with the tools bound when any were given
+    """
+    key = (model, tuple(_tool_key(tool) for tool in tools), tool_choice)
+    with _lock:
+        bound = _models.get(key)
+        if bound is not None:
+            _stats["model_hits"] += 1
+            return bound
+        _stats["model_misses"] += 1
+
+    fallback, fallback_url = fallback_model()
+    bound = RoutedModel(
+        _bind(_build_chat_model(model), tools, tool_choice),
+        provider_name(model),
+        _bind(_build_chat_model(fallback, fallback_url), tools, tool_choice) if fallback else None,
+        provider_name(fallback, fallback_url) if fallback else None,
+        tool_choice=tool_choice,
+    )
+    with _lock:
+        return _models.setdefault(key, bound)
+
+
+def configured_model(config: Optional[RunnableConfig], model: str = "gpt-4o", tools: Sequence[Any] = (),
+                     tool_choice: Optional[str] = None) -> Runnable:
+    """
+    Return the model for a node, from the story_model factory of its config or the registry.
+
+    Args:
+        config: The node config
+        model: The model name
+        tools: Tool schemas to bind, such as TypedDict classes
+        tool_choice: Name of the tool the model must call, if any
+
+    Returns:
+        A chat model, with the tools bound when any were given
+    """
+    factory: ModelFactory = ((config or {}).get("configurable") or {}).get("story_model") or get_model
+    return factory(model, tools, tool_choice)
+
+
+def model_stats() -> Dict[str, int]:
+    """Return registry and connection pool counters."""
+    return {
+        **_stats,
+        "models": len(_models),
+        "http_connections_reused": _stats["http_requests"] - _stats["http_connections_opened"],
+    }
+
+
+register_collector("story_models", model_stats)
+
+
+async def reset_models() -> None:
+    """Drop the cached models and close the shared HTTP client."""
+    global _http_client  # pylint: disable=global-statement
+    with _lock:
+        client, _http_client = _http_client, None
+        _models.clear()
+    if client is not None:
+        await client.aclose()
@@ -0,0 +1,116 @@
+"""
+Paragraph-level patches for story edits.
+
+Instead of asking the model to write the whole story again, the edit branch
+shows it the story with numbered paragraphs and asks for the few operations
+needed. The operations are validated and applied here.
+"""
+
+import re
+from typing import Any, Dict, List, Literal, Optional, Tuple, TypedDict
+
+from translate_agent.diff import split_paragraphs
+
+# Models sometimes echo the paragraph marker back in the new text
+_MARKER_RE = re.compile(r'^\[\d+\]\s*')
+
+
+class PatchOperation(TypedDict):
+    """
+    One change to a paragraph of the story.
+
+    Args:
+        op: "replace" rewrites paragraph index, "insert_after" adds a new paragraph after it (-1 inserts at the start), "delete" removes it
+        index: The number of the paragraph the operation applies to
+        text: The new paragraph text, empty for "delete"
+    """
+    op: Literal["replace", "insert_after", "delete"]
+    index: int
+    text: str
+
+
+class StoryPatch(TypedDict):
+    """
+    Targeted changes to an existing story.
+
+    Args:
+        operations: Paragraph operations, all indices refer to the original numbering
+        title: The new title, empty to keep the current one
+        genre: The new genre, empty to keep the current one
+        summary: The new summary, empty to keep the current one
+    """
+    operations: List[PatchOperation]
+    title: str
+    genre: str
+    summary: str
+
+
+def paragraphs(story: str) -> List[Tuple[str, str]]:
+    """Split a story into (text, separator) pairs, one per paragraph."""
+    result = []
+    for start, end in split_paragraphs(story):
+        text = story[start:end].rstrip()
+        result.append((text, story[start + len(text):end]))
+    return result
+
+
+def number_paragraphs(story: str) -> str:
+    """Render a story with a [n] marker in front of each paragraph."""
+    return "\n\n".join(f"[{index}] {text}" for index, (text, _) in enumerate(paragraphs(story)))
+
+
+def apply_patch(story_content: Dict[str, Any], patch: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Apply a StoryPatch to a story.
+
+    Args:
+        story_content: The current StoryContent
+        patch: The StoryPatch arguments returned by the model
+
+    Returns:
+        The updated StoryContent, or None when the patch is invalid or empty
+        and the story should be regenerated instead
+    """
+    parts = paragraphs(story_content["story"])
+    operations = patch.get("operations") or []
+    if not isinstance(operations, list):
+        return None
+
+    replaced: Dict[int, str] = {}
+    deleted = set()
+    inserted: Dict[int, List[str]] = {}
+    for operation in operations:
+        if not isinstance(operation, dict):
+            return None
+        op, index = operation.get("op"), operation.get("index")
+        text = _MARKER_RE.sub("", operation.get("text") or "")
+        if not isinstance(index, int) or not -1 <= index < len(parts):
+            return None
+        if op == "replace" and index >= 0 and text.strip() and index not in replaced:
+            replaced[index] = text.strip()
+        elif op == "delete" and index >= 0:
+            deleted.add(index)
+        elif op == "insert_after" and text.strip():
+            inserted.setdefault(index, []).append(text.strip())
+        else:
+            return None
+    if deleted & replaced.keys():
+        return None
+
+    metadata = {key: patch.get(key) for key in ("title", "genre", "summary") if patch.get(key)}
+    if not (replaced or deleted or inserted or metadata):
+        return None
+
+    # Rebuild the story, reusing each paragraph's original separator
+    result: List[Tuple[str, str]] = [(text, "\n\n") for text in inserted.get(-1, [])]
+    for index, (text, separator) in enumerate(parts):
+        if index not in deleted:
+            result.append((replaced.get(index, text), separator or "\n\n"))
+        result.extend((text, "\n\n") for text in inserted.get(index, []))
+    if not result:
+        return None
+    story = "".join(text + separator for text, separator in result[:-1]) + result[-1][0]
+    if parts and parts[-1][1]:
+        story += parts[-1][1]
+
+    return {**story_content, **metadata, "story": story}
@@ -0,0 +1,104 @@
+"""
+Prompt layout for the story model calls.
+
+Providers reuse the work done for a prompt prefix they have seen recently
+(OpenAI caches prompts of 1024 tokens and more, in 128-token steps), which
+cuts the time to the first token and bills the cached tokens at a discount.
+A prefix only matches byte for byte. Each prompt is therefore built as
+separate messages, from the most stable part to the most volatile:
+
+1. the static instructions of the call, constants of this module;
+2. the story snapshot, serialized the same way every time, or for a new
+   story the rolling summary and the conversation, which only grows;
+3. the request.
+
+The user's request is never part of the instructions, so an edit shares the
+instructions and the story with the edits of the same story tried before it
+in the same mode, such as a cancelled edit, and a new story shares the
+instructions and the conversation with the turns before it.
+
+How much of the prompt was served from the cache is counted from the
+cache_read tokens the model reports, see metrics.prompt_cache_stats().
+Anthropic models only cache prompts marked with cache_control, which these
+prompts don't set.
+"""
+
+from typing import Any, Dict, List, Sequence
+
+from langchain_core.messages import AnyMessage, HumanMessage, SystemMessage
+
+from translate_agent.patch import number_paragraphs
+
+CREATE_INSTRUCTIONS = """You are a creative storyteller that creates engaging and imaginative stories based on user prompts or descriptions.
+Generate stories with clear narrative structure, engaging characters, and vivid descriptions.
+Always generate a complete story with a title, genre, summary, and the full story text.
+Use the user's latest message as the prompt for the story."""
+
+PATCH_INSTRUCTIONS = """You are a creative storyteller that edits stories based on user requests.
+You will be given an existing story with numbered paragraphs and an edit request.
+Make the requested changes while maintaining the overall narrative structure and quality.
+Only return operations for the paragraphs that need to change.
+Use the original paragraph numbers for every operation."""
+
+EDIT_INSTRUCTIONS = """You are a creative storyteller that edits stories based on user requests.
+You will be given an existing story and an edit request.
+Make the requested changes while maintaining the overall narrative structure and quality.
+Generate the updated story with the requested changes."""
+
+
+def story_snapshot(story: Dict[str, Any], numbered: bool = False) -> str:
+    """
+    Serialize a story the same way every time.
+
+    Args:
+        story: The StoryContent
+        numbered: Put a [n] marker in front of each paragraph, for patches
+
+    Returns:
+        The title, genre, summary and story text, one field after the other
+    """
+    text = number_paragraphs(story["story"]) if numbered else story["story"]
+    return f"Existing story:\nTitle: {story['title']}\nGenre: {story['genre']}\nSummary: {story['summary']}\nStory:\n{text}"
+
+
+def edit_request_message(request: str) -> HumanMessage:
+    """The edit request, the last and only volatile message of an edit prompt."""
+    return HumanMessage(content=f'Edit request: "{request}"')
+
+
+def patch_messages(story: Dict[str, Any], request: str) -> List[AnyMessage]:
+    """Prompt for a StoryPatch of story."""
+    return [
+        SystemMessage(content=PATCH_INSTRUCTIONS),
+        HumanMessage(content=story_snapshot(story, numbered=True)),
+        edit_request_message(request),
+    ]
+
+
+def edit_messages(story: Dict[str, Any], request: str) -> List[AnyMessage]:
+    """Prompt for a full rewrite of story."""
+    return [
+        SystemMessage(content=EDIT_INSTRUCTIONS),
+        HumanMessage(content=story_snapshot(story)),
+        edit_request_message(request),
+    ]
+
+
+def create_messages(prompt: str, summary: Sequence[AnyMessage], history: Sequence[AnyMessage]) -> List[AnyMessage]:
+    """
+    Prompt for a new story.
+
+    Args:
+        prompt: The story prompt
+        summary: The rolling summary of the trimmed conversation, if any
+        history: The conversation window
+
+    Returns:
+        The instructions, the summary and the conversation, ending with the
+        prompt unless the conversation already does
+    """
+    last = history[-1] if history else None
+    request: List[AnyMessage] = []
+    if not (isinstance(last, HumanMessage) and last.content == prompt):
+        request = [HumanMessage(content=prompt)]
+    return [SystemMessage(content=CREATE_INSTRUCTIONS), *summary, *history, *request]
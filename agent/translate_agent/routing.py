@@ -0,0 +1,297 @@
+"""
+Deadlines, hedged requests and circuit breakers for model calls.
+
+A model call that stalls used to hold the user for as long as the provider
+took. Every registry model is wrapped in a RoutedModel:
+
+- each call has a deadline, after which it fails with TimeoutError;
+- with a fallback model configured, a second request is sent to it once the
+  primary has taken longer than a percentile of its recent latencies, and
+  the first response with a valid tool call wins, the other is cancelled;
+  a primary that fails or answers without the tool call fails over to the
+  fallback right away, and when there is no other request to try, an answer
+  without the tool call is returned as it is, for the node to recover from;
+- each provider has a circuit breaker that opens after consecutive failures,
+  so calls skip a provider that is down until a trial call succeeds.
+
+Only the first request streams to the UI. A hedge or failover request runs
+without the node's callbacks, so its tokens don't mix with the ones already
+streamed, and the story shows up when it completes.
+
+Configured through environment variables:
+
+    STORY_MODEL_DEADLINE      seconds a model call may take, 0 for no deadline (default: 300)
+    STORY_FALLBACK_MODEL      model that hedge and failover requests go to, claude-* models
+                              use Anthropic (default: unset, no hedging)
+    STORY_FALLBACK_BASE_URL   API base URL of the fallback provider (default: the provider's)
+    STORY_HEDGE_PERCENTILE    latency percentile of the primary after which the hedge is sent (default: 95)
+    STORY_HEDGE_DELAY         hedge delay in seconds until enough latencies are recorded (default: 10)
+    STORY_HEDGE_MIN_SAMPLES   latencies recorded before the percentile is used (default: 20)
+    STORY_BREAKER_FAILURES    consecutive failures that open a provider's circuit (default: 5)
+    STORY_BREAKER_RESET       seconds an open circuit waits before a trial call (default: 30)
+"""
+
+import asyncio
+import collections
+import os
+import threading
+import time
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+from langchain_core.runnables import Runnable, RunnableConfig
+
+from translate_agent.admission import call_priority, estimate_tokens, get_scheduler, tenant_of
+from translate_agent.metrics import increment, register_collector
+
+_lock = threading.Lock()
+_breakers: Dict[str, "CircuitBreaker"] = {}
+_stats: Dict[str, int] = {
+    "calls": 0,
+    "primary_wins": 0,
+    "hedges": 0,
+    "hedge_wins": 0,
+    "failovers": 0,
+    "invalid_responses": 0,
+    "deadline_exceeded": 0,
+    "circuit_rejections": 0,
+}
+
+
+def fallback_model() -> Tuple[Optional[str], Optional[str]]:
+    """The fallback model name and base URL, or None when hedging is off."""
+    return os.getenv("STORY_FALLBACK_MODEL") or None, os.getenv("STORY_FALLBACK_BASE_URL") or None
+
+
+def provider_name(model: str, base_url: Optional[str] = None) -> str:
+    """The provider a model is served by, with the host when it has its own base URL."""
+    provider = "anthropic" if model.startswith("claude") else "openai"
+    return f"{provider}@{urlparse(base_url).netloc}" if base_url else provider
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker for one provider.
+
+    Closed, calls go through. After failures consecutive failures it opens and
+    rejects calls for reset seconds, then lets a single trial call through:
+    the circuit closes if it succeeds and opens again if it fails.
+
+    Args:
+        name: The provider name
+        failures: Consecutive failures that open the circuit
+        reset: Seconds before an open circuit allows a trial call
+        clock: Monotonic clock in seconds
+    """
+
+    def __init__(self, name: str, failures: int = 5, reset: float = 30.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.name = name
+        self.failures = failures
+        self.reset = reset
+        self.clock = clock
+        self.state = "closed"
+        self.consecutive = 0
+        self.opened_at = 0.0
+        self.trial = False
+        self.opened = 0
+
+    def allow(self) -> bool:
+        """Whether a call may go to the provider now. A True in the half-open state claims the trial."""
+        if self.state == "open" and self.clock() - self.opened_at >= self.reset:
+            self.state = "half_open"
+            self.trial = False
+        if self.state == "half_open":
+            if self.trial:
+                return False
+            self.trial = True
+            return True
+        return self.state == "closed"
+
+    def success(self) -> None:
+        """Record a successful call."""
+        self.state = "closed"
+        self.consecutive = 0
+        self.trial = False
+
+    def failure(self) -> None:
+        """Record a failed call, opening the circuit when there are too many."""
+        self.consecutive += 1
+        self.trial = False
+        if self.state == "half_open" or self.consecutive >= self.failures:
+            if self.state != "open":
+                self.opened += 1
+                increment("story_routing_circuit_opened_total", provider=self.name)
+            self.state = "open"
+            self.opened_at = self.clock()
+
+    def release(self) -> None:
+        """Forget a call that was cancelled before it finished."""
+        self.trial = False
+
+
+def get_breaker(name: str) -> CircuitBreaker:
+    """Return the process-wide circuit breaker of a provider."""
+    with _lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = _breakers[name] = CircuitBreaker(
+                name,
+                failures=int(os.getenv("STORY_BREAKER_FAILURES", "5")),
+                reset=float(os.getenv("STORY_BREAKER_RESET", "30")),
+            )
+        return breaker
+
+
+def _valid(response: Any, tool_choice: Optional[str]) -> bool:
+    """Whether a response answers with the tool call it was asked for."""
+    if tool_choice is None:
+        return True
+    tool_calls = getattr(response, "tool_calls", None)
+    return bool(tool_calls) and tool_calls[0].get("name") == tool_choice
+
+
+class RoutedModel(Runnable):
+    """
+    A bound chat model with a deadline, an optional hedge model and circuit breakers.
+
+    Only ainvoke is routed, invoke calls the primary directly. ainvoke first
+    waits for admission.get_scheduler() to admit the call, a hedge request is
+    part of the same admitted call.
+
+    Args:
+        primary: The primary model, with the tools bound
+        primary_provider: The primary's provider name, for its circuit breaker
+        fallback: The model hedge and failover requests go to, with the same tools bound
+        fallback_provider: The fallback's provider name
+        tool_choice: Name of the tool the response must call, if any
+    """
+
+    def __init__(self, primary: Runnable, primary_provider: str, fallback: Optional[Runnable] = None,
+                 fallback_provider: Optional[str] = None, tool_choice: Optional[str] = None):
+        self.primary = primary
+        self.primary_provider = primary_provider
+        self.fallback = fallback
+        self.fallback_provider = fallback_provider
+        self.tool_choice = tool_choice
+        self.latencies: Deque[float] = collections.deque(maxlen=200)
+
+    def invoke(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Any:  # pylint: disable=redefined-builtin
+        return self.primary.invoke(input, config, **kwargs)
+
+    def hedge_delay(self) -> float:
+        """Seconds the primary may take before the hedge is sent."""
+        if len(self.latencies) < int(os.getenv("STORY_HEDGE_MIN_SAMPLES", "20")):
+            return float(os.getenv("STORY_HEDGE_DELAY", "10"))
+        ordered = sorted(self.latencies)
+        rank = float(os.getenv("STORY_HEDGE_PERCENTILE", "95")) / 100 * len(ordered)
+        return ordered[min(max(int(rank + 0.5) - 1, 0), len(ordered) - 1)]
+
+    async def ainvoke(self, input: Any, config: Optional[RunnableConfig] = None,  # pylint: disable=redefined-builtin
+                      **kwargs: Any) -> Any:
+        scheduler = get_scheduler()
+        tokens = estimate_tokens(input)
+        await scheduler.acquire(tenant_of(config), tokens, call_priority(self.tool_choice))
+        used = 0
+        try:
+            response = await self._route(input, config, **kwargs)
+            used = (getattr(response, "usage_metadata", None) or {}).get("total_tokens") or tokens
+            return response
+        finally:
+            scheduler.settle(tokens, used)
+
+    async def _route(self, input: Any, config: Optional[RunnableConfig], **kwargs: Any) -> Any:  # pylint: disable=redefined-builtin
+        _stats["calls"] += 1
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        deadline = float(os.getenv("STORY_MODEL_DEADLINE", "300"))
+        deadline_at = started + deadline if deadline > 0 else None
+        # Requests after the first one run without the node callbacks, they would mix streamed tokens
+        quiet = {**(config or {}), "callbacks": None}
+        attempts: Dict["asyncio.Task[Any]", Tuple[str, CircuitBreaker]] = {}
+        errors: List[BaseException] = []
+        invalid: Optional[Any] = None  # The last answer without the tool call
+
+        def start(role: str, model: Runnable, provider: str) -> bool:
+            breaker = get_breaker(provider)
+            if not breaker.allow():
+                _stats["circuit_rejections"] += 1
+                return False
+            task = asyncio.ensure_future(model.ainvoke(input, quiet if attempts or errors else config, **kwargs))
+            attempts[task] = (role, breaker)
+            return True
+
+        start("primary", self.primary, self.primary_provider)
+        hedge_pending = self.fallback is not None and self.fallback_provider is not None
+        hedge_at = started + self.hedge_delay() if attempts else started
+
+        try:
+            while True:
+                now = loop.time()
+                if hedge_pending and (now >= hedge_at or not attempts):
+                    hedge_pending = False
+                    racing = bool(attempts)
+                    if start("fallback", self.fallback, self.fallback_provider):  # type: ignore[arg-type]
+                        _stats["hedges" if racing else "failovers"] += 1
+                if not attempts:
+                    break
+                wakes = [at for at in (deadline_at, hedge_at if hedge_pending else None) if at is not None]
+                wake = min(wakes) if wakes else None
+                done, _ = await asyncio.wait(
+                    attempts, timeout=None if wake is None else max(wake - loop.time(), 0),
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                for task in done:
+                    role, breaker = attempts.pop(task)
+                    if task.exception() is not None:
+                        breaker.failure()
+                        errors.append(task.exception())  # type: ignore[arg-type]
+                        continue
+                    response = task.result()
+                    if not _valid(response, self.tool_choice):
+                        # The provider is up, the answer is only kept in case nothing better comes
+                        breaker.success()
+                        _stats["invalid_responses"] += 1
+                        invalid = response
+                        continue
+                    breaker.success()
+                    if role == "primary":
+                        self.latencies.append(loop.time() - started)
+                        _stats["primary_wins"] += 1
+                    else:
+                        _stats["hedge_wins"] += 1
+                    increment("story_routing_wins_total", role=role)
+                    return response
+                if deadline_at is not None and loop.time() >= deadline_at and attempts:
+                    _stats["deadline_exceeded"] += 1
+                    for _, breaker in attempts.values():
+                        breaker.failure()
+                    # The finally below cancels the calls still running
+                    raise TimeoutError(f"Model call exceeded its {deadline:g}s deadline")
+        finally:
+            for task, (role, breaker) in attempts.items():
+                task.cancel()
+                breaker.release()
+                if role == "primary":
+                    # The primary took at least this long, leaving it out would lower the percentile
+                    self.latencies.append(loop.time() - started)
+
+        if invalid is not None:
+            return invalid
+        if errors:
+            raise errors[-1]
+        raise RuntimeError(f"No model provider available, the circuit of {self.primary_provider} is open")
+
+
+def routing_stats() -> Dict[str, Any]:
+    """Return routing counters and how many provider circuits are open."""
+    with _lock:
+        breakers = dict(_breakers)
+    return {
+        **_stats,
+        "circuits_open": sum(breaker.state == "open" for breaker in breakers.values()),
+        "circuits_opened": sum(breaker.opened for breaker in breakers.values()),
+    }
+
+
+register_collector("story_routing", routing_stats)
@@ -0,0 +1,109 @@
+"""
+Single-flight coordination of identical model calls.
+
+When the UI double-fires a request, or several tabs of one thread resend at
+once, the same model call would run several times in parallel. Calls are
+keyed by their fingerprint; while one is in flight, identical calls wait for
+it and share its response instead of starting their own.
+
+A waiter that is cancelled stops waiting without cancelling the shared call,
+which is only cancelled once nobody is waiting for it any more. The shared
+call runs with the config of the first caller, so only that caller sees the
+streamed story.
+
+Configured through environment variables:
+
+    STORY_SINGLE_FLIGHT  share in-flight calls between identical requests (default: true)
+"""
+
+import asyncio
+import os
+from typing import Any, Awaitable, Callable, Dict, TypeVar
+
+from translate_agent.metrics import register_collector
+
+T = TypeVar("T")
+
+_flights: Dict[asyncio.AbstractEventLoop, Dict[str, "_Flight"]] = {}
+_stats: Dict[str, int] = {
+    "calls": 0,
+    "coalesced": 0,
+    "cancelled_waiters": 0,
+}
+
+
+class _Flight:
+    """A call in flight and the number of callers waiting for it."""
+
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: "asyncio.Task[Any]"):
+        self.task = task
+        self.waiters = 0
+
+
+def _loop_flights(loop: asyncio.AbstractEventLoop) -> Dict[str, _Flight]:
+    """Return the calls in flight on loop."""
+    if loop not in _flights:
+        _flights[loop] = {}
+    return _flights[loop]
+
+
+async def single_flight(key: str, call: Callable[[], Awaitable[T]]) -> T:
+    """
+    Run call, or wait for the identical call already in flight.
+
+    Args:
+        key: The fingerprint of the call
+        call: Makes the call when none is in flight for key
+
+    Returns:
+        The result of the shared call. Its exception is raised in every waiter.
+    """
+    if os.getenv("STORY_SINGLE_FLIGHT", "true").lower() != "true":
+        return await call()
+
+    loop = asyncio.get_running_loop()
+    flights = _loop_flights(loop)
+    flight = flights.get(key)
+    if flight is None:
+        _stats["calls"] += 1
+        flight = flights[key] = _Flight(asyncio.ensure_future(call()))
+        flight.task.add_done_callback(lambda _: _land(loop, key, flight))
+    else:
+        _stats["coalesced"] += 1
+
+    flight.waiters += 1
+    try:
+        return await asyncio.shield(flight.task)
+    except asyncio.CancelledError:
+        if not flight.task.done():
+            _stats["cancelled_waiters"] += 1
+        raise
+    finally:
+        flight.waiters -= 1
+        if flight.waiters == 0 and not flight.task.done():
+            # Nobody is left to use the result
+            flight.task.cancel()
+            _land(loop, key, flight)
+
+
+def _land(loop: asyncio.AbstractEventLoop, key: str, flight: _Flight) -> None:
+    """Forget a finished or abandoned call, so the next caller starts a new one."""
+    flights = _flights.get(loop)
+    if flights is not None and flights.get(key) is flight:
+        del flights[key]
+        if not flights:
+            # A loop with nothing in flight may be closed next, don't keep it alive
+            del _flights[loop]
+
+
+def flight_stats() -> Dict[str, int]:
+    """Return started, coalesced and cancelled call counters."""
+    return {
+        **_stats,
+        "in_flight": sum(len(flights) for flights in list(_flights.values())),
+    }
+
+
+register_collector("story_single_flight", flight_stats)
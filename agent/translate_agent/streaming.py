@@ -0,0 +1,277 @@
+"""
+Progressive story_content updates while a tool call streams.
+
+The story arrives as the JSON arguments of a tool call. Waiting for the whole
+call leaves the panel blank or stale for the entire generation. Instead the
+arguments are parsed incrementally as tokens arrive, and the partial story is
+emitted to CopilotKit at most once per emit interval, so state events don't
+flood the channel. Each emit sends what changed since the state the UI
+already has rather than the whole state, see translate_agent.emission.
+
+Configured through environment variables:
+
+    STORY_STREAM         stream story_content while it is generated (default: true)
+    STORY_EMIT_INTERVAL  shortest time in seconds between two emits (default: 0.1)
+"""
+
+import json
+import os
+import re
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from langchain_core.callbacks import AsyncCallbackHandler, BaseCallbackManager
+from langchain_core.messages import AnyMessage, BaseMessage
+from langchain_core.runnables import Runnable, RunnableConfig
+
+from translate_agent.emission import make_emitter
+from translate_agent.metrics import metrics_enabled, observe, register_collector
+
+# A string can end in the middle of an escape sequence such as \u00e
+_PARTIAL_ESCAPE_RE = re.compile(r'\\(u[0-9a-fA-F]{0,3})?$')
+_STRING_SPECIAL_RE = re.compile(r'["\\]')
+
+_stats: Dict[str, float] = {
+    "streams": 0,
+    "emits": 0,
+    "first_paragraph_seconds_total": 0.0,
+    "first_paragraph_seconds_last": 0.0,
+}
+
+
+class _Container:
+    """An open object or array while scanning."""
+
+    __slots__ = ("kind", "expect", "member_start")
+
+    def __init__(self, kind: str, member_start: int):
+        self.kind = kind
+        # For objects: "key", "colon", "value" or "comma". For arrays: "value" or "comma".
+        self.expect = "key" if kind == "{" else "value"
+        # Where the current member starts, cutting here drops it with its comma
+        self.member_start = member_start
+
+
+class PartialJSON:
+    """
+    Incremental parser for a JSON document that is still arriving.
+
+    feed() only scans the new text, so the cost of a stream is linear in its
+    length. value() closes whatever is still open and returns the parsed
+    prefix: complete members are kept, a string value that is still being
+    written is cut at the last complete character, and a partial key or
+    literal is dropped.
+    """
+
+    def __init__(self):
+        self._chunks: List[str] = []
+        self._length = 0
+        self._stack: List[_Container] = []
+        self._in_string = False
+        self._string_is_key = False
+        self._escape = False
+        self._literal_start: Optional[int] = None
+        self._last: Any = None
+
+    @property
+    def text(self) -> str:
+        """The text fed so far."""
+        if len(self._chunks) > 1:
+            self._chunks = ["".join(self._chunks)]
+        return self._chunks[0] if self._chunks else ""
+
+    def feed(self, chunk: str) -> None:
+        """Scan the next piece of the document."""
+        offset = self._length
+        self._chunks.append(chunk)
+        self._length += len(chunk)
+        i = 0
+        while i < len(chunk):
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                    i += 1
+                    continue
+                match = _STRING_SPECIAL_RE.search(chunk, i)
+                if match is None:
+                    break
+                i = match.start()
+                if chunk[i] == "\\":
+                    self._escape = True
+                else:
+                    self._in_string = False
+                    if self._stack:
+                        self._stack[-1].expect = "colon" if self._string_is_key else "comma"
+                i += 1
+                continue
+
+            char = chunk[i]
+            if self._literal_start is not None:
+                if char.isalnum() or char in ".+-":
+                    i += 1
+                    continue
+                self._literal_start = None
+                if self._stack:
+                    self._stack[-1].expect = "comma"
+
+            if char in " \t\r\n":
+                pass
+            elif char in "{[":
+                self._stack.append(_Container(char, offset + i + 1))
+            elif char in "}]":
+                if self._stack:
+                    self._stack.pop()
+                if self._stack:
+                    self._stack[-1].expect = "comma"
+            elif char == '"':
+                self._in_string = True
+                self._string_is_key = bool(self._stack) and self._stack[-1].expect == "key"
+            elif char == ":":
+                if self._stack:
+                    self._stack[-1].expect = "value"
+            elif char == ",":
+                if self._stack:
+                    top = self._stack[-1]
+                    top.member_start = offset + i
+                    top.expect = "key" if top.kind == "{" else "value"
+            else:
+                self._literal_start = offset + i
+            i += 1
+
+    def value(self) -> Any:
+        """Return the value of the document so far, or the last one that parsed."""
+        text = self.text
+        top = self._stack[-1] if self._stack else None
+        if self._in_string:
+            if self._string_is_key and top is not None:
+                text = text[:top.member_start]
+            else:
+                text = _PARTIAL_ESCAPE_RE.sub("", text) + '"'
+        elif self._literal_start is not None:
+            try:
+                json.loads(text[self._literal_start:])
+            except ValueError:
+                text = text[:top.member_start] if top is not None else ""
+        elif top is not None and top.expect != "comma":
+            text = text[:top.member_start]
+        text += "".join("}" if container.kind == "{" else "]" for container in reversed(self._stack))
+
+        try:
+            self._last = json.loads(text)
+        except ValueError:
+            pass
+        return self._last
+
+
+def streaming_enabled() -> bool:
+    """Whether story_content is streamed while it is generated."""
+    return os.getenv("STORY_STREAM", "true").lower() == "true"
+
+
+class _ToolCallStream(AsyncCallbackHandler):
+    """Callback handler that feeds streamed tool call arguments to a PartialJSON."""
+
+    def __init__(self, config: RunnableConfig, state: Dict[str, Any],
+                 to_update: Callable[[Any], Optional[Dict[str, Any]]]):
+        self.config = config
+        self.base = {key: value for key, value in state.items() if key != "messages"}
+        self.to_update = to_update
+        self.emitter = make_emitter(self.base)
+        self.interval = float(os.getenv("STORY_EMIT_INTERVAL", "0.1"))
+        self.parser = PartialJSON()
+        self.started = time.perf_counter()
+        self.last_emit = 0.0
+        self.dirty = False
+        self.first_paragraph = False
+
+    async def on_llm_new_token(self, token: str, *, chunk: Any = None, **kwargs: Any) -> None:
+        message = getattr(chunk, "message", None)
+        for tool_chunk in getattr(message, "tool_call_chunks", None) or []:
+            if tool_chunk.get("index") in (0, None) and tool_chunk.get("args"):
+                self.parser.feed(tool_chunk["args"])
+                self.dirty = True
+        if self.dirty and time.perf_counter() - self.last_emit >= self.interval:
+            await self.emit()
+
+    async def emit(self) -> None:
+        """Send the state with the partial arguments applied to CopilotKit."""
+        self.dirty = False
+        update = self.to_update(self.parser.value())
+        if not update:
+            return
+        self.last_emit = time.perf_counter()
+        _stats["emits"] += 1
+        story = (update.get("story_content") or {}).get("story") or ""
+        if not self.first_paragraph and "\n\n" in story.strip():
+            self.first_paragraph = True
+            _record_first_paragraph(self.last_emit - self.started)
+        from copilotkit.langgraph import copilotkit_emit_state  # pylint: disable=import-outside-toplevel
+        emitted = {**self.base, **update}
+        if self.emitter is not None:
+            emitted = self.emitter.message(emitted)
+        if metrics_enabled():
+            observe("story_emitted_state_bytes", len(json.dumps(emitted, default=str)))
+        await copilotkit_emit_state(self.config, emitted)
+
+
+async def astream_tool_call(
+    model: Runnable,
+    messages: Sequence[AnyMessage],
+    config: RunnableConfig,
+    state: Dict[str, Any],
+    to_update: Callable[[Any], Optional[Dict[str, Any]]],
+) -> BaseMessage:
+    """
+    Call a model that answers with a tool call and emit partial state as it streams.
+
+    The model streams whenever the graph itself is streamed, as it is under
+    CopilotKit. The tokens are picked up by a callback handler rather than
+    through model.astream(), which re-parses the accumulated arguments on
+    every chunk.
+
+    Args:
+        model: The chat model, with the tool bound
+        messages: The prompt
+        config: The node config, used to emit state to CopilotKit
+        state: The current graph state, the base of every emitted state
+        to_update: Turns the partial tool arguments into a state update,
+            or None when there is nothing worth showing yet
+
+    Returns:
+        The complete response message, the same as ainvoke would return
+    """
+    if not streaming_enabled():
+        return await model.ainvoke(messages, config)
+
+    stream = _ToolCallStream(config, state, to_update)
+    callbacks = config.get("callbacks")
+    if isinstance(callbacks, BaseCallbackManager):
+        callbacks = callbacks.copy()
+        callbacks.add_handler(stream)
+    else:
+        callbacks = [*(callbacks or []), stream]
+
+    _stats["streams"] += 1
+    response = await model.ainvoke(messages, {**config, "callbacks": callbacks})
+    if stream.dirty:
+        await stream.emit()
+    if not stream.first_paragraph:
+        # Nothing was streamed, or the story is a single paragraph
+        _record_first_paragraph(time.perf_counter() - stream.started)
+    return response
+
+
+def _record_first_paragraph(seconds: float) -> None:
+    _stats["first_paragraph_seconds_total"] += seconds
+    _stats["first_paragraph_seconds_last"] = seconds
+
+
+def streaming_stats() -> Dict[str, float]:
+    """Return stream counters, including the mean time to the first visible paragraph."""
+    return {
+        **_stats,
+        "first_paragraph_seconds_mean": _stats["first_paragraph_seconds_total"] / max(_stats["streams"], 1),
+    }
+
+
+register_collector("story_streaming", streaming_stats)
@@ -0,0 +1,594 @@
+"""
+Version history of each thread's story.
+
+Every story the agent writes is recorded as a version of its thread. The
+first version, and every snapshot_interval-th one after it, keeps the whole
+text. The others keep forward and reverse deltas against their parent, built
+from the diff the edit path already computes, so an edit costs about the
+size of the change. Reverting appends a version that shares the text of the
+target, and listing reads metadata only.
+
+Checkpoints refer to stories by version instead of copying them: with
+StoryReferenceSerializer, a story_content or previous_story_content value
+that is in the history, or a StoryContent tool call in the messages, is
+serialized as its digest. The checkpointers always resolve references on
+load, so checkpoints written with STORY_VERSIONS on still load after it is
+turned off; the setting only decides whether new references are written.
+
+Configured through environment variables:
+
+    STORY_VERSIONS                    record versions and checkpoint stories by reference (default: true)
+    STORY_VERSIONS_PATH               SQLite file, unset uses the checkpoint database with the sqlite
+                                      checkpointer and memory otherwise
+    STORY_VERSIONS_SNAPSHOT_INTERVAL  versions between two full copies of the text (default: 16)
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from langchain_core.messages import AIMessage
+from langgraph.checkpoint.serde.base import SerializerProtocol
+
+from translate_agent.metrics import register_collector
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS story_versions (
+    thread_id TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    parent INTEGER,
+    status TEXT NOT NULL,
+    label TEXT NOT NULL,
+    created REAL NOT NULL,
+    digest TEXT NOT NULL,
+    fields TEXT NOT NULL,
+    text_version INTEGER NOT NULL,
+    depth INTEGER NOT NULL,
+    snapshot TEXT,
+    forward TEXT,
+    reverse TEXT,
+    PRIMARY KEY (thread_id, version)
+);
+CREATE INDEX IF NOT EXISTS story_versions_digest ON story_versions (digest);
+"""
+
+# A story in a checkpoint is replaced by {_REFERENCE: digest}
+_REFERENCE = "__story_version__"
+
+_COMMAND_RE = re.compile(
+    r"^\s*(?:(?P<undo>undo)|(?:revert|restore|go back)(?: to)?(?: version)? #?(?P<version>\d+)"
+    r"|(?P<list>(?:list|show)(?: the)? versions))\s*[.!]?\s*$",
+    re.IGNORECASE,
+)
+
+# [start, end, text]: replace [start:end] of the parent's text with text
+Delta = List[List[Any]]
+
+_stats: Dict[str, int] = {
+    "commits": 0,
+    "snapshots": 0,
+    "reverts": 0,
+    "delta_bytes": 0,
+    "snapshot_bytes": 0,
+    "references_written": 0,
+    "references_read": 0,
+    "materialized": 0,
+    "pruned": 0,
+}
+
+
+def versions_enabled() -> bool:
+    """Whether versions are recorded and stories are checkpointed by reference."""
+    return os.getenv("STORY_VERSIONS", "true").lower() == "true"
+
+
+def story_digest(story: Dict[str, Any]) -> str:
+    """Hash a StoryContent, the same for equal stories."""
+    payload = json.dumps(story, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _is_story(value: Any) -> bool:
+    return isinstance(value, dict) and isinstance(value.get("story"), str) and "title" in value
+
+
+def deltas(old_text: str, new_text: str, diff_ops: Sequence[Sequence[Any]]) -> Tuple[Delta, Delta]:
+    """
+    Turn a compact diff into a forward and a reverse delta.
+
+    Args:
+        old_text: The parent's text
+        new_text: The new text
+        diff_ops: Changed runs as returned by diff.compact_diff
+
+    Returns:
+        The delta that turns old_text into new_text, and the one that turns
+        new_text back into old_text
+    """
+    forward = [[i1, i2, new_text[j1:j2]] for _, i1, i2, j1, j2 in diff_ops]
+    reverse = [[j1, j2, old_text[i1:i2]] for _, i1, i2, j1, j2 in diff_ops]
+    return forward, reverse
+
+
+def apply_delta(text: str, delta: Delta) -> str:
+    """Apply a delta to the text it was computed against."""
+    parts = []
+    position = 0
+    for start, end, replacement in delta:
+        parts.append(text[position:start])
+        parts.append(replacement)
+        position = end
+    parts.append(text[position:])
+    return "".join(parts)
+
+
+def _rebuild_text(conn: "sqlite3.Connection | sqlite3.Cursor", thread_id: str, version: int) -> str:
+    """Rebuild the text of a version that has its own text from its last snapshot and the deltas after it."""
+    forwards: List[str] = []
+    while True:
+        parent, snapshot, forward = conn.execute(
+            "SELECT parent, snapshot, forward FROM story_versions WHERE thread_id = ? AND version = ?",
+            (thread_id, version),
+        ).fetchone()
+        if snapshot is not None:
+            break
+        forwards.append(forward)
+        # The parent may be a revert, whose text lives in another version
+        version = conn.execute(
+            "SELECT text_version FROM story_versions WHERE thread_id = ? AND version = ?", (thread_id, parent)
+        ).fetchone()[0]
+    text = snapshot
+    for forward in reversed(forwards):
+        text = apply_delta(text, json.loads(forward))
+    return text
+
+
+def prune_versions(cursor: sqlite3.Cursor, thread_id: str, blobs: Sequence[bytes]) -> int:
+    """
+    Drop the versions of a thread that none of the serialized checkpoints refer to.
+
+    A version is kept when its digest appears in one of blobs, the kept
+    checkpoints and writes of the thread, and so is the newest version,
+    which the next one is numbered after. A kept version whose text is a
+    delta on a dropped version is stored whole instead.
+
+    Args:
+        cursor: A cursor on the history database, in the caller's transaction
+        thread_id: The thread
+        blobs: The serialized checkpoints, metadata and writes that are kept
+
+    Returns:
+        The number of versions dropped
+    """
+    rows = cursor.execute(
+        "SELECT version, parent, digest, text_version, snapshot IS NOT NULL FROM story_versions WHERE thread_id = ?",
+        (thread_id,),
+    ).fetchall()
+    if not rows:
+        return 0
+    referenced = {digest for digest in {row[2] for row in rows} if any(digest.encode() in blob for blob in blobs)}
+    text_versions = {version: text_version for version, _, _, text_version, _ in rows}
+    kept = {version for version, _, digest, _, _ in rows if digest in referenced}
+    kept.add(max(text_versions))
+    # A revert shares the text of another version
+    kept |= {text_versions[version] for version in kept}
+    rebased = [
+        version for version, parent, _, text_version, snapshot in rows
+        if version in kept and version == text_version and not snapshot
+        and text_versions.get(parent) not in kept
+    ]
+    for version in sorted(rebased):
+        cursor.execute(
+            "UPDATE story_versions SET snapshot = ?, forward = NULL, reverse = NULL, depth = 0 "
+            "WHERE thread_id = ? AND version = ?",
+            (_rebuild_text(cursor, thread_id, version), thread_id, version),
+        )
+    dropped = [(thread_id, version) for version in text_versions if version not in kept]
+    cursor.executemany("DELETE FROM story_versions WHERE thread_id = ? AND version = ?", dropped)
+    _stats["pruned"] += len(dropped)
+    return len(dropped)
+
+
+def parse_command(text: str) -> Optional[Tuple[str, Optional[int]]]:
+    """
+    Recognize a version command in a user message.
+
+    Returns:
+        ("undo", None), ("revert", version) or ("list", None), or None when
+        the message is not a version command
+    """
+    match = _COMMAND_RE.match(text or "")
+    if match is None:
+        return None
+    if match.group("undo"):
+        return "undo", None
+    if match.group("version"):
+        return "revert", int(match.group("version"))
+    return "list", None
+
+
+class VersionHistory:
+    """
+    Per-thread story versions in SQLite.
+
+    Args:
+        path: The SQLite database file, ":memory:" to keep the history in this process
+        snapshot_interval: Versions between two full copies of the text, so
+            materializing any version applies at most this many deltas
+        cache_size: Materialized stories kept in memory
+    """
+
+    def __init__(self, path: str = ":memory:", snapshot_interval: int = 16, cache_size: int = 256) -> None:
+        self.path = path
+        self.snapshot_interval = max(snapshot_interval, 1)
+        self.cache_size = cache_size
+        self.lock = threading.RLock()
+        self.stories: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA busy_timeout=5000")
+        if path != ":memory:":
+            self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+
+    def close(self) -> None:
+        """Close the SQLite connection."""
+        with self.lock:
+            self.conn.close()
+
+    def _remember(self, digest: str, story: Dict[str, Any]) -> None:
+        self.stories[digest] = story
+        self.stories.move_to_end(digest)
+        while len(self.stories) > self.cache_size:
+            self.stories.popitem(last=False)
+
+    def _row(self, thread_id: str, version: int) -> Tuple[Any, ...]:
+        row = self.conn.execute(
+            "SELECT parent, text_version, depth, digest, fields FROM story_versions "
+            "WHERE thread_id = ? AND version = ?",
+            (thread_id, version),
+        ).fetchone()
+        if row is None:
+            raise KeyError(f"No version {version} in thread {thread_id}")
+        return row
+
+    def commit(self, thread_id: str, story: Dict[str, Any], parent: Optional[int] = None,
+               parent_story: Optional[Dict[str, Any]] = None,
+               diff_ops: Optional[Sequence[Sequence[Any]]] = None, label: str = "") -> int:
+        """
+        Record a new draft version of a thread's story.
+
+        Args:
+            thread_id: The thread
+            story: The new StoryContent
+            parent: The version it was edited from, None for a new story
+            parent_story: The StoryContent of parent, needed for a delta
+            diff_ops: compact_diff(parent_story["story"], story["story"]),
+                without it the whole text is stored
+            label: A short description, such as the edit request
+
+        Returns:
+            The new version number
+        """
+        digest = story_digest(story)
+        fields = json.dumps({key: value for key, value in story.items() if key != "story"}, ensure_ascii=False)
+        with self.lock:
+            version = self.conn.execute(
+                "SELECT COALESCE(MAX(version), 0) + 1 FROM story_versions WHERE thread_id = ?", (thread_id,)
+            ).fetchone()[0]
+            depth = 0
+            if parent is not None and parent_story is not None and diff_ops is not None:
+                _, _, parent_depth, parent_digest, _ = self._row(thread_id, parent)
+                # The story may have been changed outside the agent, then the delta wouldn't apply
+                if parent_digest == story_digest(parent_story):
+                    depth = parent_depth + 1
+            snapshot = forward = reverse = None
+            if depth == 0 or depth >= self.snapshot_interval:
+                depth = 0
+                snapshot = story["story"]
+                _stats["snapshots"] += 1
+                _stats["snapshot_bytes"] += len(snapshot)
+            else:
+                assert parent_story is not None and diff_ops is not None
+                forward_delta, reverse_delta = deltas(parent_story["story"], story["story"], diff_ops)
+                forward = json.dumps(forward_delta, ensure_ascii=False)
+                reverse = json.dumps(reverse_delta, ensure_ascii=False)
+                _stats["delta_bytes"] += len(forward) + len(reverse)
+            self.conn.execute(
+                "INSERT INTO story_versions (thread_id, version, parent, status, label, created, digest, "
+                "fields, text_version, depth, snapshot, forward, reverse) "
+                "VALUES (?, ?, ?, 'draft', ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (thread_id, version, parent, label[:200], time.time(), digest, fields, version, depth,
+                 snapshot, forward, reverse),
+            )
+            self._remember(digest, story)
+            _stats["commits"] += 1
+            return version
+
+    def set_status(self, thread_id: str, version: int, status: str) -> None:
+        """Mark a version "confirmed" or "cancelled"."""
+        with self.lock:
+            self.conn.execute(
+                "UPDATE story_versions SET status = ? WHERE thread_id = ? AND version = ?",
+                (status, thread_id, version),
+            )
+
+    def revert(self, thread_id: str, target: int, current: Optional[int] = None,
+               current_story: Optional[Dict[str, Any]] = None) -> Tuple[int, Dict[str, Any]]:
+        """
+        Make an earlier version current again.
+
+        The new version shares the target's text, so nothing is copied. Going
+        back one step applies the current version's reverse delta to
+        current_story, without reading the text from its snapshot.
+
+        Args:
+            thread_id: The thread
+            target: The version to go back to
+            current: The current version, the parent of the new one
+            current_story: The StoryContent of current, if at hand
+
+        Returns:
+            The new version number and its StoryContent
+        """
+        with self.lock:
+            _, text_version, depth, digest, fields = self._row(thread_id, target)
+            story = self.stories.get(digest)
+            if story is None and current is not None and current_story is not None:
+                story = self._undo(thread_id, target, current, current_story, fields)
+            version = self.conn.execute(
+                "SELECT MAX(version) + 1 FROM story_versions WHERE thread_id = ?", (thread_id,)
+            ).fetchone()[0]
+            self.conn.execute(
+                "INSERT INTO story_versions (thread_id, version, parent, status, label, created, digest, "
+                "fields, text_version, depth) VALUES (?, ?, ?, 'confirmed', ?, ?, ?, ?, ?, ?)",
+                (thread_id, version, current, f"Reverted to version {target}", time.time(), digest, fields,
+                 text_version, depth),
+            )
+            _stats["reverts"] += 1
+            if story is not None:
+                self._remember(digest, story)
+                return version, dict(story)
+            return version, self.get(thread_id, target)
+
+    def _undo(self, thread_id: str, target: int, current: int, current_story: Dict[str, Any],
+              fields: str) -> Optional[Dict[str, Any]]:
+        """Rebuild target from current_story when current is a delta on top of it, or return None."""
+        parent, text_version, _, digest, _ = self._row(thread_id, current)
+        if parent != target or text_version != current or digest != story_digest(current_story):
+            return None
+        reverse = self.conn.execute(
+            "SELECT reverse FROM story_versions WHERE thread_id = ? AND version = ?", (thread_id, current)
+        ).fetchone()[0]
+        if reverse is None:
+            return None
+        return {**json.loads(fields), "story": apply_delta(current_story["story"], json.loads(reverse))}
+
+    def get(self, thread_id: str, version: int) -> Dict[str, Any]:
+        """Return the StoryContent of a version."""
+        with self.lock:
+            _, text_version, _, digest, fields = self._row(thread_id, version)
+            story = self.stories.get(digest)
+            if story is None:
+                story = {**json.loads(fields), "story": self._text(thread_id, text_version)}
+                self._remember(digest, story)
+                _stats["materialized"] += 1
+            else:
+                self.stories.move_to_end(digest)
+            return dict(story)
+
+    def _text(self, thread_id: str, version: int) -> str:
+        """Rebuild a version's text from its last snapshot and the forward deltas after it."""
+        return _rebuild_text(self.conn, thread_id, version)
+
+    def parent(self, thread_id: str, version: int) -> Optional[int]:
+        """Return the version a version was made from."""
+        with self.lock:
+            return self._row(thread_id, version)[0]
+
+    def find(self, digest: str) -> Optional[Tuple[str, int]]:
+        """Return a (thread_id, version) whose story has this digest."""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT thread_id, version FROM story_versions WHERE digest = ? LIMIT 1", (digest,)
+            ).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def load(self, digest: str) -> Dict[str, Any]:
+        """Return the story with this digest."""
+        with self.lock:
+            story = self.stories.get(digest)
+            if story is not None:
+                self.stories.move_to_end(digest)
+                return dict(story)
+            found = self.find(digest)
+            if found is None:
+                raise KeyError(f"No story version with digest {digest}")
+            return self.get(*found)
+
+    def list(self, thread_id: str) -> List[Dict[str, Any]]:
+        """List a thread's versions, oldest first, without their text."""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT version, parent, status, label, created, fields FROM story_versions "
+                "WHERE thread_id = ? ORDER BY version",
+                (thread_id,),
+            ).fetchall()
+        return [
+            {
+                "version": version,
+                "parent": parent,
+                "status": status,
+                "label": label,
+                "created": created,
+                "title": json.loads(fields).get("title", ""),
+            }
+            for version, parent, status, label, created, fields in rows
+        ]
+
+    def delete_thread(self, thread_id: str) -> None:
+        """Drop every version of a thread."""
+        with self.lock:
+            self.conn.execute("DELETE FROM story_versions WHERE thread_id = ?", (thread_id,))
+
+
+_history: Optional[VersionHistory] = None
+_history_lock = threading.Lock()
+
+
+def get_history() -> VersionHistory:
+    """Return the process-wide version history, creating it on first use."""
+    global _history  # pylint: disable=global-statement
+    with _history_lock:
+        if _history is None:
+            path = os.getenv("STORY_VERSIONS_PATH")
+            if not path and os.getenv("STORY_CHECKPOINTER", "sqlite").lower() == "sqlite":
+                path = os.getenv("STORY_CHECKPOINT_PATH", "checkpoints.sqlite")
+            _history = VersionHistory(
+                path or ":memory:",
+                snapshot_interval=int(os.getenv("STORY_VERSIONS_SNAPSHOT_INTERVAL", "16")),
+            )
+        return _history
+
+
+async def run_history(method: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """Call a VersionHistory method, off the event loop when the history is on disk."""
+    if get_history().path == ":memory:":
+        return method(*args, **kwargs)
+    return await asyncio.to_thread(method, *args, **kwargs)
+
+
+async def record_version(config: Dict[str, Any], story: Dict[str, Any], parent: Optional[int] = None,
+                         parent_story: Optional[Dict[str, Any]] = None,
+                         diff_ops: Optional[Sequence[Sequence[Any]]] = None, label: str = "") -> int:
+    """
+    Commit a draft version of the story to the history of the node's thread.
+
+    Args:
+        config: The node config, which names the thread
+        story: The new StoryContent
+        parent: The version it was edited from, 0 or None for a new story
+        parent_story: The StoryContent it was edited from
+        diff_ops: The compact diff between the two texts
+        label: A short description, such as the edit request
+
+    Returns:
+        The new version number, 0 when versions are off
+    """
+    thread_id = (config.get("configurable") or {}).get("thread_id")
+    if not versions_enabled() or thread_id is None:
+        return 0
+    return await run_history(get_history().commit, str(thread_id), story, parent or None,
+                             parent_story, diff_ops, label)
+
+
+class StoryReferenceSerializer:
+    """
+    Serializer that stores stories found in the version history as references.
+
+    Wraps the checkpointer's serializer. Checkpoints and pending writes are
+    scanned for StoryContent values, in the channel values, the node writes
+    kept in the metadata and the writes themselves, and for AI messages whose
+    tool call arguments are a StoryContent; those whose digest is in the
+    history are written as their digest and restored on load. The raw
+    arguments string a message keeps next to its parsed tool calls is
+    restored from the parsed arguments. References are only written while
+    versions are enabled, and always resolved.
+
+    Args:
+        serde: The serializer to wrap
+    """
+
+    def __init__(self, serde: SerializerProtocol) -> None:
+        self.serde = serde
+
+    def _reference(self, value: Any) -> Any:
+        if isinstance(value, list):
+            return [self._reference_message(item) for item in value]
+        if not _is_story(value):
+            return value
+        history = get_history()
+        digest = story_digest(value)
+        if digest not in history.stories and history.find(digest) is None:
+            return value
+        _stats["references_written"] += 1
+        return {_REFERENCE: digest}
+
+    def _reference_message(self, message: Any) -> Any:
+        if not isinstance(message, AIMessage) or not message.tool_calls:
+            return message
+        tool_calls = [{**call, "args": self._reference(call["args"])} for call in message.tool_calls]
+        referenced = {call["id"] for call in tool_calls if _REFERENCE in call["args"]}
+        if not referenced:
+            return message
+        additional_kwargs = dict(message.additional_kwargs)
+        if isinstance(additional_kwargs.get("tool_calls"), list):
+            additional_kwargs["tool_calls"] = [
+                {**raw, "function": {**raw["function"], "arguments": ""}}
+                if raw.get("id") in referenced and isinstance(raw.get("function"), dict) else raw
+                for raw in additional_kwargs["tool_calls"]
+            ]
+        return message.model_copy(update={"tool_calls": tool_calls, "additional_kwargs": additional_kwargs})
+
+    def _resolve(self, value: Any) -> Any:
+        if isinstance(value, list):
+            return [self._resolve_message(item) for item in value]
+        if isinstance(value, dict) and len(value) == 1 and _REFERENCE in value:
+            _stats["references_read"] += 1
+            return get_history().load(value[_REFERENCE])
+        return value
+
+    def _resolve_message(self, message: Any) -> Any:
+        if not isinstance(message, AIMessage) or not any(_REFERENCE in call["args"] for call in message.tool_calls):
+            return message
+        tool_calls = [{**call, "args": self._resolve(call["args"])} for call in message.tool_calls]
+        arguments = {call["id"]: json.dumps(call["args"], ensure_ascii=False) for call in tool_calls}
+        additional_kwargs = dict(message.additional_kwargs)
+        if isinstance(additional_kwargs.get("tool_calls"), list):
+            additional_kwargs["tool_calls"] = [
+                {**raw, "function": {**raw["function"], "arguments": arguments[raw["id"]]}}
+                if raw.get("id") in arguments and isinstance(raw.get("function"), dict)
+                and not raw["function"].get("arguments") else raw
+                for raw in additional_kwargs["tool_calls"]
+            ]
+        return message.model_copy(update={"tool_calls": tool_calls, "additional_kwargs": additional_kwargs})
+
+    def dumps(self, obj: Any) -> bytes:
+        return self.serde.dumps(obj)
+
+    def loads(self, data: bytes) -> Any:
+        return self.serde.loads(data)
+
+    def _map_values(self, obj: Any, method: Callable[[Any], Any]) -> Any:
+        """Apply method to the channel values of a checkpoint, the node writes in its metadata or a write."""
+        if isinstance(obj, dict) and isinstance(obj.get("channel_values"), dict):
+            return {**obj, "channel_values": {key: method(value) for key, value in obj["channel_values"].items()}}
+        if isinstance(obj, dict) and isinstance(obj.get("writes"), dict):
+            writes = {
+                node: {key: method(value) for key, value in update.items()} if isinstance(update, dict) else update
+                for node, update in obj["writes"].items()
+            }
+            return {**obj, "writes": writes}
+        return method(obj)
+
+    def dumps_typed(self, obj: Any) -> Tuple[str, bytes]:
+        if not versions_enabled():
+            return self.serde.dumps_typed(obj)
+        return self.serde.dumps_typed(self._map_values(obj, self._reference))
+
+    def loads_typed(self, data: Tuple[str, bytes]) -> Any:
+        return self._map_values(self.serde.loads_typed(data), self._resolve)
+
+
+def version_stats() -> Dict[str, int]:
+    """Return commit, snapshot, delta, reference and pruning counters."""
+    return dict(_stats)
+
+
+register_collector("story_versions", version_stats)
@@ -0,0 +1,147 @@
+"""
+Bounded process pool for CPU-heavy post-processing.
+
+Graph nodes run on the event loop, so diffing a long story inline would stall
+every other thread served by the same process. Jobs submitted here run in a
+worker process instead. When the pool is saturated, or a job runs past its
+timeout, the caller's fallback runs inline so the node still gets a result.
+
+Configured through environment variables:
+
+    STORY_WORKER_POOL_SIZE    worker processes, 0 runs jobs inline (default: CPU count)
+    STORY_WORKER_QUEUE_LIMIT  jobs allowed in flight before falling back, timed out ones
+                              included until they finish (default: 4 per worker)
+    STORY_WORKER_TIMEOUT      seconds before a job is abandoned (default: 10)
+"""
+
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import BrokenExecutor, Executor, Future, ProcessPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from translate_agent.metrics import register_collector
+
+
+def _pool_size() -> int:
+    return int(os.getenv("STORY_WORKER_POOL_SIZE", str(os.cpu_count() or 1)))
+
+
+def _queue_limit() -> int:
+    return int(os.getenv("STORY_WORKER_QUEUE_LIMIT", str(max(_pool_size(), 1) * 4)))
+
+
+def _timeout() -> float:
+    return float(os.getenv("STORY_WORKER_TIMEOUT", "10"))
+
+
+_executor: Optional[Executor] = None
+_in_flight = 0  # Jobs submitted and not finished yet, waited for or not
+_lock = threading.Lock()
+_stats: Dict[str, int] = {
+    "submitted": 0,
+    "completed": 0,
+    "failed": 0,
+    "timeouts": 0,
+    "rejected": 0,
+}
+
+
+def _get_executor() -> Optional[Executor]:
+    """Create the shared pool on first use."""
+    global _executor  # pylint: disable=global-statement
+    if _executor is None and _pool_size() > 0:
+        # spawn avoids forking a process that already runs an event loop and threads
+        _executor = ProcessPoolExecutor(
+            max_workers=_pool_size(),
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _executor
+
+
+def _release(_job: Optional["Future[Any]"] = None) -> None:
+    """Free the slot of a job once it has finished, called from the pool's thread."""
+    global _in_flight  # pylint: disable=global-statement
+    with _lock:
+        _in_flight -= 1
+
+
+async def run_in_pool(func: Callable[..., Any], *args: Any,
+                      fallback: Optional[Callable[..., Any]] = None) -> Any:
+    """
+    Run func(*args) in the worker pool without blocking the event loop.
+
+    Args:
+        func: A picklable, module-level function
+        args: Picklable arguments for func
+        fallback: Cheaper function with the same signature, run inline when
+            the pool is saturated or the job times out
+
+    Returns:
+        The result of func, or of fallback when it was used
+    """
+    global _executor, _in_flight  # pylint: disable=global-statement
+    executor = _get_executor()
+    if executor is None:
+        return func(*args)
+
+    with _lock:
+        saturated = _in_flight >= _queue_limit()
+        if not saturated:
+            _in_flight += 1
+    if saturated:
+        _stats["rejected"] += 1
+        if fallback is None:
+            raise RuntimeError("Worker pool is saturated")
+        return fallback(*args)
+
+    _stats["submitted"] += 1
+    job: Optional["Future[Any]"] = None
+    try:
+        job = executor.submit(func, *args)
+        # A job that times out keeps its slot until the worker is done with it
+        job.add_done_callback(_release)
+        result = await asyncio.wait_for(asyncio.wrap_future(job), timeout=_timeout())
+    except asyncio.TimeoutError:
+        # The worker keeps running the job, but nobody waits for it anymore
+        _stats["timeouts"] += 1
+        if fallback is None:
+            raise
+        return fallback(*args)
+    except BrokenExecutor:
+        # A worker died; start a fresh pool on the next job
+        _stats["failed"] += 1
+        _executor = None
+        if fallback is None:
+            raise
+        return fallback(*args)
+    except Exception:
+        _stats["failed"] += 1
+        raise
+    finally:
+        if job is None:
+            _release()  # Never submitted
+    _stats["completed"] += 1
+    return result
+
+
+def pool_stats() -> Dict[str, int]:
+    """Return counters for the worker pool, including the current queue depth."""
+    return {
+        **_stats,
+        "workers": _pool_size(),
+        "queue_depth": _in_flight,
+        "queue_limit": _queue_limit(),
+    }
+
+
+register_collector("story_worker_pool", pool_stats)
+
+
+def shutdown_pool(wait: bool = True) -> None:
+    """Stop the worker processes. A later job starts a new pool."""
+    global _executor  # pylint: disable=global-statement
+    if _executor is not None:
+        _executor.shutdown(wait=wait, cancel_futures=True)
+        _executor = None
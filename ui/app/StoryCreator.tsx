@@ -5,6 +5,8 @@ import { CopilotSidebar } from "@copilotkit/react-ui";
 import { MessageRole, TextMessage } from "@copilotkit/runtime-client-gql";
 import { useState, useEffect } from "react";
 import { AnswerMarkdown } from "../components/AnswerMarkdown";
+import { DiffOp, DiffProgress } from "../components/DiffViewer";
+import { StatePatch, usePatchedState } from "../components/statePatch";
 
 interface StoryCreatorAgentState {
   input: string;
@@ -22,18 +24,23 @@ interface StoryCreatorAgentState {
   } | null;
   pending_confirmation?: boolean;
   is_edit?: boolean;
+  diff_ops?: DiffOp[];
   diff_markup?: string;
+  diff_progress?: DiffProgress;
+  state_patch?: StatePatch;
 }
 
 export function StoryCreator() {
   const {
-    state: storyCreatorAgentState,
+    state: agentState,
     setState: setStoryCreatorAgentState,
     run: runStoryCreatorAgent,
   } = useCoAgent<StoryCreatorAgentState>({
     name: "story_creator_agent",
     initialState: { input: "" },
   });
+  // The story streams as deltas, rebuild the full state from them
+  const storyCreatorAgentState = usePatchedState(agentState);
 
   // Add the LangGraph interrupt handler with styled buttons
   useLangGraphInterrupt({
@@ -109,6 +116,9 @@ export function StoryCreator() {
               <AnswerMarkdown 
                 markdown={storyCreatorAgentState?.story_content?.story} 
                 diffMarkup={storyCreatorAgentState?.diff_markup}
+                diffOps={storyCreatorAgentState?.diff_ops}
+                diffProgress={storyCreatorAgentState?.diff_progress}
+                previousMarkdown={storyCreatorAgentState?.previous_story_content?.story}
                 isEdit={storyCreatorAgentState?.is_edit}
                 pendingConfirmation={storyCreatorAgentState?.pending_confirmation}
               />
@@ -1,11 +1,14 @@
 'use client';
 
 import Markdown from "react-markdown";
-import { DiffViewer } from "./DiffViewer";
+import { DiffViewer, DiffOp, DiffProgress } from "./DiffViewer";
 
 interface AnswerMarkdownProps {
 	markdown: string;
 	diffMarkup?: string;
+	diffOps?: DiffOp[];
+	diffProgress?: DiffProgress;
+	previousMarkdown?: string;
 	isEdit?: boolean;
 	pendingConfirmation?: boolean;
 }
@@ -13,16 +16,25 @@ interface AnswerMarkdownProps {
 export function AnswerMarkdown({ 
 	markdown, 
 	diffMarkup, 
+	diffOps,
+	diffProgress,
+	previousMarkdown,
 	isEdit, 
 	pendingConfirmation 
 }: AnswerMarkdownProps) {
 	if (!markdown) return null;
 	
-	// Show diff markup when in edit mode and awaiting confirmation
-	if (isEdit && pendingConfirmation && diffMarkup) {
+	// Show diff markup when in edit mode and awaiting confirmation, or while the edit streams
+	if (isEdit && (pendingConfirmation || diffProgress) && (diffMarkup || diffOps?.length)) {
 		return (
 			<div className='markdown-wrapper prose max-w-none'>
-				<DiffViewer diffMarkup={diffMarkup} />
+				<DiffViewer
+					diffMarkup={diffMarkup}
+					diffOps={diffOps}
+					oldText={previousMarkdown}
+					newText={markdown}
+					progress={diffProgress}
+				/>
 			</div>
 		);
 	}
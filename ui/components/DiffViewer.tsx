@@ -2,17 +2,71 @@
 
 import React from 'react';
 
+// [op, oldStart, oldEnd, newStart, newEnd] for each changed run,
+// offsets count code points like Python strings do
+export type DiffOp = [string, number, number, number, number];
+
+// [oldOffset, newOffset] up to which the changes are final while an edit streams
+export type DiffProgress = [number, number];
+
 interface DiffViewerProps {
-  diffMarkup: string;
+  diffMarkup?: string;
+  diffOps?: DiffOp[];
+  oldText?: string;
+  newText?: string;
+  progress?: DiffProgress;
+}
+
+const TOKEN_PATTERN = /\S+|\s+/g;
+
+function renderTokens(text: string, className: string, keyPrefix: string) {
+  return (text.match(TOKEN_PATTERN) || []).map((token, index) => (
+    <span key={`${keyPrefix}-${index}`} className={className}>{token}</span>
+  ));
+}
+
+function renderDiffOps(oldText: string, newText: string, diffOps: DiffOp[], progress?: DiffProgress) {
+  const oldChars = Array.from(oldText);
+  const newChars = Array.from(newText);
+  const slice = (chars: string[], start: number, end?: number) => chars.slice(start, end).join("");
+  const nodes: React.ReactNode[] = [];
+  let position = 0;
+  diffOps.forEach(([, oldStart, oldEnd, newStart, newEnd], index) => {
+    // Unchanged text
+    nodes.push(slice(oldChars, position, oldStart));
+    // Deleted text (red) comes before added text (green)
+    nodes.push(...renderTokens(slice(oldChars, oldStart, oldEnd), "deleted", `d${index}`));
+    nodes.push(...renderTokens(slice(newChars, newStart, newEnd), "added", `a${index}`));
+    position = oldEnd;
+  });
+  if (progress) {
+    // The rest of the old story isn't aligned yet, show the text still streaming as is
+    nodes.push(slice(oldChars, position, progress[0]));
+    nodes.push(slice(newChars, progress[1]));
+  } else {
+    nodes.push(slice(oldChars, position));
+  }
+  return nodes;
 }
 
-export function DiffViewer({ diffMarkup }: DiffViewerProps) {
+export function DiffViewer({ diffMarkup, diffOps, oldText, newText, progress }: DiffViewerProps) {
+  // Prefer markup rendered by the agent when it sends it
+  if (diffMarkup) {
+    return (
+      <div className="diff-viewer">
+        <div 
+          dangerouslySetInnerHTML={{ __html: diffMarkup }} 
+          className="diff-content"
+        />
+      </div>
+    );
+  }
+
   return (
     <div className="diff-viewer">
-      <div 
-        dangerouslySetInnerHTML={{ __html: diffMarkup }} 
-        className="diff-content"
-      />
+      <div className="diff-content">
+        {renderDiffOps(oldText || "", newText || "", diffOps || [], progress)}
+      </div>
     </div>
   );
 }
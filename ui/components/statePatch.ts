@@ -0,0 +1,113 @@
+'use client';
+
+import { useRef } from 'react';
+
+// While a story streams the agent sends the large state fields as deltas,
+// see agent/translate_agent/emission.py. Offsets of "splice" count UTF-16
+// code units, like JavaScript strings do.
+export interface PatchOp {
+  op: 'add' | 'replace' | 'remove' | 'append' | 'splice';
+  path: string;
+  value?: any;
+  start?: number;
+  delete?: number;
+}
+
+export interface StatePatch {
+  stream: string;
+  seq: number;
+  base?: number;
+  full?: boolean;
+  ops?: PatchOp[];
+}
+
+// The state keys sent as deltas, DELTA_FIELDS in emission.py
+export const DELTA_FIELDS = [
+  'story_content', 'previous_story_content', 'diff_ops', 'diff_markup', 'story_outline', 'chapters',
+];
+
+type View = Record<string, any>;
+
+function pick(state: View): View {
+  const view: View = {};
+  DELTA_FIELDS.forEach((field) => {
+    if (field in state) view[field] = state[field];
+  });
+  return view;
+}
+
+const unescape = (segment: string) => segment.replace(/~1/g, '/').replace(/~0/g, '~');
+
+// Apply operations, copying the objects on their paths and sharing the rest
+export function applyOps(view: View, ops: PatchOp[]): View {
+  const root: View = { ...view };
+  ops.forEach((op) => {
+    const segments = op.path.split('/').slice(1).map(unescape);
+    const last = segments.pop() as string;
+    let target: any = root;
+    segments.forEach((segment) => {
+      const key = Array.isArray(target) ? Number(segment) : segment;
+      target[key] = Array.isArray(target[key]) ? [...target[key]] : { ...target[key] };
+      target = target[key];
+    });
+    if (Array.isArray(target) && op.op === 'add' && last === '-') {
+      target.push(op.value);
+      return;
+    }
+    const key = Array.isArray(target) ? Number(last) : last;
+    if (op.op === 'remove') {
+      if (Array.isArray(target)) target.splice(key as number, 1);
+      else delete target[key];
+    } else if (op.op === 'append') {
+      target[key] += op.value;
+    } else if (op.op === 'splice') {
+      const text: string = target[key];
+      const start = op.start ?? 0;
+      target[key] = text.slice(0, start) + op.value + text.slice(start + (op.delete ?? 0));
+    } else {
+      target[key] = op.value;
+    }
+  });
+  return root;
+}
+
+interface Tracker {
+  nodeView: View;
+  view: View;
+  stream?: string;
+  seq: number;
+  stale: boolean;
+}
+
+// Rebuild the agent state from the deltas it streams. A delta applies to the
+// previous one of its stream, or to the state of the node when its base is 0;
+// after a missed delta the last good view is kept until the next full state.
+export function usePatchedState<T extends object>(state: T & { state_patch?: StatePatch }): T {
+  const tracker = useRef<Tracker>({ nodeView: {}, view: {}, seq: 0, stale: false });
+  const current = tracker.current;
+  const patch = state.state_patch;
+
+  if (!patch) {
+    current.nodeView = current.view = pick(state);
+    current.stream = undefined;
+    current.seq = 0;
+    current.stale = false;
+  } else if (patch.stream !== current.stream || patch.seq !== current.seq) {
+    if (patch.full) {
+      current.view = pick(state);
+      current.stale = false;
+    } else if (patch.base === 0) {
+      current.view = applyOps(current.nodeView, patch.ops || []);
+      current.stale = false;
+    } else if (!current.stale && patch.stream === current.stream && patch.base === current.seq) {
+      current.view = applyOps(current.view, patch.ops || []);
+    } else {
+      current.stale = true;
+    }
+    current.stream = patch.stream;
+    current.seq = patch.seq;
+  }
+
+  const { state_patch: _, ...rest } = state;
+  return { ...(rest as T), ...current.view };
+}